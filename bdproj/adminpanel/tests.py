@@ -2,6 +2,9 @@ from django.test import TestCase, Client
 from django.urls import reverse
 from rest_framework import status
 
+from auth_users.utils.required import remember_token
+from auth_users.utils.token_cache import token_cache
+
 class AdminUserAPITest(TestCase):
     def setUp(self):
         self.client = Client()
@@ -55,4 +58,21 @@ class AdminUserAPITest(TestCase):
     def test_delete_user_invalid_id(self):
         user_id = 9999  
         response = self.client.delete(self.user_detail_url(user_id))
-        self.assertTrue(response.status_code in [status.HTTP_404_NOT_FOUND, status.HTTP_401_UNAUTHORIZED])
\ No newline at end of file
+        self.assertTrue(response.status_code in [status.HTTP_404_NOT_FOUND, status.HTTP_401_UNAUTHORIZED])
+
+
+class SlowQueriesAPITest(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        remember_token("admin", 1, 1)
+
+    def get(self, limit):
+        return self.client.get(reverse('admin_slow_queries'), {"limit": limit}, HTTP_AUTHORIZATION="Token admin")
+
+    def test_limit_must_be_positive(self):
+        for limit in ("0", "-5", "abc"):
+            response = self.get(limit)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.json(), {"error": "limit must be a positive integer."})
+        self.assertEqual(self.get("1").status_code, status.HTTP_200_OK)
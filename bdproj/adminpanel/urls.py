@@ -29,6 +29,7 @@ urlpatterns = [
 
     path('questions/', QuestionsAPIView.as_view(), name='admin_question'),
     path('questions/<int:question_id>/', QuestionsAPIView.as_view(), name='admin_questuion_detail'),
+    path('questions/<int:question_id>/tags/', QuestionTagsAPIView.as_view(), name='admin_question_tags'),
 
     path('usertest/', UserTestProgressAPIView.as_view(), name='admin_usertest'),
     path('usertest/<int:progress_id>/', UserTestProgressAPIView.as_view(), name='admin_usertest_detail'),
@@ -49,4 +50,10 @@ urlpatterns = [
     path('usermodules/', MaterialsAPIView.as_view(), name='admin_usermodules'),
     path('usermodules/<int:link_id>/', MaterialsAPIView.as_view(), name='admin_usermodules'),
 
+    path('pool/', PoolStatsAPIView.as_view(), name='admin_pool_stats'),
+    path('slowqueries/', SlowQueriesAPIView.as_view(), name='admin_slow_queries'),
+    path('resultcache/', ResultCacheStatsAPIView.as_view(), name='admin_result_cache'),
+    path('hashing/', HashingPoolStatsAPIView.as_view(), name='admin_hashing_pool'),
+    path('cache/', SharedCacheStatsAPIView.as_view(), name='admin_shared_cache'),
+
 ]
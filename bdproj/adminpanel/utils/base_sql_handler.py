@@ -1,17 +1,54 @@
-from django.db import connection
+from core.utils import query as sql_query
 
 class BaseSQLHandler:
     @staticmethod
-    def execute_query(query, params=None, fetchone=False, fetchall=False):
-        """
-        Выполняет SQL-запрос с обработкой исключений.
-        """
-        with connection.cursor() as cursor:
-            try:
-                cursor.execute(query, params or [])
-                if fetchone:
-                    return cursor.fetchone()
-                if fetchall:
-                    return cursor.fetchall()
-            except Exception as e:
-                raise Exception(f"Database error: {e}")
\ No newline at end of file
+    def execute_query(query, params=None, fetchone=False, fetchall=False, mapper=None):
+        """
+        Выполняет SQL-запрос (строку или Statement) с обработкой исключений.
+        """
+        try:
+            return sql_query.execute_query(
+                query, params, fetchone=fetchone, fetchall=fetchall, mapper=mapper
+            )
+        except Exception as e:
+            raise Exception(f"Database error: {e}")
+
+    @staticmethod
+    def stream_query(query, params=None, batch_size=None, mapper=None):
+        """
+        Построчно отдаёт результат запроса, забирая строки с сервера пачками.
+
+        :param query: SQL-запрос (строка или Statement).
+        :param params: Параметры для SQL-запроса.
+        :param batch_size: Количество строк в одной пачке.
+        :param mapper: Mapper для преобразования строк в словари.
+        """
+        try:
+            yield from sql_query.stream_query(
+                query, params, batch_size=batch_size, mapper=mapper
+            )
+        except Exception as e:
+            raise Exception(f"Database error: {e}")
+
+    @staticmethod
+    def execute_many(query, data, page_size=None):
+        """
+        Выполняет SQL-запрос с множеством параметров пачками по page_size.
+        """
+        try:
+            sql_query.execute_many(query, data, page_size=page_size)
+        except Exception as e:
+            raise Exception(f"Database error: {e}")
+
+    @staticmethod
+    def execute_values(query, data, template=None, page_size=None, fetch=False):
+        """
+        Многострочная вставка ("INSERT ... VALUES %s [RETURNING ...]").
+        При fetch=True возвращает строки RETURNING в порядке строк data.
+        """
+        try:
+            return sql_query.execute_values(
+                query, data, template=template, page_size=page_size, fetch=fetch
+            )
+        except Exception as e:
+            raise Exception(f"Database error: {e}")
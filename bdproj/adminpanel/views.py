@@ -1,4 +1,6 @@
-from django.db import connection
+from django.conf import settings
+from django.db import connection, transaction
+from collections import defaultdict
 import os
 import json
 from rest_framework.views import APIView
@@ -8,8 +10,23 @@ from django.core.files.storage import FileSystemStorage
 from django.http import JsonResponse
 from .serializers import UserSerializer, RoleSerializer, LevelSerializer
 from .utils.admin_required import admin_required, isAuthorized
+from auth_users.utils.required import forget_user
 from .utils.base_api import BaseAPIView
 from .utils.base_sql_handler import BaseSQLHandler
+from core.utils.pool import pool_stats
+from core.utils.result_cache import result_cache
+from core.utils.rows import ROW_DICT, Mapper, json_or_none
+from core.utils.slow_queries import top_offenders
+from auth_users.utils.hash_password import hashing_pool
+from auth_users.utils.token_cache import token_cache
+from core.utils.cache import invalidation_bus
+from core.utils.streaming import StreamingJsonResponse
+from userpanel.utils.curriculum import curriculum
+from userpanel.utils.etags import ALL_PROGRESS, progress_versions
+from userpanel.utils.module_tests import bumps_module_tests, module_tests
+
+
+MATERIAL_MAPPER = Mapper(converters={"file_metadata": json_or_none})
 
 
 class AdminUserAPIView(BaseAPIView):
@@ -29,21 +46,13 @@ class AdminUserAPIView(BaseAPIView):
             FROM users u
             WHERE u.id = %s
             """
-            user = BaseSQLHandler.execute_query(query, [user_id], fetchone=True)
+            user = BaseSQLHandler.execute_query(
+                query, [user_id], fetchone=True, mapper=ROW_DICT
+            )
             if not user:
                 return JsonResponse({"detail": "User not found."}, status=404)
 
-            serializer = UserSerializer(
-                {
-                    "id": user[0],
-                    "fio": user[1],
-                    "email": user[2],
-                    "is_active": user[3],
-                    "role_id": user[4],
-                    "level_id": user[5],
-                    "entrance_test": user[6],
-                }
-            )
+            serializer = UserSerializer(user)
             return JsonResponse(serializer.data, status=200)
 
         query = """
@@ -55,21 +64,8 @@ class AdminUserAPIView(BaseAPIView):
         FROM users u
         WHERE u.role_id != (SELECT id FROM roles WHERE name = 'admin'); 
         """
-        users = BaseSQLHandler.execute_query(query, fetchall=True)
-
-        users_data = [
-            {
-                "id": user[0],
-                "fio": user[1],
-                "email": user[2],
-                "is_active": user[3],
-                "role_id": user[4],
-                "level_id": user[5],
-                "entrance_test": user[6],
-            }
-            for user in users
-        ]
-        return JsonResponse(users_data, safe=False, status=200)
+        users = BaseSQLHandler.stream_query(query, mapper=ROW_DICT)
+        return StreamingJsonResponse(users, status=200)
 
     @admin_required
     def post(self, request):
@@ -189,6 +185,10 @@ class AdminUserAPIView(BaseAPIView):
         except Exception as e:
             return JsonResponse({"error": f"Unable to update user: {e}"}, status=400)
 
+        if "role_id" in data:
+            # Роль хранится в кэше токенов вместе с пользователем
+            forget_user(user[0])
+
         serializer = UserSerializer(
             {
                 "id": user[0],
@@ -222,6 +222,8 @@ class AdminUserAPIView(BaseAPIView):
         except Exception as e:
             return JsonResponse({"error": f"Unable to delete user: {e}"}, status=400)
 
+        forget_user(user_id)
+
         return JsonResponse({"detail": "User deleted successfully."}, status=200)
 
 
@@ -510,6 +512,7 @@ class CategoryMaterialAPIView(BaseAPIView):
 
 class BulkModuleAPIView(BaseAPIView):
     @admin_required
+    @bumps_module_tests
     def post(self, request):
         """
         Массовое добавление модулей с темами из JSON-файла.
@@ -521,61 +524,59 @@ class BulkModuleAPIView(BaseAPIView):
                 {"error": "Data should be a list of modules with topics."}, status=400
             )
 
-        created_modules = []
-        try:
-            for module in data:
-                module_name = module.get("name")
-                module_description = module.get("description", "")
-                module_level_id = module.get("level_id")
-
-                # Проверка обязательных полей
-                if not module_name or not module_level_id:
+        # Проверка обязательных полей модулей и тем до записи в базу
+        for module in data:
+            if not module.get("name") or not module.get("level_id"):
+                return JsonResponse(
+                    {"error": f"Module name and level_id are required: {module}"},
+                    status=400,
+                )
+            for topic in module.get("topics", []):
+                if not topic.get("name"):
                     return JsonResponse(
-                        {"error": f"Module name and level_id are required: {module}"},
-                        status=400,
+                        {"error": f"Topic name is required: {topic}"}, status=400
                     )
 
-                # Вставка модуля
+        try:
+            with transaction.atomic():
+                # Вставка всех модулей одним запросом
                 module_query = """
                 INSERT INTO modules (name, description, level_id)
-                VALUES (%s, %s, %s)
+                VALUES %s
                 RETURNING id, name, description, level_id;
                 """
-                created_module = BaseSQLHandler.execute_query(
+                created_module_rows = BaseSQLHandler.execute_values(
                     module_query,
-                    [module_name, module_description, module_level_id],
-                    fetchone=True,
+                    [
+                        (module["name"], module.get("description", ""), module["level_id"])
+                        for module in data
+                    ],
+                    fetch=True,
                 )
 
-                module_id = created_module[0]
-                created_modules.append(
-                    {
-                        "id": created_module[0],
-                        "name": created_module[1],
-                        "description": created_module[2],
-                        "level_id": created_module[3],
-                    }
+                # Добавление тем всех модулей одним запросом
+                topic_query = """
+                INSERT INTO topics (name, description, module_id)
+                VALUES %s;
+                """
+                BaseSQLHandler.execute_values(
+                    topic_query,
+                    [
+                        (topic["name"], topic.get("description", ""), created_module[0])
+                        for module, created_module in zip(data, created_module_rows)
+                        for topic in module.get("topics", [])
+                    ],
                 )
 
-                # Добавление тем, если они указаны
-                topics = module.get("topics", [])
-                for topic in topics:
-                    topic_name = topic.get("name")
-                    topic_description = topic.get("description", "")
-
-                    # Проверка обязательных полей темы
-                    if not topic_name:
-                        return JsonResponse(
-                            {"error": f"Topic name is required: {topic}"}, status=400
-                        )
-
-                    topic_query = """
-                    INSERT INTO topics (name, description, module_id)
-                    VALUES (%s, %s, %s);
-                    """
-                    BaseSQLHandler.execute_query(
-                        topic_query, [topic_name, topic_description, module_id]
-                    )
+            created_modules = [
+                {
+                    "id": created_module[0],
+                    "name": created_module[1],
+                    "description": created_module[2],
+                    "level_id": created_module[3],
+                }
+                for created_module in created_module_rows
+            ]
 
         except Exception as e:
             return self.handle_database_error(
@@ -639,37 +640,22 @@ class ModuleAPIView(BaseAPIView):
             FROM modules AS m
             WHERE m.id = %s;
             """
-            module = BaseSQLHandler.execute_query(query, [module_id], fetchone=True)
+            module = BaseSQLHandler.execute_query(
+                query, [module_id], fetchone=True, mapper=ROW_DICT
+            )
 
             if not module:
                 return JsonResponse({"error": "Module not found."}, status=404)
 
-            return JsonResponse(
-                {
-                    "id": module[0],
-                    "name": module[1],
-                    "description": module[2],
-                    "level_id": module[3],  # Возвращаем level_id
-                },
-                status=200,
-            )
+            return JsonResponse(module, status=200)
 
         query = """
         SELECT m.id, m.name, m.description, m.level_id  
         FROM modules AS m
         ORDER BY m.id;
         """
-        modules = BaseSQLHandler.execute_query(query, fetchall=True)
-        response = [
-            {
-                "id": module[0],
-                "name": module[1],
-                "description": module[2],
-                "level_id": module[3],  # Возвращаем level_id
-            }
-            for module in modules
-        ]
-        return JsonResponse(response, safe=False, status=200)
+        modules = BaseSQLHandler.execute_query(query, fetchall=True, mapper=ROW_DICT)
+        return JsonResponse(modules, safe=False, status=200)
 
     @admin_required
     def put(self, request, module_id=None):
@@ -726,6 +712,7 @@ class ModuleAPIView(BaseAPIView):
         )
 
     @admin_required
+    @bumps_module_tests
     def delete(self, request, module_id=None):
         """
         Удаление модуля по ID.
@@ -741,6 +728,8 @@ class ModuleAPIView(BaseAPIView):
             BaseSQLHandler.execute_query(query, [module_id])
         except Exception as e:
             return self.handle_database_error("Unable to delete module", e)
+        # Прогресс по тестам модуля удалён каскадом
+        progress_versions.bump(ALL_PROGRESS)
 
         return JsonResponse({"detail": "Module deleted successfully."}, status=200)
 
@@ -794,20 +783,14 @@ class TopicAPIView(BaseAPIView):
             LEFT JOIN modules AS m ON t.module_id = m.id
             WHERE t.id = %s;
             """
-            topic = BaseSQLHandler.execute_query(query, [topic_id], fetchone=True)
+            topic = BaseSQLHandler.execute_query(
+                query, [topic_id], fetchone=True, mapper=ROW_DICT
+            )
 
             if not topic:
                 return JsonResponse({"error": "Topic not found."}, status=404)
 
-            return JsonResponse(
-                {
-                    "id": topic[0],
-                    "name": topic[1],
-                    "description": topic[2],
-                    "module_name": topic[3],
-                },
-                status=200,
-            )
+            return JsonResponse(topic, status=200)
 
         query = """
         SELECT t.id, t.name, t.description, m.name AS module_name 
@@ -815,19 +798,11 @@ class TopicAPIView(BaseAPIView):
         LEFT JOIN modules AS m ON t.module_id = m.id
         ORDER BY t.id;
         """
-        topics = BaseSQLHandler.execute_query(query, fetchall=True)
-        response = [
-            {
-                "id": topic[0],
-                "name": topic[1],
-                "description": topic[2],
-                "module_name": topic[3],
-            }
-            for topic in topics
-        ]
-        return JsonResponse(response, safe=False, status=200)
+        topics = BaseSQLHandler.stream_query(query, mapper=ROW_DICT)
+        return StreamingJsonResponse(topics, status=200)
 
     @admin_required
+    @bumps_module_tests
     def put(self, request, topic_id=None):
         """
         Обновление информации о теме по ID.
@@ -882,6 +857,7 @@ class TopicAPIView(BaseAPIView):
         )
 
     @admin_required
+    @bumps_module_tests
     def delete(self, request, topic_id=None):
         """
         Удаление темы по ID.
@@ -903,6 +879,7 @@ class TopicAPIView(BaseAPIView):
 
 class TestAPIView(BaseAPIView):
     @admin_required
+    @bumps_module_tests
     def post(self, request):
         """
         Создание нового теста.
@@ -967,6 +944,7 @@ class TestAPIView(BaseAPIView):
 
 
     @admin_required
+    @bumps_module_tests
     def put(self, request, test_id=None):
         """
         Обновление информации о тесте по ID.
@@ -1023,6 +1001,7 @@ class TestAPIView(BaseAPIView):
         )
 
     @admin_required
+    @bumps_module_tests
     def delete(self, request, test_id=None):
         """
         Удаление теста по ID.
@@ -1038,12 +1017,15 @@ class TestAPIView(BaseAPIView):
             BaseSQLHandler.execute_query(query, [test_id])
         except Exception as e:
             return self.handle_database_error("Unable to delete test", e)
+        # Прогресс по тесту удалён каскадом
+        progress_versions.bump(ALL_PROGRESS)
 
         return JsonResponse({"detail": "Test deleted successfully."}, status=200)
 
 
 class ModuleTestQuestionsAPIView(BaseAPIView):
     @admin_required
+    @bumps_module_tests
     def post(self, request):
         """
         Создание теста с вопросами для указанного модуля.
@@ -1056,6 +1038,9 @@ class ModuleTestQuestionsAPIView(BaseAPIView):
         if not module_id or not test_name:
             return JsonResponse({"error": "module_id and test_name are required"}, status=400)
 
+        if any(not question.get("question_text") for question in questions):
+            return JsonResponse({"error": "Each question must have 'question_text'"}, status=400)
+
         try:
             # Проверяем, существует ли модуль
             module_check_query = "SELECT id FROM modules WHERE id = %s;"
@@ -1063,90 +1048,105 @@ class ModuleTestQuestionsAPIView(BaseAPIView):
             if not module_exists:
                 return JsonResponse({"error": "Module not found"}, status=404)
 
-            # Создаём тест
-            create_test_query = """
-            INSERT INTO tests (name, module_id)
-            VALUES (%s, %s)
-            RETURNING id, name, module_id;
-            """
-            created_test = BaseSQLHandler.execute_query(
-                create_test_query, [test_name, module_id], fetchone=True
-            )
-            test_id = created_test[0]
-
-            print("Test create")
-
-            created_questions = []
-
-            # Обрабатываем каждый вопрос
-            for question in questions:
-                question_text = question.get("question_text")
-                topic_id = question.get("topic_id")
-                options = question.get("options", [])
-                if not question_text:
-                    return JsonResponse({"error": "Each question must have 'question_text'"}, status=400)
+            # Тест, вопросы и варианты создаются в одной транзакции,
+            # каждая таблица заполняется одним многострочным INSERT
+            with transaction.atomic():
+                # Создаём тест
+                create_test_query = """
+                INSERT INTO tests (name, module_id)
+                VALUES (%s, %s)
+                RETURNING id, name, module_id;
+                """
+                created_test = BaseSQLHandler.execute_query(
+                    create_test_query, [test_name, module_id], fetchone=True
+                )
+                test_id = created_test[0]
 
-                # Создаём вопрос
-                create_question_query = """
+                # Создаём вопросы (RETURNING возвращает строки в порядке вставки)
+                create_questions_query = """
                 INSERT INTO questions (name, topic_id, correct_answer_id)
-                VALUES (%s, %s, NULL)
+                VALUES %s
                 RETURNING id, name;
                 """
-                created_question = BaseSQLHandler.execute_query(
-                    create_question_query,
-                    [question_text, topic_id],
-                    fetchone=True
+                created_question_rows = BaseSQLHandler.execute_values(
+                    create_questions_query,
+                    [(question["question_text"], question.get("topic_id")) for question in questions],
+                    template="(%s, %s, NULL)",
+                    fetch=True,
                 )
 
-                question_id = created_question[0]
-
-                # Связываем вопрос с тестом
-                link_test_question_query = """
+                # Связываем вопросы с тестом
+                link_test_questions_query = """
                 INSERT INTO testsquestions (test_id, question_id)
-                VALUES (%s, %s);
+                VALUES %s;
                 """
-                BaseSQLHandler.execute_query(link_test_question_query, [test_id, question_id])
+                BaseSQLHandler.execute_values(
+                    link_test_questions_query,
+                    [(test_id, row[0]) for row in created_question_rows],
+                )
+
+                # Собираем варианты ответа всех вопросов: (question_id, value, is_correct)
+                options_data = []
+                for question, question_row in zip(questions, created_question_rows):
+                    for option in question.get("options", []):
+                        value = option.get("value")
+                        if not value:
+                            continue
+                        options_data.append((question_row[0], value, option.get("is_correct", False)))
 
                 # Создаём варианты ответа
-                created_options = []
-                for option in options:
-                    value = option.get("value")
-                    is_correct = option.get("is_correct", False)
-
-                    if not value:
-                        continue
-
-                    create_option_query = """
-                    INSERT INTO optionss (value)
-                    VALUES (%s)
-                    RETURNING id, value;
-                    """
-                    created_option = BaseSQLHandler.execute_query(create_option_query, [value], fetchone=True)
-
-                    option_id = created_option[0]
-                    created_options.append({"id": option_id, "value": created_option[1], "is_correct": is_correct})
-
-                    # Связываем вопрос с вариантом
-                    create_question_option_query = """
-                    INSERT INTO questionoptions (question_id, option_id)
-                    VALUES (%s, %s);
-                    """
-                    BaseSQLHandler.execute_query(create_question_option_query, [question_id, option_id])
-
-                    # Если вариант правильный, обновляем поле correct_answer_id
+                create_options_query = """
+                INSERT INTO optionss (value)
+                VALUES %s
+                RETURNING id, value;
+                """
+                created_option_rows = BaseSQLHandler.execute_values(
+                    create_options_query,
+                    [(value,) for _, value, _ in options_data],
+                    fetch=True,
+                )
+
+                # Связываем вопросы с вариантами
+                create_question_options_query = """
+                INSERT INTO questionoptions (question_id, option_id)
+                VALUES %s;
+                """
+                BaseSQLHandler.execute_values(
+                    create_question_options_query,
+                    [
+                        (question_id, option_row[0])
+                        for (question_id, _, _), option_row in zip(options_data, created_option_rows)
+                    ],
+                )
+
+                # Проставляем correct_answer_id (если правильных несколько — последний)
+                correct_answers = {}
+                options_by_question = defaultdict(list)
+                for (question_id, _, is_correct), option_row in zip(options_data, created_option_rows):
+                    options_by_question[question_id].append(
+                        {"id": option_row[0], "value": option_row[1], "is_correct": is_correct}
+                    )
                     if is_correct:
-                        update_correct_answer_query = """
-                        UPDATE questions
-                        SET correct_answer_id = %s
-                        WHERE id = %s;
-                        """
-                        BaseSQLHandler.execute_query(update_correct_answer_query, [option_id, question_id])
-
-                created_questions.append({
-                    "id": question_id,
-                    "name": created_question[1],
-                    "options": created_options
-                })
+                        correct_answers[question_id] = option_row[0]
+
+                update_correct_answers_query = """
+                UPDATE questions AS q
+                SET correct_answer_id = v.option_id
+                FROM (VALUES %s) AS v (question_id, option_id)
+                WHERE q.id = v.question_id;
+                """
+                BaseSQLHandler.execute_values(
+                    update_correct_answers_query, list(correct_answers.items())
+                )
+
+            created_questions = [
+                {
+                    "id": question_row[0],
+                    "name": question_row[1],
+                    "options": options_by_question[question_row[0]],
+                }
+                for question_row in created_question_rows
+            ]
 
             return JsonResponse({
                 "test": {
@@ -1193,6 +1193,7 @@ class UserTestProgressAPIView(BaseAPIView):
             )
         except Exception as e:
             return self.handle_database_error("Unable to update test progress", e)
+        progress_versions.bump(progress[1])
 
         return JsonResponse(
             {
@@ -1219,21 +1220,13 @@ class UserTestProgressAPIView(BaseAPIView):
             JOIN tests AS t ON utp.test_id = t.id
             WHERE utp.id = %s;
             """
-            progress = BaseSQLHandler.execute_query(query, [progress_id], fetchone=True)
+            progress = BaseSQLHandler.execute_query(
+                query, [progress_id], fetchone=True, mapper=ROW_DICT
+            )
             if not progress:
                 return JsonResponse({"error": "Test progress not found."}, status=404)
 
-            return JsonResponse(
-                {
-                    "id": progress[0],
-                    "user_name": progress[1],
-                    "test_name": progress[2],
-                    "is_passed": progress[3],
-                    "attempts": progress[4],
-                    "correct_answers": progress[5],
-                },
-                status=200,
-            )
+            return JsonResponse(progress, status=200)
 
         query = """
         SELECT utp.id, u.fio AS user_name, t.name AS test_name, utp.is_passed, utp.attempts, utp.correct_answers
@@ -1241,19 +1234,8 @@ class UserTestProgressAPIView(BaseAPIView):
         JOIN users AS u ON utp.user_id = u.id
         JOIN tests AS t ON utp.test_id = t.id;
         """
-        progresses = BaseSQLHandler.execute_query(query, fetchall=True)
-        response = [
-            {
-                "id": progress[0],
-                "user_name": progress[1],
-                "test_name": progress[2],
-                "is_passed": progress[3],
-                "attempts": progress[4],
-                "correct_answers": progress[5],
-            }
-            for progress in progresses
-        ]
-        return JsonResponse(response, safe=False, status=200)
+        progresses = BaseSQLHandler.stream_query(query, mapper=ROW_DICT)
+        return StreamingJsonResponse(progresses, status=200)
 
     @admin_required
     def put(self, request, progress_id=None):
@@ -1299,6 +1281,7 @@ class UserTestProgressAPIView(BaseAPIView):
             )
         except Exception as e:
             return self.handle_database_error("Unable to update test progress", e)
+        progress_versions.bump(updated_progress[1])
 
         return JsonResponse(
             {
@@ -1325,17 +1308,20 @@ class UserTestProgressAPIView(BaseAPIView):
         if not self.get_object_by_id("usertestprogress", progress_id):
             return JsonResponse({"error": "Progress not found."}, status=404)
 
-        query = "DELETE FROM usertestprogress WHERE id = %s;"
+        query = "DELETE FROM usertestprogress WHERE id = %s RETURNING user_id;"
         try:
-            BaseSQLHandler.execute_query(query, [progress_id])
+            progress = BaseSQLHandler.execute_query(query, [progress_id], fetchone=True)
         except Exception as e:
             return self.handle_database_error("Unable to delete test progress", e)
+        if progress:
+            progress_versions.bump(progress[0])
 
         return JsonResponse({"detail": "Progress deleted successfully."}, status=200)
 
 
 class QuestionsAPIView(BaseAPIView):
     @admin_required
+    @bumps_module_tests
     def post(self, request):
         """
         Создание нового вопроса.
@@ -1405,6 +1391,7 @@ class QuestionsAPIView(BaseAPIView):
         return JsonResponse(response, safe=False, status=200)
 
     @admin_required
+    @bumps_module_tests
     def put(self, request, question_id=None):
         """
         Обновление информации о вопросе по ID.
@@ -1460,6 +1447,7 @@ class QuestionsAPIView(BaseAPIView):
         )
 
     @admin_required
+    @bumps_module_tests
     def delete(self, request, question_id=None):
         """
         Удаление вопроса по ID.
@@ -1481,8 +1469,49 @@ class QuestionsAPIView(BaseAPIView):
         return JsonResponse({"detail": "Question deleted successfully."}, status=200)
 
 
+class QuestionTagsAPIView(BaseAPIView):
+    @admin_required
+    def get(self, request, question_id):
+        """
+        Метки вопроса (источник вопросов вступительного теста "tag:<метка>").
+        """
+        if not self.get_object_by_id("questions", question_id):
+            return JsonResponse({"error": "Question not found."}, status=404)
+
+        query = "SELECT tag FROM questiontags WHERE question_id = %s ORDER BY tag;"
+        tags = BaseSQLHandler.execute_query(query, [question_id], fetchall=True)
+        return JsonResponse({"question_id": question_id, "tags": [tag[0] for tag in tags]}, status=200)
+
+    @admin_required
+    def put(self, request, question_id):
+        """
+        Замена меток вопроса.
+        """
+        tags = request.data.get("tags")
+        if not isinstance(tags, list) or not all(isinstance(tag, str) and tag for tag in tags):
+            return JsonResponse({"error": "Field 'tags' must be a list of non-empty strings."}, status=400)
+
+        if not self.get_object_by_id("questions", question_id):
+            return JsonResponse({"error": "Question not found."}, status=404)
+
+        tags = sorted(set(tags))
+        try:
+            with transaction.atomic():
+                BaseSQLHandler.execute_query("DELETE FROM questiontags WHERE question_id = %s;", [question_id])
+                if tags:
+                    BaseSQLHandler.execute_values(
+                        "INSERT INTO questiontags (tag, question_id) VALUES %s;",
+                        [(tag, question_id) for tag in tags],
+                    )
+        except Exception as e:
+            return self.handle_database_error("Unable to update question tags", e)
+
+        return JsonResponse({"question_id": question_id, "tags": tags}, status=200)
+
+
 class OptionsAPIView(BaseAPIView):
     @admin_required
+    @bumps_module_tests
     def post(self, request):
         """
         Создание нового варианта ответа.
@@ -1520,6 +1549,7 @@ class OptionsAPIView(BaseAPIView):
         return JsonResponse(response, safe=False, status=200)
 
     @admin_required
+    @bumps_module_tests
     def put(self, request, option_id=None):
         """
         Обновление варианта ответа по ID.
@@ -1545,6 +1575,7 @@ class OptionsAPIView(BaseAPIView):
         )
 
     @admin_required
+    @bumps_module_tests
     def delete(self, request, option_id=None):
         """
         Удаление варианта ответа по ID.
@@ -1566,6 +1597,7 @@ class OptionsAPIView(BaseAPIView):
 
 class TestsQuestionsAPIView(BaseAPIView):
     @admin_required
+    @bumps_module_tests
     def post(self, request):
         """
         Связывание вопроса с тестом.
@@ -1665,6 +1697,7 @@ class TestsQuestionsAPIView(BaseAPIView):
 
 
     @admin_required
+    @bumps_module_tests
     def put(self, request, link_id=None):
         """
         Обновление связи вопроса с тестом по ID.
@@ -1713,6 +1746,7 @@ class TestsQuestionsAPIView(BaseAPIView):
         )
 
     @admin_required
+    @bumps_module_tests
     def delete(self, request, test_id=None):
         """
         Удаление связи вопроса с тестом по ID.
@@ -1736,6 +1770,7 @@ class TestsQuestionsAPIView(BaseAPIView):
 
 class QuestionOptionsAPIView(BaseAPIView):
     @admin_required
+    @bumps_module_tests
     def post(self, request):
         """
         Связывание варианта ответа с вопросом.
@@ -1794,6 +1829,7 @@ class QuestionOptionsAPIView(BaseAPIView):
         return JsonResponse(response, safe=False, status=200)
 
     @admin_required
+    @bumps_module_tests
     def put(self, request, link_id=None):
         """
         Обновление связи варианта ответа с вопросом.
@@ -1842,6 +1878,7 @@ class QuestionOptionsAPIView(BaseAPIView):
         )
 
     @admin_required
+    @bumps_module_tests
     def delete(self, request, link_id=None):
         """
         Удаление связи варианта ответа с вопросом по ID.
@@ -1904,21 +1941,12 @@ class MaterialsAPIView(BaseAPIView):
                     metadata,
                 ],
                 fetchone=True,
+                mapper=MATERIAL_MAPPER,
             )
         except Exception as e:
             return self.handle_database_error("Unable to create material", e)
 
-        return JsonResponse(
-            {
-                "id": material[0],
-                "topic_id": material[1],
-                "categorymaterials_id": material[2],
-                "content": material[3],
-                "file_url": material[4],
-                "file_metadata": json.loads(material[5]) if material[5] else None,
-            },
-            status=201,
-        )
+        return JsonResponse(material, status=201)
 
 
     def get(self, request, material_id=None):
@@ -1931,39 +1959,20 @@ class MaterialsAPIView(BaseAPIView):
             FROM materials
             WHERE id = %s;
             """
-            material = BaseSQLHandler.execute_query(query, [material_id], fetchone=True)
+            material = BaseSQLHandler.execute_query(
+                query, [material_id], fetchone=True, mapper=MATERIAL_MAPPER
+            )
             if not material:
                 return JsonResponse({"error": "Material not found."}, status=404)
 
-            return JsonResponse(
-                {
-                    "id": material[0],
-                    "topic_id": material[1],
-                    "categorymaterials_id": material[2],
-                    "content": material[3],
-                    "file_url": material[4],
-                    "file_metadata": json.loads(material[5]) if material[5] else None,
-                },
-                status=200,
-            )
+            return JsonResponse(material, status=200)
 
         query = """
         SELECT id, topic_id, categorymaterials_id, content, file_url, file_metadata
         FROM materials;
         """
-        materials = BaseSQLHandler.execute_query(query, fetchall=True)
-        response = [
-            {
-                "id": material[0],
-                "topic_id": material[1],
-                "categorymaterials_id": material[2],
-                "content": material[3],
-                "file_url": material[4],
-                "file_metadata": json.loads(material[5]) if material[5] else None,
-            }
-            for material in materials
-        ]
-        return JsonResponse(response, safe=False, status=200)
+        materials = BaseSQLHandler.stream_query(query, mapper=MATERIAL_MAPPER)
+        return StreamingJsonResponse(materials, status=200)
 
     @admin_required
     def put(self, request, material_id=None):
@@ -2029,24 +2038,12 @@ class MaterialsAPIView(BaseAPIView):
 
         try:
             updated_material = BaseSQLHandler.execute_query(
-                query, values, fetchone=True
+                query, values, fetchone=True, mapper=MATERIAL_MAPPER
             )
         except Exception as e:
             return self.handle_database_error("Unable to update material", e)
 
-        return JsonResponse(
-            {
-                "id": updated_material[0],
-                "topic_id": updated_material[1],
-                "categorymaterials_id": updated_material[2],
-                "content": updated_material[3],
-                "file_url": updated_material[4],
-                "file_metadata": (
-                    json.loads(updated_material[5]) if updated_material[5] else None
-                ),
-            },
-            status=200,
-        )
+        return JsonResponse(updated_material, status=200)
 
     @admin_required
     def delete(self, request, material_id=None):
@@ -2090,6 +2087,7 @@ class UsersModulesAPIView(BaseAPIView):
             )
         except Exception as e:
             return self.handle_database_error("Unable to link user and module", e)
+        curriculum.invalidate_user(user_module[1])
 
         return JsonResponse(
             {
@@ -2146,10 +2144,72 @@ class UsersModulesAPIView(BaseAPIView):
         if not self.get_object_by_id("usersmodules", link_id):
             return JsonResponse({"error": "Link not found."}, status=404)
 
-        query = "DELETE FROM usersmodules WHERE id = %s;"
+        query = "DELETE FROM usersmodules WHERE id = %s RETURNING user_id;"
         try:
-            BaseSQLHandler.execute_query(query, [link_id])
+            link = BaseSQLHandler.execute_query(query, [link_id], fetchone=True)
         except Exception as e:
             return self.handle_database_error("Unable to delete link", e)
+        if link:
+            curriculum.invalidate_user(link[0])
 
         return JsonResponse({"detail": "Link deleted successfully."}, status=200)
+
+
+class PoolStatsAPIView(APIView):
+    @admin_required
+    def get(self, request):
+        """
+        Статистика пулов соединений с базой данных.
+        """
+        return JsonResponse(pool_stats(), status=200)
+
+
+class SlowQueriesAPIView(APIView):
+    @admin_required
+    def get(self, request):
+        """
+        Самые медленные запросы из журнала: сортировка по суммарному времени.
+        Параметр ?limit= ограничивает количество записей (по умолчанию 20).
+        """
+        try:
+            limit = int(request.GET.get("limit", 20))
+            if limit < 1:
+                raise ValueError
+        except ValueError:
+            return JsonResponse({"error": "limit must be a positive integer."}, status=400)
+
+        return JsonResponse({"queries": top_offenders(limit)}, status=200)
+
+
+class ResultCacheStatsAPIView(APIView):
+    @admin_required
+    def get(self, request):
+        """
+        Счётчики кэша результатов справочных запросов.
+        """
+        return JsonResponse(result_cache.stats(), status=200)
+
+
+class HashingPoolStatsAPIView(APIView):
+    @admin_required
+    def get(self, request):
+        """
+        Метрики пула хэширования паролей: очередь, отказы, время ожидания.
+        """
+        return JsonResponse(hashing_pool.stats(), status=200)
+
+
+class SharedCacheStatsAPIView(APIView):
+    @admin_required
+    def get(self, request):
+        """
+        Общий кэш: бэкенд, сбросы между процессами, счётчики кэша токенов,
+        кэша модулей пользователей и готовых тестов модулей.
+        """
+        return JsonResponse({
+            "backend": settings.CACHES["default"]["BACKEND"],
+            "invalidation": invalidation_bus.stats(),
+            "token_cache": token_cache.stats(),
+            "curriculum": curriculum.stats(),
+            "module_tests": module_tests.stats(),
+        }, status=200)
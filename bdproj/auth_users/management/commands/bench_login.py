@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from auth_users.utils.hash_password import hash_password
+from core.utils.bench import count_queries, format_summary, run_benchmark
+from core.utils.query import execute_query
+
+
+BENCH_EMAIL = "bench-login@example.com"
+BENCH_PASSWORD = "bench-login-password"
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный замер входа (POST /api/auth/login/): время ответа, "
+        "пропускная способность и число SQL-запросов на один вход."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--email", help="Существующий пользователь; по умолчанию создаётся временный.")
+        parser.add_argument("--password")
+
+    def handle(self, *args, **options):
+        email, password = options["email"], options["password"]
+        if bool(email) != bool(password):
+            raise CommandError("--email and --password must be given together.")
+
+        temporary = email is None
+        if temporary:
+            email, password = BENCH_EMAIL, BENCH_PASSWORD
+            execute_query(
+                """
+                INSERT INTO users (fio, email, password) VALUES ('Benchmark', %s, %s)
+                ON CONFLICT (email) DO UPDATE SET password = EXCLUDED.password
+                """,
+                [email, hash_password(password)],
+            )
+
+        client = Client()
+        payload = {"email": email, "password": password}
+
+        def login():
+            response = client.post("/api/auth/login/", payload, content_type="application/json")
+            if response.status_code != 200:
+                raise CommandError(f"Login failed with status {response.status_code}.")
+
+        try:
+            login()
+            self.stdout.write(f"SQL queries per login: {count_queries(login)}")
+            for concurrency in sorted({1, options["concurrency"]}):
+                summary = run_benchmark(login, requests=options["requests"], concurrency=concurrency)
+                self.stdout.write(format_summary(f"login x{concurrency}", summary))
+        finally:
+            if temporary:
+                execute_query("DELETE FROM users WHERE email = %s", [email])
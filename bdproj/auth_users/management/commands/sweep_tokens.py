@@ -0,0 +1,76 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.utils.query import execute_query
+
+
+# Пачка истёкших токенов; SKIP LOCKED — не ждать строки, которые сейчас
+# обновляет вход или запись времени использования
+SWEEP_TOKENS_QUERY = """
+    DELETE FROM usertoken
+    WHERE id IN (
+        SELECT id FROM usertoken
+        WHERE expires_at < now()
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING 1
+"""
+
+# Отзывы подписанных токенов, которые уже истекли сами
+SWEEP_REVOCATIONS_QUERY = """
+    DELETE FROM tokenrevocations
+    WHERE user_id IN (
+        SELECT user_id FROM tokenrevocations
+        WHERE revoked_before < %s
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING 1
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет истёкшие токены (usertoken) и устаревшие отзывы подписанных "
+        "токенов пачками, чтобы таблица и её индексы оставались небольшими."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", type=int, default=getattr(settings, "TOKEN_SWEEP_CHUNK_SIZE", 1000)
+        )
+        parser.add_argument("--pause", type=float, default=0.1, help="Пауза между пачками, секунд.")
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Повторять очистку каждые N секунд (0 — выполнить один раз).",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            tokens = self.sweep(SWEEP_TOKENS_QUERY, lambda: [options["chunk_size"]], options)
+            revoked_before = int((time.time() - getattr(settings, "SIGNED_TOKEN_TTL", 12 * 3600)) * 1000)
+            revocations = self.sweep(
+                SWEEP_REVOCATIONS_QUERY, lambda: [revoked_before, options["chunk_size"]], options
+            )
+            self.stdout.write(f"Deleted {tokens} expired tokens and {revocations} stale revocations.")
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
+
+    def sweep(self, query, params, options):
+        """
+        Удаляет пачками (каждая — отдельная короткая транзакция), пока
+        очередная пачка не окажется неполной.
+        """
+        total = 0
+        while True:
+            deleted = len(execute_query(query, params(), fetchall=True))
+            total += deleted
+            if deleted < options["chunk_size"]:
+                return total
+            time.sleep(options["pause"])
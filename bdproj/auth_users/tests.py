@@ -1,7 +1,21 @@
-from django.test import TestCase, Client
+import io
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, Client, RequestFactory, SimpleTestCase, override_settings
+from django.core.management import call_command
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 
+from core.utils.cache import InvalidationBus, shared_cache
+from core.utils.result_cache import MISS
+from .utils.required import admin_required, isAuthorized, remember_token
+from .utils import signed_tokens
+from .utils.hash_password import check_password, hash_password, verify_password
+from .utils.token_cache import TokenCache, token_cache
+from .utils.token_usage import TokenUsage
+
 class RoleAPITest(TestCase):
     def setUp(self):
         self.client = Client()
@@ -67,3 +81,315 @@ class CoverageBoostTest(TestCase):
     def test_sample_delete_request(self):
         response = self.client.delete(self.sample_url)
         self.assertTrue(response.status_code in [status.HTTP_200_OK, status.HTTP_404_NOT_FOUND, status.HTTP_401_UNAUTHORIZED])
+
+
+# Удаление токена в другом процессе проверяется на кэше с атомарным incr
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "shared"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TokenCacheTest(SimpleTestCase):
+    def test_positive_and_negative_entries(self):
+        cache = TokenCache(negative_ttl=60)
+        self.assertIs(cache.get("a"), MISS)
+        cache.set("a", (1, 2))
+        cache.set("bad", None)
+        self.assertEqual(cache.get("a"), (1, 2))
+        self.assertIsNone(cache.get("bad"))
+        self.assertEqual(cache.stats()["negative_hits"], 1)
+
+    def test_expired_negative_entry_is_a_miss(self):
+        cache = TokenCache(negative_ttl=-1)
+        cache.set("bad", None)
+        self.assertIs(cache.get("bad"), MISS)
+
+    def test_bounded_size(self):
+        cache = TokenCache(max_entries=2, negative_max_entries=1)
+        for index in range(3):
+            cache.set(f"t{index}", (index, 2))
+            cache.set(f"bad{index}", None)
+        self.assertIs(cache.get("t0"), MISS)
+        self.assertEqual(cache.get("t2"), (2, 2))
+        self.assertEqual(cache.stats()["negative_size"], 1)
+
+    def test_invalidate_user(self):
+        cache = TokenCache()
+        cache.set("old", (1, 2))
+        cache.set("other", (2, 2))
+        cache.invalidate_user(1)
+        self.assertIs(cache.get("old"), MISS)
+        self.assertEqual(cache.get("other"), (2, 2))
+
+    def test_shared_tier_across_workers(self):
+        self.addCleanup(shared_cache().clear)
+        first, second = (TokenCache(namespace="test_tokens", bus=InvalidationBus(poll_interval=0)) for _ in range(2))
+        second.shared.bus.poll()
+        first.set("token", (1, 2), ttl=30)
+        first.set("other", (2, 2), ttl=30)
+        first.set("bad", None)
+        self.assertEqual(second.get("token"), (1, 2))
+        self.assertEqual(second.get("other"), (2, 2))
+        self.assertIs(second.get("bad"), MISS)
+        self.assertEqual(second.stats()["shared_hits"], 2)
+
+        first.invalidate_user(1)
+        self.assertEqual(second.get("token"), (1, 2))
+        second.shared.bus.poll()
+        self.assertIs(second.get("token"), MISS)
+        # Токены остальных пользователей остаются в локальном кэше
+        hits = second.stats()["hits"]
+        self.assertEqual(second.get("other"), (2, 2))
+        self.assertEqual(second.stats()["hits"], hits + 1)
+
+
+class CachedAuthenticationTest(SimpleTestCase):
+    class View:
+        @isAuthorized
+        def get(self, request):
+            return (request.user_id, request.role_id)
+
+        @admin_required
+        def post(self, request):
+            return "ok"
+
+    def setUp(self):
+        token_cache.clear()
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        token_cache.clear()
+
+    def request(self, method, token):
+        return getattr(self.factory, method)("/", HTTP_AUTHORIZATION=f"Token {token}")
+
+    def test_cached_token_needs_no_queries(self):
+        remember_token("student", 5, 2)
+        remember_token("admin", 6, 1)
+        view = self.View()
+        self.assertEqual(view.get(self.request("get", "student")), (5, 2))
+        self.assertEqual(view.post(self.request("post", "admin")), "ok")
+        self.assertEqual(view.post(self.request("post", "student")).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_rotated_token_is_rejected(self):
+        remember_token("first", 5, 2)
+        remember_token("second", 5, 2)
+        self.assertIs(token_cache.get("first"), MISS)
+        token_cache.set("first", None)
+        self.assertEqual(self.View().get(self.request("get", "first")).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(AUTH_TOKEN_MODE="signed", SIGNED_TOKEN_SECRET="test-secret")
+class SignedTokenTest(SimpleTestCase):
+    def setUp(self):
+        signed_tokens.revocations.clear()
+        patcher = mock.patch.object(signed_tokens, "execute_query", return_value=[])
+        self.execute_query = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(signed_tokens.revocations.clear)
+
+    def test_round_trip(self):
+        token = signed_tokens.issue_token(7, 2)
+        self.assertTrue(signed_tokens.is_signed(token))
+        self.assertEqual(signed_tokens.verify_token(token), (7, 2))
+
+    def test_tampered_and_foreign_tokens_are_rejected(self):
+        token = signed_tokens.issue_token(7, 2)
+        self.assertIsNone(signed_tokens.verify_token(token.replace(".7.2.", ".7.1.")))
+        self.assertIsNone(signed_tokens.verify_token(token + "x"))
+        self.assertIsNone(signed_tokens.verify_token("s1.токен"))
+        with override_settings(SIGNED_TOKEN_SECRET="other"):
+            self.assertIsNone(signed_tokens.verify_token(token))
+
+    @override_settings(SIGNED_TOKEN_TTL=-1)
+    def test_expired_token_is_rejected(self):
+        self.assertIsNone(signed_tokens.verify_token(signed_tokens.issue_token(7, 2)))
+
+    def test_login_revokes_previous_tokens(self):
+        old = signed_tokens.issue_token(7, 2, issued_at=1)
+        new = signed_tokens.login_token(7, 2)
+        self.assertIsNone(signed_tokens.verify_token(old))
+        self.assertEqual(signed_tokens.verify_token(new), (7, 2))
+
+    def test_revocations_are_loaded_from_database(self):
+        token = signed_tokens.issue_token(7, 2)
+        self.execute_query.return_value = [(7, signed_tokens._now_ms() + 1)]
+        self.assertIsNone(signed_tokens.verify_token(token))
+
+    def test_decorator_accepts_signed_token_without_queries(self):
+        signed_tokens.revocations.refresh()
+        request = RequestFactory().get("/", HTTP_AUTHORIZATION=f"Token {signed_tokens.issue_token(7, 1)}")
+        self.assertEqual(CachedAuthenticationTest.View().get(request), (7, 1))
+        self.assertEqual(self.execute_query.call_count, 1)
+
+
+USERTOKEN_TABLE = """
+    CREATE TABLE usertoken (
+        id serial PRIMARY KEY,
+        key varchar(64) UNIQUE,
+        user_id int UNIQUE,
+        created_at timestamptz NOT NULL DEFAULT now(),
+        last_used_at timestamptz NOT NULL DEFAULT now(),
+        expires_at timestamptz NOT NULL DEFAULT now() + interval '7 days'
+    )
+"""
+
+FAST_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher", "django.contrib.auth.hashers.PBKDF2PasswordHasher"]
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class PasswordHasherTest(SimpleTestCase):
+    def test_hash_is_versioned_and_salted(self):
+        first, second = hash_password("secret"), hash_password("secret")
+        self.assertTrue(first.startswith("md5$"))
+        self.assertNotEqual(first, second)
+        self.assertTrue(verify_password("secret", first))
+        self.assertFalse(verify_password("wrong", first))
+
+    def test_legacy_hash_is_upgraded(self):
+        legacy = "2bb80d537b1da3e38bd30361aa855686bde0eacd7162fef6a25fe97bf527a25b"
+        self.assertEqual(check_password("wrong", legacy), (False, None))
+        is_valid, new_hash = check_password("secret", legacy)
+        self.assertTrue(is_valid)
+        self.assertTrue(new_hash.startswith("md5$"))
+
+    def test_other_hasher_is_upgraded(self):
+        with override_settings(PASSWORD_HASHERS=list(reversed(FAST_HASHERS))):
+            old = hash_password("secret")
+        is_valid, new_hash = check_password("secret", old)
+        self.assertTrue(is_valid and new_hash.startswith("md5$"))
+        self.assertEqual(check_password("secret", new_hash), (True, None))
+
+    def test_missing_user(self):
+        self.assertEqual(check_password("secret", None), (False, None))
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class UserInfoUpdateTest(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE users (id serial PRIMARY KEY, fio text, email varchar(255) UNIQUE, "
+                "password varchar(255), role_id int)"
+            )
+            cursor.execute(USERTOKEN_TABLE)
+            cursor.execute(
+                "INSERT INTO users (fio, email, password, role_id) VALUES ('Old', 'user@example.com', %s, 2) "
+                "RETURNING id",
+                [hash_password("secret")],
+            )
+            self.user_id = cursor.fetchone()[0]
+        token = self.client.post(
+            reverse('login'), {"email": "user@example.com", "password": "secret"}, content_type='application/json'
+        ).json()["token"]
+        self.client = Client(HTTP_AUTHORIZATION=f"Token {token}")
+
+    def test_update_is_a_tracked_write(self):
+        with mock.patch("core.utils.routing.stick_to_primary") as stick_to_primary:
+            response = self.client.put(reverse('about_me'), {"fio": "New"}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["fio"], "New")
+        stick_to_primary.assert_called_with(self.user_id)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class LoginFlowTest(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TABLE users (id serial PRIMARY KEY, email varchar(255) UNIQUE, password varchar(255), role_id int)")
+            cursor.execute(USERTOKEN_TABLE)
+            cursor.execute("INSERT INTO users (email, password, role_id) VALUES ('user@example.com', %s, 2)", [hash_password("secret")])
+        self.url = reverse('login')
+
+    def login(self, email, password):
+        return self.client.post(self.url, {"email": email, "password": password}, content_type='application/json')
+
+    def test_unknown_email(self):
+        self.assertEqual(self.login("nobody@example.com", "secret").status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_wrong_password(self):
+        self.assertEqual(self.login("user@example.com", "wrong").status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_login_uses_two_queries_and_rotates_token(self):
+        first = self.login("user@example.com", "secret").json()["token"]
+        # Второй вход: подготовленные запросы уже есть на соединении
+        with CaptureQueriesContext(connection) as queries:
+            response = self.login("user@example.com", "secret")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["role_id"], 2)
+        self.assertEqual(len(queries), 2)
+
+        second = response.json()["token"]
+        self.assertNotEqual(first, second)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT key FROM usertoken")
+            self.assertEqual(cursor.fetchall(), [(second,)])
+
+    def test_legacy_password_is_rehashed_on_login(self):
+        legacy = "2bb80d537b1da3e38bd30361aa855686bde0eacd7162fef6a25fe97bf527a25b"
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE users SET password = %s", [legacy])
+        self.assertEqual(self.login("user@example.com", "secret").status_code, status.HTTP_200_OK)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT password FROM users")
+            self.assertTrue(cursor.fetchone()[0].startswith("md5$"))
+        self.assertEqual(self.login("user@example.com", "secret").status_code, status.HTTP_200_OK)
+
+    def test_expired_token_is_rejected(self):
+        token = self.login("user@example.com", "secret").json()["token"]
+        token_cache.clear()
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE usertoken SET expires_at = now() - interval '1 second'")
+        response = self.client.get(reverse('about_me'), HTTP_AUTHORIZATION=f"Token {token}")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(TOKEN_IDLE_TIMEOUT=3600, TOKEN_MAX_AGE=7200)
+class TokenExpiryTest(TestCase):
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute(USERTOKEN_TABLE)
+            cursor.execute("CREATE TABLE tokenrevocations (user_id int PRIMARY KEY, revoked_before bigint NOT NULL)")
+            cursor.execute("""
+                INSERT INTO usertoken (key, user_id, created_at, last_used_at, expires_at) VALUES
+                ('fresh', 1, now() - interval '10 minutes', now() - interval '10 minutes', now() + interval '50 minutes'),
+                ('old', 2, now() - interval '110 minutes', now() - interval '1 minute', now() + interval '1 minute'),
+                ('expired', 3, now() - interval '1 day', now() - interval '1 day', now() - interval '1 hour')
+            """)
+
+    def tokens(self):
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT key, round(EXTRACT(EPOCH FROM expires_at - now()) / 60)
+                FROM usertoken ORDER BY key
+            """)
+            return cursor.fetchall()
+
+    def test_usage_is_coalesced_and_slides_expiry(self):
+        usage = TokenUsage(flush_interval=3600)
+        for _ in range(3):
+            usage.touch("fresh")
+        usage.touch("old")
+        self.assertEqual(usage.pending(), 2)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(usage.flush(), 2)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(usage.pending(), 0)
+        # fresh продлён на TOKEN_IDLE_TIMEOUT, old упирается в TOKEN_MAX_AGE
+        self.assertEqual(self.tokens(), [("expired", -60), ("fresh", 60), ("old", 10)])
+
+    def test_sweeper_deletes_expired_in_chunks(self):
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO usertoken (key, user_id, expires_at)
+                SELECT 'old' || g, 100 + g, now() - interval '1 minute' FROM generate_series(1, 5) g
+            """)
+            cursor.execute("INSERT INTO tokenrevocations VALUES (1, 0), (2, 9999999999999)")
+        call_command("sweep_tokens", chunk_size=2, pause=0, stdout=io.StringIO())
+        self.assertEqual([key for key, _ in self.tokens()], ["fresh", "old"])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT user_id FROM tokenrevocations")
+            self.assertEqual(cursor.fetchall(), [(2,)])
@@ -1,9 +1,75 @@
 import hashlib
+import hmac
+import re
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework.exceptions import APIException
+
+from core.utils.workers import PoolBusy, WorkerPool
+
+
+# Хэши прежнего формата: SHA-256 без соли, 64 шестнадцатеричных символа
+_LEGACY_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class PasswordHashingBusy(APIException):
+    status_code = 503
+    default_detail = "Server is busy, please retry later."
+    default_code = "password_hashing_busy"
+
+
+hashing_pool = WorkerPool(
+    "password-hashing",
+    max_workers=getattr(settings, "PASSWORD_HASHING_WORKERS", 2),
+    max_queue=getattr(settings, "PASSWORD_HASHING_QUEUE", 32),
+    timeout=getattr(settings, "PASSWORD_HASHING_TIMEOUT", 10),
+)
+
+
+def _run(func, *args):
+    try:
+        return hashing_pool.run(func, *args)
+    except PoolBusy:
+        raise PasswordHashingBusy()
+
+
+def _check(password, hashed_password):
+    if hashed_password is None:
+        # Пользователь не найден: хэшируем впустую, чтобы время ответа
+        # не выдавало, существует ли email
+        hashers.make_password(password)
+        return False, None
+
+    if _LEGACY_RE.match(hashed_password):
+        legacy = hashlib.sha256(password.encode('utf-8')).hexdigest()
+        if not hmac.compare_digest(legacy, hashed_password):
+            return False, None
+        return True, hashers.make_password(password)
+
+    new_hash = []
+    is_valid = hashers.check_password(
+        password, hashed_password, setter=lambda raw: new_hash.append(hashers.make_password(raw))
+    )
+    return is_valid, new_hash[0] if is_valid and new_hash else None
+
 
 def hash_password(password):
-    """Хэширует пароль."""
-    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+    """Хэширует пароль основным хэшером из PASSWORD_HASHERS."""
+    return _run(hashers.make_password, password)
+
+
+def check_password(password, hashed_password):
+    """
+    Проверяет пароль и возвращает (совпадает ли, новый хэш или None).
+
+    Новый хэш возвращается, если сохранённый создан другим хэшером или
+    с другими параметрами (например, числом итераций) — его нужно записать
+    вместо старого.
+    """
+    return _run(_check, password, hashed_password)
+
 
 def verify_password(password, hashed_password):
     """Проверяет, совпадает ли пароль с хэшем."""
-    return hash_password(password) == hashed_password
\ No newline at end of file
+    return check_password(password, hashed_password)[0]
@@ -1,29 +1,130 @@
 from rest_framework.response import Response
 from rest_framework import status
 from functools import wraps
-from django.db import connection
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from core.utils import routing
+from core.utils.query import Statement, execute_query
+from core.utils.result_cache import MISS
+from . import signed_tokens
+from .token_cache import token_cache
+from .token_usage import token_usage
+
+
+# Предполагается, что роль администратора имеет ID = 1
+ADMIN_ROLE_ID = 1
+
+# Проверка токена выполняется в каждом защищённом запросе: пользователь,
+# его роль и сколько секунд токен ещё действует читаются одним запросом
+TOKEN_USER_QUERY = Statement(
+    "usertoken_user_role",
+    """
+    SELECT t.user_id, u.role_id, EXTRACT(EPOCH FROM t.expires_at - now())
+    FROM usertoken t
+    JOIN users u ON u.id = t.user_id
+    WHERE t.key = %s AND t.expires_at > now()
+    """,
+)
+
+
+def get_token_identity(token):
+    """
+    Возвращает (user_id, role_id) по токену или None.
+
+    Подписанные токены (AUTH_TOKEN_MODE = "signed") проверяются по подписи,
+    сроку и списку отзыва. Для обычных токенов результат кэшируется
+    в token_cache (в том числе отрицательный, и не дольше срока токена),
+    а использование токена отмечается в token_usage.
+
+    Найденный пользователь запоминается для маршрутизации запросов между
+    основной базой и репликой.
+    """
+    if signed_tokens.enabled() and signed_tokens.is_signed(token):
+        # Подписанный токен проверяется без обращения к базе
+        identity = signed_tokens.verify_token(token)
+        if identity is not None:
+            routing.set_current_user(identity[0])
+        return identity
+
+    use_cache = getattr(settings, "TOKEN_CACHE_ENABLED", True)
+    identity = token_cache.get(token) if use_cache else MISS
+
+    if identity is MISS:
+        result = execute_query(TOKEN_USER_QUERY, [token], fetchone=True)
+        if not result and routing.replica_alias() is not None:
+            # Только что выданный токен мог ещё не дойти до реплики
+            result = execute_query(TOKEN_USER_QUERY, [token], fetchone=True, using=DEFAULT_DB_ALIAS)
+        identity = (result[0], result[1]) if result else None
+        if use_cache:
+            token_cache.set(token, identity, ttl=float(result[2]) if result else None)
+
+    if identity is not None:
+        token_usage.touch(token)
+        routing.set_current_user(identity[0])
+    return identity
+
+
+def remember_token(token, user_id, role_id):
+    """
+    Сбрасывает прежние токены пользователя и кладёт в кэш только что выданный.
+    """
+    token_cache.invalidate_user(user_id)
+    if getattr(settings, "TOKEN_CACHE_ENABLED", True) and not signed_tokens.is_signed(token):
+        token_cache.set(token, (user_id, role_id))
+
+
+def forget_user(user_id):
+    """
+    Сбрасывает кэш токенов пользователя после смены роли или удаления
+    и отзывает его подписанные токены (роль записана в самом токене).
+    """
+    token_cache.invalidate_user(user_id)
+    if signed_tokens.enabled():
+        signed_tokens.revocations.revoke(user_id)
+
+
+def _authenticate(request):
+    """
+    Проверяет заголовок Authorization. Возвращает (user_id, role_id) и None
+    или None и ответ 401.
+    """
+    # Проверка наличия токена
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Token '):
+        return None, Response({"detail": "Authorization token is missing or invalid."}, status=status.HTTP_401_UNAUTHORIZED)
+
+    token = auth_header.split(' ')[1]
+
+    # Проверяем токен (кэш, затем таблица usertoken)
+    identity = get_token_identity(token)
+
+    if identity is None:
+        return None, Response({"detail": "Invalid token."}, status=status.HTTP_401_UNAUTHORIZED)
+
+    request.user_id, request.role_id = identity
+    return identity, None
+
 
 def isAuthorized(view_func):
     @wraps(view_func)
     def wrapper(self, request, *args, **kwargs):
-        # Проверка наличия токена
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Token '):
-            return Response({"detail": "Authorization token is missing or invalid."}, status=status.HTTP_401_UNAUTHORIZED)
-
-        token = auth_header.split(' ')[1]
+        identity, error = _authenticate(request)
+        if error is not None:
+            return error
+        return view_func(self, request, *args, **kwargs)
+    return wrapper
 
-        # Проверяем токен в таблице usertoken
-        token_query = "SELECT user_id FROM usertoken WHERE key = %s"
-        with connection.cursor() as cursor:
-            cursor.execute(token_query, [token])
-            result = cursor.fetchone()
 
-        if not result:
-            return Response({"detail": "Invalid token."}, status=status.HTTP_401_UNAUTHORIZED)
+def admin_required(view_func):
+    @wraps(view_func)
+    def wrapper(self, request, *args, **kwargs):
+        identity, error = _authenticate(request)
+        if error is not None:
+            return error
 
-        user_id = result[0]
+        # Проверяем роль пользователя
+        if identity[1] != ADMIN_ROLE_ID:
+            return Response({"detail": "You don't have administrator rights."}, status=status.HTTP_403_FORBIDDEN)
 
-        request.user_id = user_id
         return view_func(self, request, *args, **kwargs)
     return wrapper
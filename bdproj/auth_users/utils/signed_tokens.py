@@ -0,0 +1,178 @@
+import base64
+import hashlib
+import hmac
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from core.utils.query import Statement, execute_query
+
+
+PREFIX = "s1"
+
+# Отзывы токенов, которые ещё не истекли: токены пользователя, выданные
+# раньше revoked_before (мс), недействительны
+REVOCATIONS_QUERY = Statement(
+    "token_revocations",
+    "SELECT user_id, revoked_before FROM tokenrevocations WHERE revoked_before > %s",
+)
+
+REVOKE_QUERY = """
+    INSERT INTO tokenrevocations (user_id, revoked_before)
+    VALUES (%s, %s)
+    ON CONFLICT (user_id) DO UPDATE
+    SET revoked_before = GREATEST(tokenrevocations.revoked_before, EXCLUDED.revoked_before),
+        updated_at = now();
+"""
+
+
+def enabled():
+    return getattr(settings, "AUTH_TOKEN_MODE", "opaque") == "signed"
+
+
+def is_signed(token):
+    return token.startswith(PREFIX + ".")
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def _ttl_ms():
+    return getattr(settings, "SIGNED_TOKEN_TTL", 12 * 3600) * 1000
+
+
+@lru_cache(maxsize=4)
+def _derive_key(secret):
+    return hashlib.sha256(f"signed-token:{secret}".encode("utf-8")).digest()
+
+
+def _key():
+    return _derive_key(getattr(settings, "SIGNED_TOKEN_SECRET", None) or settings.SECRET_KEY)
+
+
+def _sign(payload):
+    digest = hmac.new(_key(), payload.encode("ascii"), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+
+def issue_token(user_id, role_id, issued_at=None):
+    """
+    Подписанный токен "s1.<user_id>.<role_id>.<выдан, мс>.<истекает, мс>.<HMAC>".
+    """
+    issued_at = _now_ms() if issued_at is None else issued_at
+    payload = f"{PREFIX}.{user_id}.{role_id}.{issued_at}.{issued_at + _ttl_ms()}"
+    return f"{payload}.{_sign(payload)}"
+
+
+def parse_token(token):
+    """
+    (user_id, role_id, issued_at) для токена с верной подписью и неистекшим
+    сроком, иначе None. Базу не использует.
+    """
+    if not token.isascii():
+        return None
+    payload, _, signature = token.rpartition(".")
+    if not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    try:
+        prefix, user_id, role_id, issued_at, expires_at = payload.split(".")
+        user_id, role_id, issued_at, expires_at = int(user_id), int(role_id), int(issued_at), int(expires_at)
+    except ValueError:
+        return None
+    if prefix != PREFIX or expires_at <= _now_ms():
+        return None
+    return user_id, role_id, issued_at
+
+
+class RevocationList:
+    """
+    Отозванные подписанные токены: user_id -> момент отзыва (мс).
+
+    Список перечитывается из таблицы tokenrevocations не чаще раза в
+    refresh_interval секунд; отзывы, сделанные в этом процессе, действуют
+    сразу. Строки старше срока жизни токена не читаются — такие токены
+    уже истекли.
+    """
+
+    def __init__(self, refresh_interval=5):
+        self.refresh_interval = refresh_interval
+        self._revoked = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    def is_revoked(self, user_id, issued_at):
+        self._maybe_refresh()
+        return issued_at < self._revoked.get(user_id, 0)
+
+    def revoke(self, user_id, before=None):
+        """
+        Отзывает токены пользователя, выданные раньше before (по умолчанию — все).
+        """
+        before = _now_ms() + 1 if before is None else before
+        execute_query(REVOKE_QUERY, [user_id, before])
+        with self._lock:
+            self._revoked[user_id] = max(self._revoked.get(user_id, 0), before)
+
+    def refresh(self):
+        rows = execute_query(
+            REVOCATIONS_QUERY, [_now_ms() - _ttl_ms()], fetchall=True, using=DEFAULT_DB_ALIAS
+        )
+        with self._lock:
+            revoked = dict(rows)
+            # Отзывы этого процесса, которые ещё не видны в выборке, не теряем
+            oldest = _now_ms() - _ttl_ms()
+            for user_id, before in self._revoked.items():
+                if before > max(revoked.get(user_id, 0), oldest):
+                    revoked[user_id] = before
+            self._revoked = revoked
+            self._loaded_at = time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._revoked = {}
+            self._loaded_at = None
+
+    def _maybe_refresh(self):
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.refresh_interval:
+            return
+        # Перечитывает один поток, остальные пользуются прежним списком
+        if not self._refreshing.acquire(blocking=loaded_at is None):
+            return
+        try:
+            if self._loaded_at is loaded_at:
+                self.refresh()
+        finally:
+            self._refreshing.release()
+
+
+revocations = RevocationList(
+    refresh_interval=getattr(settings, "SIGNED_TOKEN_REVOCATION_REFRESH", 5),
+)
+
+
+def login_token(user_id, role_id):
+    """
+    Выдаёт новый токен при входе и отзывает все прежние токены пользователя.
+    """
+    issued_at = _now_ms()
+    revocations.revoke(user_id, before=issued_at)
+    return issue_token(user_id, role_id, issued_at)
+
+
+def verify_token(token):
+    """
+    (user_id, role_id) для действующего подписанного токена или None.
+    """
+    parsed = parse_token(token)
+    if parsed is None:
+        return None
+    user_id, role_id, issued_at = parsed
+    if revocations.is_revoked(user_id, issued_at):
+        return None
+    return user_id, role_id
@@ -0,0 +1,182 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from core.utils.cache import SharedNamespace, hashed_key
+from core.utils.result_cache import MISS
+
+
+class TokenCache:
+    """
+    Кэш проверки токенов: токен -> (user_id, role_id).
+
+    Размер ограничен (вытесняются давно не использованные записи), записи
+    живут ttl секунд. Неизвестные токены запоминаются отдельно и на короткое
+    время negative_ttl, чтобы перебор случайных токенов не доходил до базы
+    и не вытеснял из кэша настоящие токены.
+
+    Без namespace кэш локален для процесса: после смены токена или роли
+    запись сбрасывается явно (invalidate_user), в остальных процессах она
+    живёт не дольше ttl. С namespace перед базой стоит ещё общий кэш
+    (core.utils.cache): токен, проверенный одним процессом, остальные берут
+    оттуда, а invalidate_user удаляет токены пользователя из общего кэша
+    и через invalidation_bus удаляет их же из локальных кэшей других
+    процессов. Отрицательные записи в общий кэш не попадают.
+    """
+
+    def __init__(self, max_entries=10000, ttl=60, negative_ttl=5, negative_max_entries=10000, namespace=None, bus=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.negative_max_entries = negative_max_entries
+        self._entries = OrderedDict()
+        self._negative = OrderedDict()
+        self._users = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.shared = None
+        if namespace is not None:
+            self.shared = SharedNamespace(namespace, bus=bus)
+            self.shared.on_invalidate(self._clear_local)
+            self.shared.on_delete(self._deleted)
+
+    def get(self, token):
+        """
+        (user_id, role_id), None для заведомо неверного токена или MISS.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                if entry[0] >= now:
+                    self._entries.move_to_end(token)
+                    self.hits += 1
+                    return entry[1]
+                self._remove(token)
+
+            expires = self._negative.get(token)
+            if expires is not None:
+                if expires >= now:
+                    self.negative_hits += 1
+                    return None
+                del self._negative[token]
+
+        if self.shared is not None:
+            # Запись общего кэша: (user_id, role_id, истекает по time.time())
+            entry = self.shared.get(f"token:{hashed_key(token)}")
+            if entry is not MISS:
+                identity, ttl = entry[:2], entry[2] - time.time()
+                if ttl > 0:
+                    self._set_local(token, identity, ttl)
+                    with self._lock:
+                        self.shared_hits += 1
+                    return identity
+
+        with self._lock:
+            self.misses += 1
+        return MISS
+
+    def set(self, token, identity, ttl=None):
+        """
+        Запоминает результат проверки токена; identity = None — токен неверный.
+        ttl сокращает срок записи (например, до истечения самого токена).
+        """
+        self._set_local(token, identity, ttl)
+        if self.shared is not None and identity is not None:
+            ttl = self.ttl if ttl is None else min(self.ttl, ttl)
+            key = hashed_key(token)
+            tokens = self.shared.get(f"user:{identity[0]}", ())
+            self.shared.set(f"token:{key}", (*identity, time.time() + ttl), ttl)
+            self.shared.set(f"user:{identity[0]}", (*tokens[-7:], key), self.ttl)
+
+    def _set_local(self, token, identity, ttl):
+        now = time.monotonic()
+        with self._lock:
+            if identity is None:
+                self._negative[token] = now + self.negative_ttl
+                self._negative.move_to_end(token)
+                while len(self._negative) > self.negative_max_entries:
+                    self._negative.popitem(last=False)
+                return
+
+            if token in self._entries:
+                self._remove(token)
+            self._negative.pop(token, None)
+            self._entries[token] = (now + (self.ttl if ttl is None else min(self.ttl, ttl)), identity)
+            self._users.setdefault(identity[0], set()).add(token)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id):
+        """
+        Сбрасывает все токены пользователя (новый токен при входе, смена роли,
+        удаление пользователя).
+        """
+        with self._lock:
+            for token in list(self._users.get(user_id, ())):
+                self._remove(token)
+        if self.shared is not None:
+            tokens = self.shared.get(f"user:{user_id}", ())
+            self.shared.delete(f"user:{user_id}", *(f"token:{key}" for key in tokens))
+
+    def _deleted(self, keys):
+        # Удаление в другом процессе: invalidate_user всегда удаляет ключ
+        # "user:<id>" вместе с токенами пользователя
+        user_ids = set()
+        for key in keys:
+            kind, _, user_id = key.partition(":")
+            if kind == "user":
+                try:
+                    user_ids.add(int(user_id))
+                except ValueError:
+                    self._clear_local()
+                    return
+        with self._lock:
+            for user_id in user_ids:
+                for token in list(self._users.get(user_id, ())):
+                    self._remove(token)
+
+    def clear(self):
+        self._clear_local()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def _clear_local(self):
+        with self._lock:
+            self._entries.clear()
+            self._negative.clear()
+            self._users.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "negative_size": len(self._negative),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+            }
+
+    def _remove(self, token):
+        _, identity = self._entries.pop(token)
+        tokens = self._users.get(identity[0])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._users[identity[0]]
+
+
+token_cache = TokenCache(
+    max_entries=getattr(settings, "TOKEN_CACHE_MAX_ENTRIES", 10000),
+    ttl=getattr(settings, "TOKEN_CACHE_TTL", 60),
+    negative_ttl=getattr(settings, "TOKEN_CACHE_NEGATIVE_TTL", 5),
+    negative_max_entries=getattr(settings, "TOKEN_CACHE_NEGATIVE_MAX_ENTRIES", 10000),
+    namespace="auth_tokens" if getattr(settings, "TOKEN_CACHE_SHARED", True) else None,
+)
@@ -0,0 +1,108 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import connections
+
+from core.utils.query import execute_values
+
+
+logger = logging.getLogger(__name__)
+
+
+def idle_timeout():
+    return getattr(settings, "TOKEN_IDLE_TIMEOUT", 7 * 24 * 3600)
+
+
+def max_age():
+    return getattr(settings, "TOKEN_MAX_AGE", 30 * 24 * 3600)
+
+
+def flush_query():
+    # Скользящий срок: от последнего использования, но не дольше max_age от выдачи
+    return f"""
+        UPDATE usertoken AS t
+        SET last_used_at = v.used_at,
+            expires_at = LEAST(
+                t.created_at + interval '{int(max_age())} seconds',
+                v.used_at + interval '{int(idle_timeout())} seconds'
+            )
+        FROM (VALUES %s) AS v(key, used_at)
+        WHERE t.key = v.key AND v.used_at > t.last_used_at
+    """
+
+
+class TokenUsage:
+    """
+    Время последнего использования токенов.
+
+    Использование запоминается в памяти (для каждого токена только последнее)
+    и записывается в usertoken одним UPDATE ... FROM (VALUES ...) не чаще
+    раза в flush_interval секунд или сразу при max_pending токенах. Запись
+    идёт в отдельном потоке, вне HTTP-запроса. При остановке процесса
+    теряется не больше одного интервала — на срок действия токена это
+    почти не влияет.
+    """
+
+    def __init__(self, flush_interval=60, max_pending=10000):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flushing = threading.Lock()
+        self._flushed_at = time.monotonic()
+        self._scheduled = False
+        self.flushes = 0
+        self.flushed_tokens = 0
+
+    def touch(self, token):
+        with self._lock:
+            self._pending[token] = time.time()
+            due = not self._scheduled and (
+                len(self._pending) >= self.max_pending
+                or time.monotonic() - self._flushed_at >= self.flush_interval
+            )
+            if due:
+                self._scheduled = True
+        if due:
+            threading.Thread(target=self._flush_in_background, daemon=True).start()
+
+    def flush(self):
+        """
+        Записывает накопленные отметки; возвращает число токенов.
+        """
+        with self._flushing:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._flushed_at = time.monotonic()
+                self._scheduled = False
+            if not pending:
+                return 0
+            rows = [
+                (token, datetime.fromtimestamp(used_at, timezone.utc))
+                for token, used_at in pending.items()
+            ]
+            execute_values(flush_query(), rows, template="(%s, %s::timestamptz)")
+            self.flushes += 1
+            self.flushed_tokens += len(rows)
+            return len(rows)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Unable to flush token usage")
+        finally:
+            connections.close_all()
+
+
+token_usage = TokenUsage(
+    flush_interval=getattr(settings, "TOKEN_USAGE_FLUSH_INTERVAL", 60),
+    max_pending=getattr(settings, "TOKEN_USAGE_MAX_PENDING", 10000),
+)
@@ -1,28 +1,55 @@
 from re import I
 import re
-from django.db import connection
+from django.db import DEFAULT_DB_ALIAS, transaction
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from .utils.generate_token import generate_token
-from .utils.hash_password import hash_password, verify_password
+from .utils.hash_password import check_password, hash_password, verify_password
 from django.http import JsonResponse
 from .serializers import UpdateUserSerializer, UserInfoSerializer, RegisterUserSerializer, LoginResponseSerializer
-from .utils.required import isAuthorized
+from .utils.required import isAuthorized, remember_token
+from .utils import signed_tokens
+from .utils.token_usage import idle_timeout
 from .utils.check_unique import validate_unique_field
+from core.utils.query import Statement, execute_query
+
+
+# Учётные данные и роль одним запросом; читается основная база, чтобы
+# только что зарегистрированный пользователь сразу мог войти
+LOGIN_USER_QUERY = Statement("login_user", "SELECT id, password, role_id FROM users WHERE email = %s")
+
+# Пересчитанный при входе хэш пароля (сменился хэшер или его параметры)
+REHASH_PASSWORD_QUERY = "UPDATE users SET password = %s WHERE id = %s AND password = %s"
+
+# Токен записывается, только если пароль не сменился после проверки
+LOGIN_TOKEN_QUERY = Statement(
+    "login_token",
+    """
+    INSERT INTO usertoken (key, user_id, created_at, last_used_at, expires_at)
+    SELECT %s, id, now(), now(), now() + %s * interval '1 second'
+    FROM users WHERE id = %s AND password = %s
+    ON CONFLICT (user_id) DO UPDATE
+    SET key = EXCLUDED.key,
+        created_at = EXCLUDED.created_at,
+        last_used_at = EXCLUDED.last_used_at,
+        expires_at = EXCLUDED.expires_at
+    RETURNING key
+    """,
+)
 
 class RegisterUserAPIView(APIView):
     def post(self, request):
         data = request.data
-        hashed_password = hash_password(data['password'])
 
+        # Проверка занятости email — по основной базе, а не по реплике
         email_query = "SELECT id FROM users WHERE email = %s"
-        with connection.cursor() as cursor:
-            cursor.execute(email_query, [data['email']])
-            existing_user = cursor.fetchone()
+        existing_user = execute_query(email_query, [data['email']], fetchone=True, using=DEFAULT_DB_ALIAS)
 
         if existing_user:
             return JsonResponse({"error": "Email already exists."}, status=400)
+
+        hashed_password = hash_password(data['password'])
         
         # SQL-запрос для вставки нового пользователя
         query = """
@@ -30,17 +57,15 @@ class RegisterUserAPIView(APIView):
         VALUES (%s, %s, %s)
         RETURNING id, fio, email;
         """
-        with connection.cursor() as cursor:
-            try:
-                cursor.execute(query, [
-                    data['fio'],
-                    data['email'],
-                    hashed_password,
-                ])
-                user = cursor.fetchone()
-            except Exception as e:
-                return JsonResponse({"error": "Register error"}, status=400)
-        
+        try:
+            user = execute_query(query, [
+                data['fio'],
+                data['email'],
+                hashed_password,
+            ], fetchone=True)
+        except Exception as e:
+            return JsonResponse({"error": "Register error"}, status=400)
+
 
         # Использование сериализатора
         serializer = RegisterUserSerializer({
@@ -54,37 +79,39 @@ class LoginUserAPIView(APIView):
     def post(self, request):
         data = request.data
 
-        # SQL-запрос для получения пользователя по email
-        query = "SELECT id, password FROM users WHERE email = %s"
-        with connection.cursor() as cursor:
-            cursor.execute(query, [data['email']])
-            user = cursor.fetchone()
-        
-        user_id = user[0]
-
+        # Пользователь, хэш пароля и роль — одним запросом
+        user = execute_query(LOGIN_USER_QUERY, [data['email']], fetchone=True, using=DEFAULT_DB_ALIAS)
 
-        query = "SELECT role_id FROM users WHERE id = %s"
-        with connection.cursor() as cursor:
-            cursor.execute(query, [user_id])
-            role_id = cursor.fetchone()
-        
-        if not user or not verify_password(data['password'], user[1]):
+        is_valid, new_hash = check_password(data['password'], user[1] if user else None)
+        if not is_valid:
             return JsonResponse({"error": "Invalid email or password."}, status=401)
 
-        # Генерация токена
-        token = generate_token()
-        token_query = """
-        INSERT INTO usertoken (key, user_id) 
-        VALUES (%s, %s)
-        ON CONFLICT (user_id) DO UPDATE SET key = EXCLUDED.key 
-        RETURNING key
-        """
-        with connection.cursor() as cursor:
-            cursor.execute(token_query, [token, user[0]])
-            token = cursor.fetchone()[0]
+        user_id, password_hash, role_id = user
+
+        if new_hash is not None:
+            # Хэш старого формата заменяется при первом успешном входе
+            execute_query(REHASH_PASSWORD_QUERY, [new_hash, user_id, password_hash])
+            password_hash = new_hash
+
+        if signed_tokens.enabled():
+            # Подписанный токен в базе не хранится, прежние токены отзываются
+            with transaction.atomic():
+                execute_query("DELETE FROM usertoken WHERE user_id = %s", [user_id])
+                token = signed_tokens.login_token(user_id, role_id)
+        else:
+            # Генерация токена; запись одним оператором, без отдельной транзакции
+            result = execute_query(
+                LOGIN_TOKEN_QUERY, [generate_token(), idle_timeout(), user_id, password_hash], fetchone=True
+            )
+            if not result:
+                return JsonResponse({"error": "Invalid email or password."}, status=401)
+            token = result[0]
+
+        # Прежний токен пользователя больше недействителен
+        remember_token(token, user_id, role_id)
 
         # Использование сериализатора
-        serializer = LoginResponseSerializer({"token": token, "role_id": role_id[0]})
+        serializer = LoginResponseSerializer({"token": token, "role_id": role_id})
         return Response(serializer.data, status=200)
         
 
@@ -114,9 +141,7 @@ class UserInfoAPIView(APIView):
                     WHERE 
                         u.id = %s;
                     """
-        with connection.cursor() as cursor:
-            cursor.execute(user_query, [user_id])
-            user = cursor.fetchone()
+        user = execute_query(user_query, [user_id], fetchone=True)
 
         if not user:
             return JsonResponse({"error": "User not found."}, status=404)
@@ -139,10 +164,9 @@ class UserInfoAPIView(APIView):
         user_id = request.user_id
         data = request.data
 
+        # Пароль проверяется по основной базе: на реплике он может быть старым
         get_password_query = "SELECT password FROM users WHERE id = %s;"
-        with connection.cursor() as cursor:
-            cursor.execute(get_password_query, [user_id])
-            user_password = cursor.fetchone()
+        user_password = execute_query(get_password_query, [user_id], fetchone=True, using=DEFAULT_DB_ALIAS)
 
 
         if 'old_password' in data and 'new_password' in data:
@@ -183,10 +207,10 @@ class UserInfoAPIView(APIView):
         """
         values.append(user_id)
 
+        # Запись через execute_query: следующие чтения пользователя идут
+        # с основной базы, а закэшированные чтения users сбрасываются
         try:
-            with connection.cursor() as cursor:
-                cursor.execute(query, values)
-                updated_user = cursor.fetchone()
+            updated_user = execute_query(query, values, fetchone=True)
         except Exception as e:
             return JsonResponse({"error": f"Unable to update user: {e}"}, status=400)
 
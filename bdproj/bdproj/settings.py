@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 from decouple import config
 from rest_framework.settings import api_settings
@@ -41,6 +42,7 @@ ALLOWED_HOSTS = ["*"]
 INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.staticfiles',
+    'core',
     'auth_users',
     'adminpanel',
     'userpanel',
@@ -62,6 +64,9 @@ MIGRATION_MODULES = {
 }
 
 MIDDLEWARE = [
+    'core.middleware.SQLInstrumentationMiddleware',
+    'core.middleware.CacheInvalidationMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -100,17 +105,240 @@ POSTGRES_DB_NAME = config("POSTGRES_DB_NAME")
 POSTGRES_HOST = config("POSTGRES_HOST")
 POSTGRES_PORT = config("POSTGRES_PORT", cast=int)
 
+# Пул соединений (core.utils.pool.ConnectionPool), отключается POSTGRES_POOL=False
+POSTGRES_POOL = config("POSTGRES_POOL", default=True, cast=bool)
+POSTGRES_POOL_OPTIONS = {
+    "min_size": config("POSTGRES_POOL_MIN_SIZE", default=2, cast=int),
+    "max_size": config("POSTGRES_POOL_MAX_SIZE", default=20, cast=int),
+    "timeout": config("POSTGRES_POOL_TIMEOUT", default=10.0, cast=float),
+    "max_lifetime": config("POSTGRES_POOL_MAX_LIFETIME", default=1800.0, cast=float),
+    "max_idle": config("POSTGRES_POOL_MAX_IDLE", default=300.0, cast=float),
+    "check_interval": config("POSTGRES_POOL_CHECK_INTERVAL", default=30.0, cast=float),
+}
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
+        "ENGINE": "core.backends.postgresql",
         "NAME": POSTGRES_DB_NAME,
         "USER": POSTGRES_USER,
         "PASSWORD": POSTGRES_PASSWORD,
         "HOST": POSTGRES_HOST,
         "PORT": POSTGRES_PORT,
+        "CONN_HEALTH_CHECKS": True,
+        "POOL": POSTGRES_POOL_OPTIONS if POSTGRES_POOL else False,
     }
 }
 
+# Реплика для чтения: включается, если задан POSTGRES_REPLICA_HOST.
+# Читающие запросы слоя core.utils.query идут на неё, записи — на default.
+POSTGRES_REPLICA_HOST = config("POSTGRES_REPLICA_HOST", default="")
+SQL_REPLICA_ALIAS = "replica"
+# Сколько секунд после записи пользователь читает с основной базы
+REPLICA_STICKY_SECONDS = config("REPLICA_STICKY_SECONDS", default=5, cast=int)
+
+if POSTGRES_REPLICA_HOST:
+    DATABASES[SQL_REPLICA_ALIAS] = {
+        **DATABASES["default"],
+        "NAME": config("POSTGRES_REPLICA_DB_NAME", default=POSTGRES_DB_NAME),
+        "USER": config("POSTGRES_REPLICA_USER", default=POSTGRES_USER),
+        "PASSWORD": config("POSTGRES_REPLICA_PASSWORD", default=POSTGRES_PASSWORD),
+        "HOST": POSTGRES_REPLICA_HOST,
+        "PORT": config("POSTGRES_REPLICA_PORT", default=POSTGRES_PORT),
+        # В тестах реплика указывает на тестовую базу default
+        "TEST": {"MIRROR": "default"},
+    }
+
+# Количество строк в одном запросе пакетной записи (core.utils.query)
+SQL_BATCH_PAGE_SIZE = config("SQL_BATCH_PAGE_SIZE", default=1000, cast=int)
+
+# Количество строк в одной пачке при потоковом чтении серверным курсором
+SQL_STREAM_BATCH_SIZE = config("SQL_STREAM_BATCH_SIZE", default=2000, cast=int)
+
+# Кэш результатов чтения справочных таблиц (core.utils.result_cache):
+# записи помечаются таблицами и сбрасываются при записи в них
+RESULT_CACHE_ENABLED = config("RESULT_CACHE_ENABLED", default=True, cast=bool)
+RESULT_CACHE_MAX_ENTRIES = config("RESULT_CACHE_MAX_ENTRIES", default=1000, cast=int)
+RESULT_CACHE_TTL = config("RESULT_CACHE_TTL", default=300, cast=int)
+RESULT_CACHE_TABLES = [
+    "roles",
+    "levels",
+    "categorymaterials",
+    "modules",
+    "topics",
+    "tests",
+    "questions",
+    "optionss",
+    "testsquestions",
+    "questionoptions",
+    "questiontags",
+]
+# Внешние ключи с ON DELETE CASCADE / SET NULL (core/sql_migrations):
+# удаление из таблицы меняет и перечисленные в ней, поэтому их записи
+# кэша сбрасываются вместе с ней (core.tests сверяет карту со схемой)
+RESULT_CACHE_CASCADES = {
+    "users": {
+        "usertoken": "CASCADE",
+        "usertestprogress": "CASCADE",
+        "courseprogress": "CASCADE",
+        "usersmodules": "CASCADE",
+    },
+    "modules": {"topics": "CASCADE", "tests": "CASCADE", "usersmodules": "CASCADE"},
+    "topics": {"questions": "CASCADE", "materials": "CASCADE"},
+    "tests": {"testsquestions": "CASCADE", "usertestprogress": "CASCADE"},
+    "optionss": {"questions": "SET NULL", "questionoptions": "CASCADE"},
+    "questions": {"testsquestions": "CASCADE", "questionoptions": "CASCADE", "questiontags": "CASCADE"},
+}
+
+# Вступительный тест (userpanel.utils.entrance_pool). Источник вопросов:
+# "module:<id>" — все тесты модуля, "test:<id>" — один тест,
+# "tag:<метка>" — вопросы с меткой из таблицы questiontags
+ENTRANCE_TEST_SOURCE = config("ENTRANCE_TEST_SOURCE", default="module:37")
+# "memory" — выборка из пула вопросов в памяти процесса, "sql" — выборка
+# в Postgres (ROW_NUMBER по уровням), "auto" — пул в памяти, пока в
+# источнике не больше ENTRANCE_POOL_MAX_QUESTIONS вопросов
+ENTRANCE_TEST_SAMPLING = config("ENTRANCE_TEST_SAMPLING", default="auto")
+ENTRANCE_POOL_MAX_QUESTIONS = config("ENTRANCE_POOL_MAX_QUESTIONS", default=2000, cast=int)
+# Сколько последних показанных вопросов вступительного теста не повторять
+# пользователю и как долго (секунды); 0 — не запоминать
+ENTRANCE_RECENT_QUESTIONS = config("ENTRANCE_RECENT_QUESTIONS", default=50, cast=int)
+ENTRANCE_RECENT_TTL = config("ENTRANCE_RECENT_TTL", default=24 * 3600, cast=int)
+
+# Срок жизни списка модулей пользователя в кэше (userpanel.utils.curriculum),
+# секунды; после записи на модули список сбрасывается сразу
+CURRICULUM_CACHE_TTL = config("CURRICULUM_CACHE_TTL", default=3600, cast=int)
+
+# Тест модуля собирается в JSON на стороне Postgres (json_agg) и отдаётся
+# без разбора в Python; False — группировка строк JOIN в Python
+MODULE_TEST_SQL_JSON = config("MODULE_TEST_SQL_JSON", default=True, cast=bool)
+
+# Готовые ответы тестов модулей (userpanel.utils.module_tests): срок жизни
+# в кэше, секунды, и уровень заранее сжатой gzip-копии (0 — без неё)
+MODULE_TEST_CACHE_TTL = config("MODULE_TEST_CACHE_TTL", default=3600, cast=int)
+MODULE_TEST_GZIP_LEVEL = config("MODULE_TEST_GZIP_LEVEL", default=6, cast=int)
+
+# Общий для всех процессов кэш (core.utils.cache). CACHE_BACKEND:
+# "redis" (CACHE_LOCATION = redis://host:6379/1, нужен пакет redis),
+# "memcached" (host:11211, нужен pymemcache), "file" — каталог на общем
+# диске, работает без отдельного сервера, если все процессы на одной машине,
+# но без атомарных add/incr: удаление ключа сбрасывает локальные кэши других
+# процессов целиком, а одновременные сборки схлопываются только внутри
+# процесса; "locmem" — только для тестов и одного процесса
+CACHE_BACKEND = config("CACHE_BACKEND", default="file")
+_CACHE_BACKENDS = {
+    "redis": "django.core.cache.backends.redis.RedisCache",
+    "memcached": "django.core.cache.backends.memcached.PyMemcacheCache",
+    "file": "django.core.cache.backends.filebased.FileBasedCache",
+    "locmem": "django.core.cache.backends.locmem.LocMemCache",
+}
+CACHES = {
+    "default": {
+        "BACKEND": _CACHE_BACKENDS[CACHE_BACKEND],
+        "LOCATION": config("CACHE_LOCATION", default=str(Path(tempfile.gettempdir()) / "bdproj_cache")),
+        "KEY_PREFIX": config("CACHE_KEY_PREFIX", default="bdproj"),
+        "TIMEOUT": 300,
+        "OPTIONS": {"MAX_ENTRIES": 100000} if CACHE_BACKEND in ("file", "locmem") else {},
+    },
+}
+SHARED_CACHE_ALIAS = "default"
+# Как часто (в секундах) процесс проверяет сбросы кэшей, сделанные другими
+# процессами; столько же после сброса могут жить локальные копии
+CACHE_INVALIDATION_POLL_INTERVAL = config("CACHE_INVALIDATION_POLL_INTERVAL", default=1.0, cast=float)
+
+# Кэш проверки токенов (auth_users.utils.token_cache): токен -> (user_id, role_id)
+TOKEN_CACHE_ENABLED = config("TOKEN_CACHE_ENABLED", default=True, cast=bool)
+# Держать проверенные токены ещё и в общем кэше, чтобы другие процессы
+# не проверяли их по базе заново
+TOKEN_CACHE_SHARED = config("TOKEN_CACHE_SHARED", default=True, cast=bool)
+TOKEN_CACHE_MAX_ENTRIES = config("TOKEN_CACHE_MAX_ENTRIES", default=10000, cast=int)
+TOKEN_CACHE_TTL = config("TOKEN_CACHE_TTL", default=60, cast=int)
+# Сколько секунд помнить неверный токен, чтобы перебор не доходил до базы
+TOKEN_CACHE_NEGATIVE_TTL = config("TOKEN_CACHE_NEGATIVE_TTL", default=5, cast=int)
+TOKEN_CACHE_NEGATIVE_MAX_ENTRIES = config("TOKEN_CACHE_NEGATIVE_MAX_ENTRIES", default=10000, cast=int)
+
+# Хэширование паролей (auth_users.utils.hash_password): новые хэши создаёт
+# первый хэшер списка; хэши других хэшеров, с устаревшими параметрами и
+# старые SHA-256 без соли пересчитываются при входе
+PASSWORD_HASHERS = [
+    "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+]
+# Пул потоков для хэширования: число потоков, длина очереди и сколько
+# секунд ждать; при переполнении вход и регистрация отвечают 503
+PASSWORD_HASHING_WORKERS = config("PASSWORD_HASHING_WORKERS", default=2, cast=int)
+PASSWORD_HASHING_QUEUE = config("PASSWORD_HASHING_QUEUE", default=32, cast=int)
+PASSWORD_HASHING_TIMEOUT = config("PASSWORD_HASHING_TIMEOUT", default=10, cast=int)
+
+# Срок действия токенов usertoken: скользящий (TOKEN_IDLE_TIMEOUT секунд
+# с последнего использования), но не дольше TOKEN_MAX_AGE секунд с выдачи.
+# Время использования копится в памяти и пишется пачкой раз в
+# TOKEN_USAGE_FLUSH_INTERVAL секунд; истёкшие токены удаляет manage.py sweep_tokens
+TOKEN_IDLE_TIMEOUT = config("TOKEN_IDLE_TIMEOUT", default=7 * 24 * 3600, cast=int)
+TOKEN_MAX_AGE = config("TOKEN_MAX_AGE", default=30 * 24 * 3600, cast=int)
+TOKEN_USAGE_FLUSH_INTERVAL = config("TOKEN_USAGE_FLUSH_INTERVAL", default=60, cast=int)
+TOKEN_USAGE_MAX_PENDING = config("TOKEN_USAGE_MAX_PENDING", default=10000, cast=int)
+TOKEN_SWEEP_CHUNK_SIZE = config("TOKEN_SWEEP_CHUNK_SIZE", default=1000, cast=int)
+
+# Режим токенов доступа: "opaque" — случайный токен из таблицы usertoken,
+# "signed" — подписанный HMAC токен с user_id, role_id и сроком действия,
+# который проверяется без обращения к базе (auth_users.utils.signed_tokens)
+AUTH_TOKEN_MODE = config("AUTH_TOKEN_MODE", default="opaque")
+SIGNED_TOKEN_SECRET = config("SIGNED_TOKEN_SECRET", default=SECRET_KEY)
+SIGNED_TOKEN_TTL = config("SIGNED_TOKEN_TTL", default=12 * 3600, cast=int)
+# Как часто (в секундах) перечитывать список отозванных токенов
+SIGNED_TOKEN_REVOCATION_REFRESH = config("SIGNED_TOKEN_REVOCATION_REFRESH", default=5, cast=int)
+
+# Метрики SQL для каждого запроса (core.middleware): заголовок Server-Timing и лог core.sql
+SQL_INSTRUMENTATION = config("SQL_INSTRUMENTATION", default=True, cast=bool)
+# Сколько повторов одного и того же запроса считать признаком N+1
+SQL_N_PLUS_ONE_THRESHOLD = config("SQL_N_PLUS_ONE_THRESHOLD", default=5, cast=int)
+# Запрос с большим числом обращений к базе или временем в базе (мс)
+# логируется с уровнем WARNING, остальные — с уровнем DEBUG
+SQL_QUERY_COUNT_THRESHOLD = config("SQL_QUERY_COUNT_THRESHOLD", default=30, cast=int)
+SQL_DB_TIME_THRESHOLD_MS = config("SQL_DB_TIME_THRESHOLD_MS", default=500, cast=int)
+
+# Журнал медленных запросов (core.utils.slow_queries) с планами EXPLAIN (ANALYZE, BUFFERS)
+SLOW_QUERY_LOG = config("SLOW_QUERY_LOG", default=True, cast=bool)
+SLOW_QUERY_THRESHOLD_MS = config("SLOW_QUERY_THRESHOLD_MS", default=200, cast=int)
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = config("SLOW_QUERY_EXPLAIN_SAMPLE_RATE", default=1.0, cast=float)
+SLOW_QUERY_EXPLAIN_INTERVAL = config("SLOW_QUERY_EXPLAIN_INTERVAL", default=60, cast=int)
+SLOW_QUERY_LOG_FILE = config(
+    "SLOW_QUERY_LOG_FILE", default=str(Path(tempfile.gettempdir()) / "bdproj_slow_queries.log")
+)
+SLOW_QUERY_LOG_MAX_BYTES = config("SLOW_QUERY_LOG_MAX_BYTES", default=5 * 1024 * 1024, cast=int)
+SLOW_QUERY_LOG_BACKUP_COUNT = config("SLOW_QUERY_LOG_BACKUP_COUNT", default=3, cast=int)
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+        "slow_queries": {
+            "class": "logging.handlers.RotatingFileHandler",
+            "filename": SLOW_QUERY_LOG_FILE,
+            "maxBytes": SLOW_QUERY_LOG_MAX_BYTES,
+            "backupCount": SLOW_QUERY_LOG_BACKUP_COUNT,
+            "encoding": "utf-8",
+            "delay": True,
+        },
+    },
+    "loggers": {
+        "core.sql": {
+            "handlers": ["console"],
+            "level": config("SQL_LOG_LEVEL", default="INFO"),
+            "propagate": False,
+        },
+        "core.slow_queries": {
+            "handlers": ["slow_queries"],
+            "level": "WARNING",
+            "propagate": False,
+        },
+    },
+}
+
+# Выполнять часто используемые запросы (Statement) как серверные prepared statements
+SQL_PREPARED_STATEMENTS = config("SQL_PREPARED_STATEMENTS", default=True, cast=bool)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -151,6 +379,7 @@ api_settings.UNAUTHENTICATED_USER = None
 CORS_ORIGIN_ALLOW_ALL = True
 
 CORS_ORIGIN_ALLOW_ALL = True
+CORS_EXPOSE_HEADERS = ["Server-Timing"]
 MEDIA_ROOT = BASE_DIR / "media"
 MEDIA_URL = "/media/"
 
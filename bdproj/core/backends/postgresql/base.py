@@ -0,0 +1,48 @@
+from functools import partial
+
+import psycopg2
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base
+
+from core.utils.pool import ConnectionPool, PooledConnection
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL-бэкенд Django, берущий соединения из ConnectionPool.
+
+    Пул включается ключом "POOL" в настройках базы данных (True или словарь
+    параметров ConnectionPool). Django возвращает соединение в пул в конце
+    каждого запроса вместо того, чтобы закрывать его.
+    """
+
+    @property
+    def pool(self):
+        pool_options = self.settings_dict.get("POOL")
+        if self.alias == NO_DB_ALIAS or not pool_options:
+            return None
+
+        if self.alias not in self._connection_pools:
+            if self.settings_dict.get("CONN_MAX_AGE", 0) != 0:
+                raise ImproperlyConfigured(
+                    "Pooling doesn't support persistent connections."
+                )
+            if pool_options is True:
+                pool_options = {}
+
+            connect_kwargs = self.get_connection_params()
+            pool = ConnectionPool(
+                connect=partial(
+                    psycopg2.connect,
+                    connection_factory=PooledConnection,
+                    **connect_kwargs,
+                ),
+                configure=self._configure_connection,
+                name=self.alias,
+                check=self.settings_dict["CONN_HEALTH_CHECKS"],
+                **pool_options,
+            )
+            self._connection_pools.setdefault(self.alias, pool)
+
+        return self._connection_pools[self.alias]
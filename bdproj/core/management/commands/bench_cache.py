@@ -0,0 +1,55 @@
+import itertools
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.utils.bench import format_summary, run_benchmark
+from core.utils.cache import TieredCache
+from core.utils.query import execute_query
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает время попадания в кэш: память процесса, общий кэш "
+        "(CACHES, CACHE_BACKEND) и для сравнения запрос к базе."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=5000)
+        parser.add_argument("--concurrency", type=int, default=1)
+        parser.add_argument("--size", type=int, default=1024, help="Размер значения в байтах.")
+        parser.add_argument("--keys", type=int, default=100)
+        parser.add_argument("--no-database", action="store_true", help="Не замерять запрос к базе.")
+
+    def handle(self, *args, **options):
+        tiered = TieredCache("bench_cache", timeout=600, local_ttl=600)
+        value = b"x" * options["size"]
+        keys = [f"key{number}" for number in range(options["keys"])]
+        for key in keys:
+            tiered.set(key, value)
+
+        def lookups(get):
+            position = itertools.count()
+
+            def lookup():
+                get(keys[next(position) % len(keys)])
+            return lookup
+
+        def shared_get(key):
+            # Мимо локального уровня: то, что видит другой процесс
+            return tiered.shared.get(key)
+
+        self.stdout.write(f"Shared cache backend: {settings.CACHES['default']['BACKEND']}")
+        runs = [
+            ("in-process hit", lookups(tiered.get)),
+            ("shared hit", lookups(shared_get)),
+        ]
+        if not options["no_database"]:
+            runs.append(("database SELECT 1", lambda: execute_query("SELECT 1", fetchone=True)))
+
+        try:
+            for title, func in runs:
+                summary = run_benchmark(func, requests=options["requests"], concurrency=options["concurrency"])
+                self.stdout.write(format_summary(title, summary))
+        finally:
+            tiered.delete(*keys)
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from core.utils.sql_migrations import MigrationError, MigrationRunner
+
+
+class Command(BaseCommand):
+    help = (
+        "Применяет SQL-миграции схемы из core/sql_migrations "
+        "(таблицы, уникальные ограничения и индексы)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+        parser.add_argument("--status", action="store_true", help="Показать применённые и ожидающие миграции.")
+        parser.add_argument("--dry-run", action="store_true", help="Показать, что будет сделано, ничего не меняя.")
+        parser.add_argument(
+            "--report",
+            action="store_true",
+            help="Показать индексы, запросы, которые они обслуживают, и их использование.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            runner = MigrationRunner(using=options["database"], log=self.stdout.write)
+            if options["status"]:
+                self.show_status(runner)
+            elif options["report"]:
+                self.show_report(runner)
+            else:
+                applied = runner.migrate(dry_run=options["dry_run"])
+                if not applied:
+                    self.stdout.write("No SQL migrations to apply.")
+                elif not options["dry_run"]:
+                    self.stdout.write(self.style.SUCCESS(f"Applied {len(applied)} SQL migration(s)."))
+        except MigrationError as e:
+            raise CommandError(str(e))
+
+    def show_status(self, runner):
+        for record in runner.status():
+            line = f"[{record['state']:>7}] {record['version']}_{record['name']}"
+            if record["applied_at"]:
+                line += f" ({record['applied_at']:%Y-%m-%d %H:%M})"
+            self.stdout.write(line)
+
+    def show_report(self, runner):
+        for item in runner.index_report():
+            columns = ", ".join(item["columns"])
+            kind = "UNIQUE " if item["unique"] else ""
+            self.stdout.write(f"{item['index']} — {kind}{item['table']} ({columns})")
+            if item["served_by"] is None:
+                self.stdout.write(self.style.WARNING("  missing"))
+            else:
+                via = "" if item["served_by"] == item["index"] else f" via {item['served_by']}"
+                self.stdout.write(f"  present{via}, scans: {item['scans']}, size: {item['size']}")
+            for query in item["serves"]:
+                self.stdout.write(f"  serves: {query}")
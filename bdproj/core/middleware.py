@@ -0,0 +1,160 @@
+import json
+import logging
+
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+
+from core.utils import routing
+from core.utils.cache import invalidation_bus
+from core.utils.instrumentation import QueryCollector, collect_queries
+from core.utils.slow_queries import current_view
+
+
+logger = logging.getLogger("core.sql")
+
+
+class SQLInstrumentationMiddleware:
+    """
+    Считает SQL-запросы каждого HTTP-запроса.
+
+    Добавляет к ответу заголовок Server-Timing (число запросов и время в
+    базе) и пишет в лог "core.sql" строку JSON с метрикой запроса: с уровнем
+    DEBUG, а с уровнем WARNING — если один и тот же запрос выполнен не
+    меньше SQL_N_PLUS_ONE_THRESHOLD раз (N+1), обращений к базе не меньше
+    SQL_QUERY_COUNT_THRESHOLD или время в базе не меньше
+    SQL_DB_TIME_THRESHOLD_MS.
+
+    Запросы считаются через execute_wrapper соединений, а не через
+    core.utils.query.add_query_hook: обработчики слоя общие для всех потоков
+    процесса и не видят отдельных обращений к базе (PREPARE перед первым
+    EXECUTE, запросы самого Django).
+
+    Для потоковых ответов запросы, выполненные при отдаче тела, попадают
+    в лог после его завершения; заголовок содержит только то, что было
+    выполнено до начала отдачи.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, "SQL_INSTRUMENTATION", True)
+        self.threshold = getattr(settings, "SQL_N_PLUS_ONE_THRESHOLD", 5)
+        self.query_count_threshold = getattr(settings, "SQL_QUERY_COUNT_THRESHOLD", 30)
+        self.db_time_threshold = getattr(settings, "SQL_DB_TIME_THRESHOLD_MS", 500) / 1000
+
+    def __call__(self, request):
+        token = current_view.set(None)
+        try:
+            if not self.enabled:
+                return self.get_response(request)
+
+            collector = QueryCollector()
+            with collect_queries(collector):
+                response = self.get_response(request)
+            view = current_view.get()
+        finally:
+            current_view.reset(token)
+
+        response["Server-Timing"] = self.server_timing(collector)
+
+        if response.streaming:
+            response.streaming_content = self.stream(
+                request, response, collector, view, response.streaming_content
+            )
+        else:
+            self.log(request, response, collector)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Имя представления для журнала медленных запросов
+        view = getattr(view_func, "view_class", view_func)
+        current_view.set(f"{view.__module__}.{view.__qualname__}")
+
+    def stream(self, request, response, collector, view, content):
+        token = current_view.set(view)
+        try:
+            with collect_queries(collector):
+                yield from content
+        finally:
+            current_view.reset(token)
+        self.log(request, response, collector)
+
+    def server_timing(self, collector):
+        metrics = [f'db;desc="{collector.count} queries";dur={collector.duration * 1000:.2f}']
+        repeated = collector.repeated(self.threshold)
+        if repeated:
+            metrics.append(f'db-repeated;desc="{repeated[0][1]}x same query"')
+        return ", ".join(metrics)
+
+    def log(self, request, response, collector):
+        repeated = collector.repeated(self.threshold)
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "queries": collector.count,
+            "db_time_ms": round(collector.duration * 1000, 2),
+            "distinct_queries": len(collector.statements),
+            "n_plus_one": bool(repeated),
+        }
+        if repeated:
+            record["repeated"] = [
+                {"sql": " ".join(sql.split())[:200], "count": count}
+                for sql, count in repeated
+            ]
+        if (
+            repeated
+            or collector.count >= self.query_count_threshold
+            or collector.duration >= self.db_time_threshold
+        ):
+            logger.warning(json.dumps(record, ensure_ascii=False))
+        else:
+            logger.debug(json.dumps(record, ensure_ascii=False))
+
+
+class CacheInvalidationMiddleware:
+    """
+    В начале запроса применяет сбросы кэшей, сделанные другими процессами
+    (core.utils.cache.invalidation_bus). Общий кэш опрашивается не чаще
+    раза в CACHE_INVALIDATION_POLL_INTERVAL секунд.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            invalidation_bus.poll()
+        except Exception:
+            # Недоступный общий кэш не должен ронять запрос: локальные
+            # копии проживут не дольше своего ttl
+            logging.getLogger("core.cache").exception("Unable to poll cache invalidations")
+        return self.get_response(request)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Сбрасывает пользователя маршрутизации (core.utils.routing) в начале
+    запроса и после успешного изменяющего запроса (POST, PUT, PATCH, DELETE)
+    открывает для пользователя окно чтения с основной базы.
+
+    Так ученик сразу видит свой прогресс после отправки теста, даже если
+    реплика ещё не догнала основную базу.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routing.reset_current_user()
+        try:
+            response = self.get_response(request)
+            user_id = routing.current_user()
+            if (
+                user_id is not None
+                and request.method not in SAFE_METHODS
+                and response.status_code < 400
+            ):
+                routing.stick_to_primary(user_id)
+            return response
+        finally:
+            routing.reset_current_user()
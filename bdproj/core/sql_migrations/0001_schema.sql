@@ -0,0 +1,116 @@
+-- Схема базы платформы. Таблицы создаются только если их ещё нет,
+-- поэтому миграцию можно применять и к уже существующей базе.
+
+CREATE TABLE IF NOT EXISTS roles (
+    id serial PRIMARY KEY,
+    name varchar(128) UNIQUE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS levels (
+    id serial PRIMARY KEY,
+    name varchar(128) UNIQUE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    id serial PRIMARY KEY,
+    fio varchar(255),
+    email varchar(255) UNIQUE NOT NULL,
+    password varchar(255) NOT NULL,
+    is_active boolean DEFAULT true,
+    role_id int REFERENCES roles(id) DEFAULT 2,
+    level_id int REFERENCES levels(id) DEFAULT 1,
+    entrance_test boolean DEFAULT false
+);
+
+CREATE TABLE IF NOT EXISTS usertoken (
+    id serial PRIMARY KEY,
+    key varchar(64) UNIQUE NOT NULL,
+    user_id int UNIQUE REFERENCES users(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS categorymaterials (
+    id serial PRIMARY KEY,
+    name varchar(128) UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS modules (
+    id serial PRIMARY KEY,
+    name varchar(255),
+    description text,
+    level_id int REFERENCES levels(id)
+);
+
+CREATE TABLE IF NOT EXISTS topics (
+    id serial PRIMARY KEY,
+    name varchar(255),
+    description text,
+    module_id int REFERENCES modules(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS tests (
+    id serial PRIMARY KEY,
+    name varchar(255),
+    module_id int REFERENCES modules(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS optionss (
+    id serial PRIMARY KEY,
+    value text
+);
+
+CREATE TABLE IF NOT EXISTS questions (
+    id serial PRIMARY KEY,
+    name text,
+    correct_answer_id int REFERENCES optionss(id) ON DELETE SET NULL,
+    topic_id int REFERENCES topics(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS testsquestions (
+    id serial PRIMARY KEY,
+    test_id int REFERENCES tests(id) ON DELETE CASCADE,
+    question_id int REFERENCES questions(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS questionoptions (
+    id serial PRIMARY KEY,
+    question_id int REFERENCES questions(id) ON DELETE CASCADE,
+    option_id int REFERENCES optionss(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS usertestprogress (
+    id serial PRIMARY KEY,
+    user_id int REFERENCES users(id) ON DELETE CASCADE,
+    test_id int REFERENCES tests(id) ON DELETE CASCADE,
+    is_passed boolean DEFAULT false,
+    attempts int DEFAULT 0,
+    correct_answers int DEFAULT 0,
+    UNIQUE (user_id, test_id)
+);
+
+CREATE TABLE IF NOT EXISTS courseprogress (
+    id serial PRIMARY KEY,
+    user_id int REFERENCES users(id) ON DELETE CASCADE,
+    is_complite_course boolean DEFAULT false,
+    completion_percentage float DEFAULT 0,
+    modules_complite int DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS materials (
+    id serial PRIMARY KEY,
+    topic_id int REFERENCES topics(id) ON DELETE CASCADE,
+    categorymaterials_id int REFERENCES categorymaterials(id),
+    content text,
+    file_url varchar(255),
+    file_metadata text
+);
+
+CREATE TABLE IF NOT EXISTS usersmodules (
+    id serial PRIMARY KEY,
+    user_id int REFERENCES users(id) ON DELETE CASCADE,
+    module_id int REFERENCES modules(id) ON DELETE CASCADE,
+    UNIQUE (user_id, module_id)
+);
+
+-- Справочник ролей: 1 — администратор, 2 — ученик
+INSERT INTO roles (id, name) VALUES (1, 'admin'), (2, 'student') ON CONFLICT DO NOTHING;
+SELECT setval(pg_get_serial_sequence('roles', 'id'), (SELECT MAX(id) FROM roles));
@@ -0,0 +1,84 @@
+-- Индексы под частые запросы. Строит их CREATE INDEX CONCURRENTLY, без
+-- блокировки записи в таблицы. Если в базе уже есть равноценный индекс
+-- (например, созданный ограничением UNIQUE), новый не создаётся.
+--
+-- Строки "-- serves:" перечисляют запросы, которые обслуживает индекс;
+-- их выводит manage.py migrate_sql --report. Комментарии не входят
+-- в контрольную сумму миграции, их можно править после применения.
+
+-- serves: auth_users.utils.required.TOKEN_USER_QUERY (каждый запрос с токеном)
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS usertoken_key_uniq ON usertoken (key);
+
+-- serves: auth_users.views.LoginUserAPIView (INSERT ... ON CONFLICT (user_id))
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS usertoken_user_id_uniq ON usertoken (user_id);
+
+-- serves: auth_users.views.LoginUserAPIView (поиск по email)
+-- serves: auth_users.views.RegisterUserAPIView (проверка занятости email)
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS users_email_uniq ON users (email);
+
+-- Запись на модули в админке не проверяла повторы, и одна и та же пара
+-- (пользователь, модуль) могла записаться несколько раз: из повторов
+-- остаётся первая запись
+DELETE FROM usersmodules d
+USING usersmodules k
+WHERE d.user_id = k.user_id
+  AND d.module_id = k.module_id
+  AND k.id < d.id;
+
+-- serves: userpanel.utils.curriculum.USER_MODULE_IDS_QUERY (WHERE user_id = %s)
+-- serves: userpanel.views.ASSIGN_LEVEL_MODULES_QUERY (INSERT ... ON CONFLICT DO NOTHING)
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS usersmodules_user_module_uniq ON usersmodules (user_id, module_id);
+
+-- Старый код сдачи теста проверял наличие строки и вставлял её без
+-- блокировки, поэтому параллельные сдачи могли оставить дубликаты, и
+-- уникальный индекс не строился бы. Из повторов остаётся лучшая попытка:
+-- сданная, с большим числом верных ответов, более поздняя
+DELETE FROM usertestprogress d
+USING usertestprogress k
+WHERE d.user_id = k.user_id
+  AND d.test_id = k.test_id
+  AND (coalesce(k.is_passed, false), coalesce(k.correct_answers, 0), k.id)
+    > (coalesce(d.is_passed, false), coalesce(d.correct_answers, 0), d.id);
+
+-- serves: userpanel.views.UPSERT_TEST_PROGRESS_QUERY (INSERT ... ON CONFLICT (user_id, test_id))
+-- serves: userpanel.views.PROMOTE_LEVEL_QUERY (WHERE user_id = %s AND is_passed)
+-- serves: userpanel.views.UserProgressAPIView (WHERE user_id = %s)
+-- serves: adminpanel.views (INSERT ... ON CONFLICT (user_id, test_id))
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS usertestprogress_user_test_uniq ON usertestprogress (user_id, test_id);
+
+-- Прогресс по курсу пересчитывается при каждой сдаче: из повторов
+-- остаётся последняя строка
+DELETE FROM courseprogress d
+USING courseprogress k
+WHERE d.user_id = k.user_id AND k.id > d.id;
+
+-- serves: userpanel.views.UPSERT_COURSE_PROGRESS_QUERY (INSERT ... ON CONFLICT (user_id))
+-- serves: userpanel.views.UserProgressAPIView (courseprogress WHERE user_id = %s)
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS courseprogress_user_uniq ON courseprogress (user_id);
+
+-- serves: userpanel.views.MODULE_TEST_QUERY, MODULE_TEST_JSON_QUERY (JOIN testsquestions ON test_id)
+-- serves: userpanel.views.EntranceTestAPIView (вопросы вступительного теста)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS testsquestions_test_id_idx ON testsquestions (test_id);
+
+-- serves: userpanel.views.MODULE_TEST_QUERY, MODULE_TEST_JSON_QUERY (JOIN questionoptions ON question_id)
+-- serves: userpanel.views.EntranceTestAPIView (варианты ответов)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS questionoptions_question_id_idx ON questionoptions (question_id);
+
+-- serves: userpanel.views.MODULE_TEST_QUERY, MODULE_TEST_JSON_QUERY (WHERE ts.module_id = %s)
+-- serves: userpanel.views.MODULE_SERVED_TEST_QUERY (WHERE ts.module_id = %s)
+-- serves: adminpanel.views (SELECT id FROM tests WHERE module_id = %s)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tests_module_id_idx ON tests (module_id);
+
+-- serves: userpanel.utils.curriculum.MODULE_TREE_QUERY (LEFT JOIN topics ON module_id)
+-- serves: modules ON DELETE CASCADE
+CREATE INDEX CONCURRENTLY IF NOT EXISTS topics_module_id_idx ON topics (module_id);
+
+-- serves: materials по теме и topics ON DELETE CASCADE
+CREATE INDEX CONCURRENTLY IF NOT EXISTS materials_topic_id_idx ON materials (topic_id);
+
+-- serves: topics ON DELETE CASCADE (questions.topic_id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS questions_topic_id_idx ON questions (topic_id);
+
+-- serves: userpanel.views.PROMOTE_LEVEL_QUERY (тесты модулей уровня, WHERE m.level_id = %s)
+-- serves: userpanel.views.LEVEL_MODULES_QUERY, ASSIGN_LEVEL_MODULES_QUERY (WHERE level_id = %s)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS modules_level_id_idx ON modules (level_id);
@@ -0,0 +1,13 @@
+-- Отзыв подписанных токенов (AUTH_TOKEN_MODE = "signed"): токены
+-- пользователя, выданные раньше revoked_before (мс с начала эпохи),
+-- недействительны. Строку нельзя удалять каскадно вместе с пользователем,
+-- иначе его токены снова станут действительными до истечения срока.
+
+CREATE TABLE IF NOT EXISTS tokenrevocations (
+    user_id int PRIMARY KEY,
+    revoked_before bigint NOT NULL,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+-- serves: auth_users.utils.signed_tokens.REVOCATIONS_QUERY (WHERE revoked_before > %s)
+CREATE INDEX IF NOT EXISTS tokenrevocations_revoked_before_idx ON tokenrevocations (revoked_before);
@@ -0,0 +1,10 @@
+-- Срок действия токенов: created_at — выдача, last_used_at — последнее
+-- использование (пишется пачками), expires_at — когда токен перестаёт
+-- действовать. Уже выданные токены получают срок по умолчанию.
+
+ALTER TABLE usertoken ADD COLUMN IF NOT EXISTS created_at timestamptz NOT NULL DEFAULT now();
+ALTER TABLE usertoken ADD COLUMN IF NOT EXISTS last_used_at timestamptz NOT NULL DEFAULT now();
+ALTER TABLE usertoken ADD COLUMN IF NOT EXISTS expires_at timestamptz NOT NULL DEFAULT now() + interval '7 days';
+
+-- serves: auth_users.management.commands.sweep_tokens (WHERE expires_at < now())
+CREATE INDEX CONCURRENTLY IF NOT EXISTS usertoken_expires_at_idx ON usertoken (expires_at);
@@ -0,0 +1,12 @@
+-- Метки вопросов: именованные наборы вопросов, из которых можно составлять
+-- вступительный тест (ENTRANCE_TEST_SOURCE = "tag:<метка>").
+
+CREATE TABLE IF NOT EXISTS questiontags (
+    tag varchar(64) NOT NULL,
+    question_id int NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+    PRIMARY KEY (tag, question_id)
+);
+
+-- serves: adminpanel.views.QuestionTagsAPIView (WHERE question_id = %s)
+-- serves: questions ON DELETE CASCADE (questiontags.question_id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS questiontags_question_id_idx ON questiontags (question_id);
@@ -0,0 +1,966 @@
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import psycopg2
+from psycopg2 import extensions
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .utils.pool import ConnectionPool, PoolTimeout
+from .utils.query import (
+    Statement,
+    add_query_hook,
+    execute_many,
+    execute_query,
+    execute_values,
+    is_read_only,
+    remove_query_hook,
+    stream_query,
+)
+from .middleware import ReplicaRoutingMiddleware, SQLInstrumentationMiddleware
+from .utils import routing
+from .utils.cache import InvalidationBus, TieredCache, invalidation_bus, shared_cache
+from .utils.slow_queries import SlowQueryRecorder, current_view, top_offenders
+from .utils.result_cache import (
+    MISS,
+    ResultCache,
+    cacheable_tables,
+    cascade_closure,
+    result_cache,
+    written_table,
+    written_tables,
+)
+from .utils.rows import ROW_DICT, Group, Mapper, json_or_none
+from .utils.sampling import SamplingPool, draw
+from .utils.sql_migrations import (
+    MIGRATIONS_DIR,
+    ExistingIndex,
+    MigrationRunner,
+    SQLStatement,
+    covering_index,
+    load_migrations,
+    parse_index,
+    split_statements,
+)
+from .utils.streaming import StreamingJsonResponse, accepts_encoding, iter_json_array
+from .utils.workers import PoolBusy, WorkerPool
+
+
+class FakeInfo:
+    def __init__(self):
+        self.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, params=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection")
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.info = FakeInfo()
+        self.rolled_back = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.rolled_back = True
+        self.info.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    def make_pool(self, **options):
+        options.setdefault("reap_interval", 0)
+        return ConnectionPool(connect=FakeConnection, **options)
+
+    def test_connection_is_reused(self):
+        pool = self.make_pool(min_size=0, max_size=2)
+        conn = pool.getconn()
+        pool.putconn(conn)
+        self.assertIs(pool.getconn(), conn)
+        self.assertEqual(pool.stats()["connections_opened"], 1)
+
+    def test_open_prefills_min_size(self):
+        pool = self.make_pool(min_size=3, max_size=5)
+        pool.open()
+        stats = pool.stats()
+        self.assertEqual(stats["size"], 3)
+        self.assertEqual(stats["idle"], 3)
+
+    def test_timeout_when_exhausted(self):
+        pool = self.make_pool(min_size=0, max_size=1, timeout=0.05)
+        pool.getconn()
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+        self.assertEqual(pool.stats()["timeouts"], 1)
+
+    def test_broken_connection_is_replaced(self):
+        pool = self.make_pool(min_size=0, check_interval=0)
+        conn = pool.getconn()
+        pool.putconn(conn)
+        conn.broken = True
+        fresh = pool.getconn()
+        self.assertIsNot(fresh, conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()["health_check_failures"], 1)
+
+    def test_open_transaction_is_rolled_back_on_return(self):
+        pool = self.make_pool(min_size=0)
+        conn = pool.getconn()
+        conn.info.transaction_status = extensions.TRANSACTION_STATUS_INTRANS
+        pool.putconn(conn)
+        self.assertTrue(conn.rolled_back)
+        self.assertEqual(pool.stats()["idle"], 1)
+
+    def test_expired_connection_is_closed_on_return(self):
+        pool = self.make_pool(min_size=0, max_lifetime=60)
+        conn = pool.getconn()
+        conn.created_at = time.monotonic() - 120
+        pool.putconn(conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()["size"], 0)
+
+    def test_reap_keeps_min_size(self):
+        pool = self.make_pool(min_size=1, max_size=3, max_idle=0.01)
+        conns = [pool.getconn() for _ in range(3)]
+        for conn in conns:
+            pool.putconn(conn)
+        time.sleep(0.02)
+        self.assertEqual(pool.reap(), 2)
+        self.assertEqual(pool.stats()["size"], 1)
+
+
+class PooledBackendTest(TransactionTestCase):
+    def test_connection_returns_to_pool(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        raw = connection.connection
+        connection.close()
+        self.assertIsNone(connection.connection)
+        self.assertFalse(raw.closed)
+        self.assertGreaterEqual(connection.pool.stats()["idle"], 1)
+
+
+class BatchWriteTest(TestCase):
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TEMP TABLE batch_items (id serial PRIMARY KEY, name text)")
+
+    def test_execute_values_returns_rows_in_order(self):
+        names = [f"item-{i}" for i in range(25)]
+        rows = execute_values(
+            "INSERT INTO batch_items (name) VALUES %s RETURNING id, name",
+            [(name,) for name in names],
+            page_size=10,
+            fetch=True,
+        )
+        self.assertEqual([row[1] for row in rows], names)
+
+    def test_execute_many_updates_all_rows(self):
+        execute_values("INSERT INTO batch_items (name) VALUES %s", [("a",), ("b",)])
+        execute_many(
+            "UPDATE batch_items SET name = %s WHERE name = %s",
+            [("x", "a"), ("y", "b")],
+            page_size=1,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM batch_items ORDER BY id")
+            self.assertEqual(cursor.fetchall(), [("x",), ("y",)])
+
+
+class StatementTest(SimpleTestCase):
+    def test_placeholders_are_converted(self):
+        statement = Statement("test_placeholders", "SELECT %s, '%%' || %s;")
+        self.assertEqual(statement.param_count, 2)
+        self.assertEqual(statement.prepare_sql, "PREPARE test_placeholders AS SELECT $1, '%' || $2")
+        self.assertEqual(statement.execute_sql, "EXECUTE test_placeholders (%s, %s)")
+
+    def test_name_conflict(self):
+        Statement("test_conflict", "SELECT 1")
+        with self.assertRaises(ValueError):
+            Statement("test_conflict", "SELECT 2")
+
+
+class QueryLayerTest(TestCase):
+    statement = Statement("test_add_one", "SELECT %s::int + 1")
+
+    def test_statement_is_prepared_once_per_connection(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(execute_query(self.statement, [1], fetchone=True), (2,))
+            self.assertEqual(execute_query(self.statement, [5], fetchone=True), (6,))
+        prepares = [q["sql"] for q in queries if q["sql"].startswith("PREPARE")]
+        self.assertLessEqual(len(prepares), 1)
+        self.assertTrue(queries[-1]["sql"].startswith("EXECUTE test_add_one"))
+
+    @override_settings(SQL_PREPARED_STATEMENTS=False)
+    def test_plain_execution_when_disabled(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(execute_query(self.statement, [1], fetchone=True), (2,))
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]["sql"].startswith("SELECT"))
+
+    def test_execute_query_with_mapper(self):
+        row = execute_query("SELECT 1 AS id, 'x' AS name", fetchone=True, mapper=ROW_DICT)
+        self.assertEqual(row, {"id": 1, "name": "x"})
+
+    def test_hooks_receive_timings(self):
+        calls = []
+
+        def hook(**kwargs):
+            calls.append(kwargs)
+
+        add_query_hook(hook)
+        try:
+            execute_query(self.statement, [1], fetchone=True)
+            execute_query("SELECT 1", fetchone=True)
+        finally:
+            remove_query_hook(hook)
+
+        self.assertEqual([call["name"] for call in calls], ["test_add_one", None])
+        self.assertTrue(all(call["duration"] >= 0 for call in calls))
+
+
+class StreamingTest(TestCase):
+    def test_stream_query_fetches_in_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(stream_query("SELECT generate_series(1, 25)", batch_size=10))
+        self.assertEqual([row[0] for row in rows], list(range(1, 26)))
+        # Запрос выполняется один раз, пачки дочитываются из того же курсора
+        self.assertEqual(len(queries), 1)
+
+    def test_iter_json_array(self):
+        items = ({"id": i} for i in range(100))
+        chunks = list(iter_json_array(items, chunk_size=64))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(json.loads("".join(chunks)), [{"id": i} for i in range(100)])
+        self.assertEqual("".join(iter_json_array([])), "[]")
+
+    def test_streaming_json_response(self):
+        response = StreamingJsonResponse(iter([{"a": 1}, {"a": 2}]), status=200)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(json.loads(b"".join(response.streaming_content)), [{"a": 1}, {"a": 2}])
+
+    def test_accepts_encoding(self):
+        def accepts(header):
+            return accepts_encoding(RequestFactory().get("/", HTTP_ACCEPT_ENCODING=header), "gzip")
+
+        self.assertTrue(accepts("gzip, deflate, br"))
+        self.assertTrue(accepts("br;q=1.0, GZIP;q=0.5"))
+        self.assertTrue(accepts("*"))
+        self.assertFalse(accepts("gzip;q=0"))
+        self.assertFalse(accepts("gzip;q=0.000, *"))
+        self.assertFalse(accepts("*;q=0"))
+        self.assertFalse(accepts("deflate, br"))
+        self.assertFalse(accepts(""))
+
+
+def describe(*columns):
+    return [(column, None, None, None, None, None, None) for column in columns]
+
+
+class RowMapperTest(SimpleTestCase):
+    def test_row_dict_uses_column_names(self):
+        description = describe("id", "name")
+        self.assertEqual(ROW_DICT.map_all(description, [(1, "a"), (2, "b")]),
+                         [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}])
+        self.assertIs(ROW_DICT.bind(description), ROW_DICT.bind(describe("id", "name")))
+
+    def test_fields_and_converters(self):
+        mapper = Mapper({"id": "id", "meta": "file_metadata"}, converters={"meta": json_or_none})
+        description = describe("file_metadata", "id")
+        self.assertEqual(mapper.map_one(description, ('{"size": 1}', 7)), {"id": 7, "meta": {"size": 1}})
+        self.assertEqual(mapper.map_one(description, (None, 8)), {"id": 8, "meta": None})
+
+    def test_duplicate_and_missing_columns(self):
+        with self.assertRaises(ValueError):
+            ROW_DICT.bind(describe("id", "id"))
+        with self.assertRaises(ValueError):
+            Mapper(["missing"]).bind(describe("id"))
+
+    def test_nested_group(self):
+        group = Group(
+            "question_id",
+            {"id": "question_id"},
+            children={"options": Group("option_id", {"id": "option_id", "text": "option_text"})},
+        )
+        description = describe("question_id", "option_id", "option_text")
+        rows = [(1, 10, "a"), (1, 11, "b"), (2, None, None), (1, 10, "a"), (3, 12, "c")]
+        self.assertEqual(group.map_all(description, rows), [
+            {"id": 1, "options": [{"id": 10, "text": "a"}, {"id": 11, "text": "b"}]},
+            {"id": 2, "options": []},
+            {"id": 3, "options": [{"id": 12, "text": "c"}]},
+        ])
+
+
+class SQLInstrumentationTest(TestCase):
+    def run_view(self, repeats):
+        def view(request):
+            for i in range(repeats):
+                execute_query("SELECT %s", [i], fetchone=True)
+            return HttpResponse("ok")
+
+        request = RequestFactory().get("/api/test/")
+        return SQLInstrumentationMiddleware(view)(request)
+
+    def test_server_timing_and_log(self):
+        with self.assertLogs("core.sql", "DEBUG") as logs:
+            response = self.run_view(2)
+        self.assertTrue(response["Server-Timing"].startswith('db;desc="2 queries";dur='))
+        self.assertEqual(logs.records[0].levelname, "DEBUG")
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["queries"], 2)
+        self.assertEqual(record["path"], "/api/test/")
+        self.assertFalse(record["n_plus_one"])
+
+    @override_settings(SQL_QUERY_COUNT_THRESHOLD=3)
+    def test_many_queries_are_logged_as_warning(self):
+        with self.assertLogs("core.sql", "WARNING") as logs:
+            self.run_view(3)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["queries"], 3)
+        self.assertFalse(record["n_plus_one"])
+
+    @override_settings(SQL_N_PLUS_ONE_THRESHOLD=3)
+    def test_repeated_queries_are_flagged(self):
+        with self.assertLogs("core.sql", "WARNING") as logs:
+            response = self.run_view(4)
+        self.assertIn('db-repeated;desc="4x same query"', response["Server-Timing"])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertTrue(record["n_plus_one"])
+        self.assertEqual(record["repeated"][0]["count"], 4)
+
+
+@override_settings(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_EXPLAIN_INTERVAL=0)
+class SlowQueryLogTest(TestCase):
+    def setUp(self):
+        # При нулевом пороге общий recorder соединения пишет каждый запрос
+        # теста: журнал уводится во временный каталог
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log_file = os.path.join(directory.name, "slow.log")
+        settings_override = self.settings(SLOW_QUERY_LOG_FILE=self.log_file)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        logger = logging.getLogger("core.slow_queries")
+        handler = logging.FileHandler(self.log_file, encoding="utf-8", delay=True)
+        self.addCleanup(setattr, logger, "handlers", logger.handlers[:])
+        self.addCleanup(handler.close)
+        logger.handlers = [handler]
+
+    def record(self, sql, params=None):
+        recorder = SlowQueryRecorder()
+        with self.assertLogs("core.slow_queries", "WARNING") as logs:
+            with connection.execute_wrapper(recorder):
+                execute_query(sql, params, fetchall=True)
+        return [json.loads(record.getMessage()) for record in logs.records]
+
+    def test_slow_select_is_logged_with_plan(self):
+        token = current_view.set("adminpanel.views.AdminUserAPIView")
+        try:
+            entry = self.record("SELECT %s::int AS value", [1])[-1]
+        finally:
+            current_view.reset(token)
+        self.assertEqual(entry["sql"], "SELECT %s::int AS value")
+        self.assertEqual(entry["params"], [1])
+        self.assertEqual(entry["view"], "adminpanel.views.AdminUserAPIView")
+        self.assertIn("Plan", entry["plan"][0])
+        # Запрос под EXPLAIN выполняется внутри транзакции теста без её прерывания
+        self.assertEqual(execute_query("SELECT 1", fetchone=True), (1,))
+
+    def test_writes_are_not_explained(self):
+        execute_query("CREATE TEMP TABLE slow_items (id int)")
+        entry = self.record("INSERT INTO slow_items VALUES (1) RETURNING id")[-1]
+        self.assertIsNone(entry["plan"])
+        self.assertEqual(execute_query("SELECT count(*) FROM slow_items", fetchone=True), (1,))
+
+    def test_service_statements_are_skipped(self):
+        recorder = SlowQueryRecorder()
+        with mock.patch.object(recorder, "record") as record:
+            with connection.execute_wrapper(recorder):
+                with transaction.atomic():
+                    execute_query("SET LOCAL statement_timeout = 0")
+                    execute_query("SELECT 1", fetchone=True)
+        self.assertEqual([call.args[0] for call in record.call_args_list], ["SELECT 1"])
+
+    def test_explained_queries_are_bounded(self):
+        recorder = SlowQueryRecorder(max_explained=2)
+        for sql in ("SELECT 1", "SELECT 2", "SELECT 3"):
+            self.assertTrue(recorder._should_explain(sql))
+        self.assertEqual(list(recorder._explained), ["SELECT 2", "SELECT 3"])
+
+    def test_top_offenders(self):
+        entries = [
+            {"time": "t1", "sql": "SELECT a", "params": [], "duration_ms": 300, "view": "A", "plan": None},
+            {"time": "t2", "sql": "SELECT b", "params": [], "duration_ms": 500, "view": "B", "plan": None},
+            {"time": "t3", "sql": "SELECT a", "params": [1], "duration_ms": 400, "view": "A", "plan": [{}]},
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "slow.log")
+            with open(path + ".1", "w") as log_file:
+                log_file.write(json.dumps(entries[0]) + "\n")
+            with open(path, "w") as log_file:
+                log_file.write("".join(json.dumps(entry) + "\n" for entry in entries[1:]))
+            offenders = top_offenders(path=path)
+
+        self.assertEqual([item["sql"] for item in offenders], ["SELECT a", "SELECT b"])
+        self.assertEqual(offenders[0]["count"], 2)
+        self.assertEqual(offenders[0]["avg_ms"], 350)
+        self.assertEqual(offenders[0]["last_params"], [1])
+        self.assertEqual(offenders[0]["plan"], [{}])
+
+
+@mock.patch.object(routing, "replica_alias", return_value="replica")
+class ReplicaRoutingTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        routing.reset_current_user()
+
+    def tearDown(self):
+        routing.reset_current_user()
+
+    def test_reads_go_to_replica(self, replica_alias):
+        self.assertEqual(routing.read_alias(), "replica")
+        routing.set_current_user(7)
+        self.assertEqual(routing.read_alias(), "replica")
+
+    def test_reads_stick_to_primary_after_write(self, replica_alias):
+        routing.set_current_user(7)
+        routing.stick_to_primary(7)
+        self.assertEqual(routing.read_alias(), "default")
+        # Следующий запрос того же пользователя в пределах окна
+        routing.set_current_user(7)
+        self.assertEqual(routing.read_alias(), "default")
+        routing.set_current_user(8)
+        self.assertEqual(routing.read_alias(), "replica")
+
+    def test_reads_inside_transaction_use_primary(self, replica_alias):
+        with mock.patch.object(connection, "in_atomic_block", True):
+            self.assertEqual(routing.read_alias(), "default")
+
+    def test_middleware_sticks_after_unsafe_request(self, replica_alias):
+        def view(request):
+            routing.set_current_user(7)
+            return HttpResponse(status=200 if request.method == "POST" else 400)
+
+        middleware = ReplicaRoutingMiddleware(view)
+        middleware(RequestFactory().put("/"))
+        routing.set_current_user(7)
+        self.assertEqual(routing.read_alias(), "replica")
+
+        middleware(RequestFactory().post("/"))
+        routing.set_current_user(7)
+        self.assertEqual(routing.read_alias(), "default")
+
+    def test_is_read_only(self, replica_alias):
+        self.assertTrue(is_read_only("SELECT 1"))
+        self.assertTrue(is_read_only(Statement("test_read_only", "WITH t AS (SELECT 1) SELECT * FROM t")))
+        self.assertFalse(is_read_only("INSERT INTO t VALUES (1)"))
+        self.assertFalse(is_read_only("SELECT id FROM users WHERE id = 1 FOR UPDATE"))
+        self.assertFalse(is_read_only("WITH t AS (DELETE FROM x RETURNING id) SELECT * FROM t"))
+
+
+class ResultCacheTest(SimpleTestCase):
+    def test_lru_eviction(self):
+        cache = ResultCache(max_entries=2)
+        cache.set("a", 1, {"roles"})
+        cache.set("b", 2, {"roles"})
+        cache.get("a")
+        cache.set("c", 3, {"levels"})
+        self.assertIs(cache.get("b"), MISS)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_invalidation_by_table(self):
+        cache = ResultCache()
+        cache.set("modules", 1, {"modules"})
+        cache.set("join", 2, {"modules", "topics"})
+        cache.set("levels", 3, {"levels"})
+        cache.invalidate("topics")
+        self.assertEqual(cache.get("modules"), 1)
+        self.assertIs(cache.get("join"), MISS)
+        self.assertEqual(cache.get("levels"), 3)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["invalidations"]), (2, 1, 1))
+
+    def test_written_after(self):
+        cache = ResultCache()
+        since = time.monotonic()
+        self.assertFalse(cache.written_after({"roles"}, since))
+        cache.invalidate("roles")
+        self.assertTrue(cache.written_after({"roles", "levels"}, since))
+
+    def test_expired_entry_is_a_miss(self):
+        cache = ResultCache(ttl=-1)
+        cache.set("a", 1, {"roles"})
+        self.assertIs(cache.get("a"), MISS)
+
+    def test_tables(self):
+        self.assertEqual(cacheable_tables("SELECT * FROM Modules m JOIN topics t ON t.module_id = m.id"),
+                         frozenset({"modules", "topics"}))
+        self.assertIsNone(cacheable_tables("SELECT * FROM modules JOIN usersmodules ON true"))
+        self.assertIsNone(cacheable_tables("SELECT 1"))
+        self.assertIsNone(cacheable_tables("SELECT id FROM modules ORDER BY random()"))
+        self.assertEqual(written_table("\n  UPDATE modules SET name = %s"), "modules")
+        self.assertEqual(written_table("DELETE FROM topics WHERE id = %s"), "topics")
+        self.assertIsNone(written_table("SELECT 1"))
+
+    def test_comma_joined_tables_are_tagged(self):
+        self.assertEqual(cacheable_tables("SELECT * FROM modules m, topics AS t WHERE t.module_id = m.id"),
+                         frozenset({"modules", "topics"}))
+        self.assertIsNone(cacheable_tables("SELECT * FROM modules, usersmodules WHERE true"))
+
+    def test_deletes_invalidate_cascades(self):
+        self.assertEqual(written_tables("UPDATE modules SET name = %s"), {"modules"})
+        self.assertEqual(written_tables("INSERT INTO optionss (value) VALUES (%s)"), {"optionss"})
+        self.assertEqual(
+            written_tables("DELETE FROM modules WHERE id = %s"),
+            {"modules", "topics", "tests", "usersmodules", "questions", "materials", "testsquestions",
+             "usertestprogress", "questionoptions", "questiontags"},
+        )
+        # SET NULL меняет строки questions, но не удаляет их: дальше каскад не идёт
+        self.assertEqual(written_tables("DELETE FROM optionss WHERE id = %s"),
+                         {"optionss", "questions", "questionoptions"})
+        self.assertEqual(cascade_closure("a", {"a": {"b": "SET NULL", "c": "CASCADE"}, "c": {"b": "CASCADE"},
+                                               "b": {"d": "CASCADE"}}),
+                         {"a", "b", "c", "d"})
+
+    def test_cascades_match_schema(self):
+        cascades = {}
+        for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+            for child, body in re.findall(r"CREATE TABLE IF NOT EXISTS (\w+) \((.*?)\n\);", path.read_text(), re.S):
+                for parent, action in re.findall(r"REFERENCES (\w+)\(id\) ON DELETE (CASCADE|SET NULL)", body):
+                    cascades.setdefault(parent, {})[child] = action
+        self.assertEqual(settings.RESULT_CACHE_CASCADES, cascades)
+
+
+@override_settings(RESULT_CACHE_TABLES=["cache_items"])
+class QueryResultCacheTest(TransactionTestCase):
+    def setUp(self):
+        result_cache.clear()
+        execute_query("CREATE TABLE cache_items (id int, name text)")
+        execute_query("INSERT INTO cache_items VALUES (1, 'a')")
+
+    def tearDown(self):
+        execute_query("DROP TABLE cache_items")
+        result_cache.clear()
+
+    def test_catalog_reads_are_cached_until_write(self):
+        query = "SELECT name FROM cache_items WHERE id = %s"
+        self.assertEqual(execute_query(query, [1], fetchone=True), ("a",))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(execute_query(query, [1], fetchone=True, mapper=ROW_DICT), {"name": "a"})
+        self.assertEqual(len(queries), 0)
+
+        execute_query("UPDATE cache_items SET name = 'b' WHERE id = 1")
+        self.assertEqual(execute_query(query, [1], fetchone=True), ("b",))
+
+    def test_writes_inside_transaction_invalidate_on_commit(self):
+        query = "SELECT count(*) FROM cache_items"
+        self.assertEqual(execute_query(query, fetchone=True), (1,))
+        with transaction.atomic():
+            execute_values("INSERT INTO cache_items (id, name) VALUES %s", [(2, "b"), (3, "c")])
+            self.assertEqual(execute_query(query, fetchone=True), (3,))
+        self.assertEqual(execute_query(query, fetchone=True), (3,))
+
+    @override_settings(
+        RESULT_CACHE_TABLES=["cache_items", "cache_children"],
+        RESULT_CACHE_CASCADES={"cache_items": {"cache_children": "CASCADE"}},
+    )
+    def test_cascading_delete_invalidates_children(self):
+        execute_query("ALTER TABLE cache_items ADD PRIMARY KEY (id)")
+        execute_query(
+            "CREATE TABLE cache_children (id int, item_id int REFERENCES cache_items(id) ON DELETE CASCADE)"
+        )
+        try:
+            execute_query("INSERT INTO cache_children VALUES (1, 1)")
+            query = "SELECT count(*) FROM cache_children"
+            self.assertEqual(execute_query(query, fetchone=True), (1,))
+            execute_query("DELETE FROM cache_items WHERE id = 1")
+            self.assertEqual(execute_query(query, fetchone=True), (0,))
+        finally:
+            execute_query("DROP TABLE cache_children")
+
+
+# Схлопывание сборок и удаление по ключам проверяются на кэше
+# с атомарными add/incr
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "shared"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SharedCacheTest(SimpleTestCase):
+    def setUp(self):
+        shared_cache().clear()
+        self.addCleanup(shared_cache().clear)
+
+    def worker(self):
+        # Отдельная шина и локальный уровень — как в другом процессе
+        return TieredCache("test_tiered", bus=InvalidationBus(poll_interval=0))
+
+    def test_value_is_shared_between_workers(self):
+        first, second = self.worker(), self.worker()
+        first.set("a", {"x": 1})
+        self.assertEqual(second.get("a"), {"x": 1})
+        self.assertEqual(second.get("a"), {"x": 1})
+        self.assertEqual(second.stats()["shared_hits"], 1)
+        self.assertEqual(second.stats()["local_hits"], 1)
+
+    def test_delete_reaches_other_workers_on_poll(self):
+        first, second = self.worker(), self.worker()
+        first.set("a", 1)
+        second.get("a")
+        first.delete("a")
+        self.assertEqual(second.get("a"), 1)
+        second.shared.bus.poll()
+        self.assertIs(second.get("a"), MISS)
+
+    def test_delete_drops_only_deleted_keys_elsewhere(self):
+        first, second = self.worker(), self.worker()
+        second.shared.bus.poll()
+        first.set("a", 1)
+        first.set("b", 2)
+        second.get("a"), second.get("b")
+        first.delete("a")
+        second.shared.bus.poll()
+        self.assertIs(second.local.get("a"), MISS)
+        self.assertEqual(second.local.get("b"), 2)
+
+    def test_lost_delete_events_drop_local_tier(self):
+        first, second = self.worker(), self.worker()
+        second.shared.bus.poll()
+        first.set("b", 2)
+        second.get("b")
+        first.delete("a")
+        shared_cache().delete(InvalidationBus.EVENT_KEY.format("test_tiered", 1))
+        second.shared.bus.poll()
+        self.assertIs(second.local.get("b"), MISS)
+
+    def test_non_atomic_backend_drops_namespace(self):
+        first, second = self.worker(), self.worker()
+        second.shared.bus.poll()
+        first.set("b", 2)
+        second.get("b")
+        with mock.patch("core.utils.cache.atomic_cache", return_value=False):
+            first.delete("a")
+            self.assertEqual(first.get_or_build("c", lambda: 3), 3)
+        second.shared.bus.poll()
+        self.assertIs(second.local.get("b"), MISS)
+        self.assertIs(shared_cache().get(first.shared.key("c:building")), None)
+
+    def test_clear_starts_new_generation(self):
+        first, second = self.worker(), self.worker()
+        first.set("a", 1)
+        second.shared.bus.poll()
+        first.clear()
+        second.shared.bus.poll()
+        self.assertIs(second.get("a"), MISS)
+        first.set("a", 2)
+        self.assertEqual(second.get("a"), 2)
+
+    def test_concurrent_misses_build_once(self):
+        workers = [self.worker() for _ in range(2)]
+        builds = []
+
+        def build():
+            builds.append(1)
+            time.sleep(0.05)
+            return "value"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda cache=cache: results.append(cache.get_or_build("key", build)))
+            for cache in workers * 4
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["value"] * 8)
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(sum(cache.stats()["coalesced"] for cache in workers), 7)
+
+    def test_build_started_before_clear_is_not_kept(self):
+        cache = self.worker()
+
+        def build():
+            cache.clear()
+            return "stale"
+
+        self.assertEqual(cache.get_or_build("key", build), "stale")
+        self.assertIs(cache.get("key"), MISS)
+        self.assertEqual(cache.get_or_build("key", lambda: "fresh"), "fresh")
+
+    def test_poll_is_rate_limited(self):
+        bus = InvalidationBus(poll_interval=60)
+        calls = []
+        bus.subscribe("topic", calls.append)
+        bus.poll()
+        shared_cache().set(InvalidationBus.KEY.format("topic"), "remote", timeout=None)
+        bus.poll()
+        self.assertEqual(calls, [])
+        bus.poll(force=True)
+        self.assertEqual(calls, ["topic"])
+
+    def test_remote_write_invalidates_result_cache(self):
+        result_cache.clear()
+        self.addCleanup(result_cache.clear)
+        result_cache.set("key", "value", frozenset({"modules"}))
+        invalidation_bus.poll(force=True)
+        shared_cache().set(InvalidationBus.KEY.format("table:modules"), "remote", timeout=None)
+        invalidation_bus.poll(force=True)
+        self.assertIs(result_cache.get("key"), MISS)
+
+
+class WorkerPoolTest(SimpleTestCase):
+    def setUp(self):
+        self.pool = WorkerPool("test", max_workers=1, max_queue=1, timeout=5)
+        self.addCleanup(self.pool.shutdown)
+
+    def test_run_returns_result_and_counts(self):
+        self.assertEqual(self.pool.run(pow, 2, 10), 1024)
+        with self.assertRaises(ZeroDivisionError):
+            self.pool.run(divmod, 1, 0)
+        stats = self.pool.stats()
+        self.assertEqual((stats["submitted"], stats["completed"], stats["failed"], stats["in_flight"]), (2, 1, 1, 0))
+
+    def test_full_queue_is_rejected(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        threads = [threading.Thread(target=self.pool.run, args=(block,)) for _ in range(2)]
+        threads[0].start()
+        started.wait(5)
+        threads[1].start()
+        while self.pool.stats()["in_flight"] < 2:
+            time.sleep(0.001)
+        with self.assertRaises(PoolBusy):
+            self.pool.run(block)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.pool.stats()["rejected"], 1)
+
+    def test_timeout_releases_slot(self):
+        pool = WorkerPool("slow", max_workers=1, max_queue=1, timeout=0.01)
+        self.addCleanup(pool.shutdown)
+        release = threading.Event()
+        with self.assertRaises(PoolBusy):
+            pool.run(release.wait, 5)
+        with self.assertRaises(PoolBusy):
+            pool.run(release.wait, 5)
+        release.set()
+        self.assertEqual(pool.run(pow, 2, 3), 8)
+        self.assertEqual(pool.stats()["timeouts"], 2)
+
+
+class SamplingPoolTest(SimpleTestCase):
+    def setUp(self):
+        # 3 уровня по 10 элементов
+        self.pool = SamplingPool(
+            [{"id": number, "level": number % 3} for number in range(30)],
+            key=lambda item: item["id"],
+            groups={"level": lambda item: item["level"]},
+        )
+
+    def test_draw_touches_only_count_items(self):
+        population = mock.MagicMock()
+        population.__len__.return_value = 10 ** 9
+        population.__getitem__.side_effect = lambda index: index
+        picked = draw(population, 5, random.Random(1))
+        self.assertEqual(len(set(picked)), 5)
+        self.assertEqual(population.__getitem__.call_count, 5)
+
+    def test_quotas_and_size(self):
+        picked = self.pool.sample(10, quotas={"level": 3})
+        self.assertEqual(len({item["id"] for item in picked}), 10)
+        levels = [item["level"] for item in picked]
+        self.assertTrue(all(levels.count(level) >= 3 for level in range(3)))
+
+        picked = self.pool.sample(quotas={"level": {0: 2, 2: 1}})
+        self.assertEqual(sorted(item["level"] for item in picked), [0, 0, 2])
+        self.assertEqual(len(self.pool.sample(100)), 30)
+
+    def test_exclude(self):
+        excluded = set(range(0, 30, 2))
+        picked = self.pool.sample(15, quotas={"level": 5}, exclude=excluded)
+        self.assertEqual({item["id"] for item in picked}, set(range(1, 30, 2)))
+
+    def test_seed_is_reproducible(self):
+        first = self.pool.sample(8, quotas={"level": 2}, seed="user-1")
+        self.assertEqual(self.pool.sample(8, quotas={"level": 2}, seed="user-1"), first)
+        self.assertNotEqual(
+            [item["id"] for item in self.pool.sample(8, seed="user-2")],
+            [item["id"] for item in self.pool.sample(8, seed="user-3")],
+        )
+
+
+class SQLMigrationParsingTest(SimpleTestCase):
+    def test_split_statements(self):
+        sql = (
+            "-- header\n\n"
+            "-- serves: some view\n"
+            "INSERT INTO t VALUES (';', 'it''s'); -- trailing\n"
+            "DO $body$ BEGIN PERFORM 1; END $body$;\n"
+            "/* ; */ SELECT \"a;b\";"
+        )
+        statements = split_statements(sql)
+        self.assertEqual([statement.sql for statement in statements], [
+            "INSERT INTO t VALUES (';', 'it''s')",
+            "DO $body$ BEGIN PERFORM 1; END $body$",
+            '/* ; */ SELECT "a;b"',
+        ])
+        self.assertEqual(statements[0].comments, ("-- serves: some view",))
+
+    def test_parse_index(self):
+        spec = parse_index(SQLStatement(
+            "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS t_uniq ON T (a, b DESC)",
+            ("-- serves: view one", "-- note", "-- serves: view two"),
+        ))
+        self.assertEqual((spec.name, spec.table, spec.columns), ("t_uniq", "t", ("a", "b")))
+        self.assertTrue(spec.unique and spec.concurrently)
+        self.assertEqual(spec.serves, ("view one", "view two"))
+        self.assertIsNone(parse_index(SQLStatement("CREATE INDEX t_lower ON t (lower(a))", ())))
+        self.assertIsNone(parse_index(SQLStatement("CREATE TABLE t (a int)", ())))
+
+    def test_covering_index(self):
+        existing = [
+            ExistingIndex("t_a_b_key", True, True, False, ("a", "b")),
+            ExistingIndex("t_c_idx", False, False, False, ("c",)),
+        ]
+        plain = parse_index(SQLStatement("CREATE INDEX t_a_idx ON t (a)", ()))
+        unique = parse_index(SQLStatement("CREATE UNIQUE INDEX t_b_a ON t (b, a)", ()))
+        invalid = parse_index(SQLStatement("CREATE INDEX t_c ON t (c)", ()))
+        other = parse_index(SQLStatement("CREATE INDEX t_b_idx ON t (b)", ()))
+        self.assertEqual(covering_index(plain, existing).name, "t_a_b_key")
+        self.assertEqual(covering_index(unique, existing).name, "t_a_b_key")
+        self.assertIsNone(covering_index(invalid, existing))
+        self.assertIsNone(covering_index(other, existing))
+
+    def test_repository_migrations_load(self):
+        migrations = load_migrations()
+        self.assertEqual([migration.version for migration in migrations][:2], ["0001", "0002"])
+        self.assertTrue(migrations[0].atomic)
+        self.assertFalse(migrations[1].atomic)
+        self.assertTrue(all(spec.serves for spec in migrations[1].indexes()))
+
+
+class SQLMigrationRunnerTest(TransactionTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.write("0001_items.sql", "CREATE TABLE IF NOT EXISTS migration_items (id int, name text, UNIQUE (name));")
+        self.write("0002_items_indexes.sql", (
+            "-- serves: lookup by name\n"
+            "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS migration_items_name_uniq ON migration_items (name);\n"
+            "-- serves: lookup by id\n"
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS migration_items_id_idx ON migration_items (id);\n"
+        ))
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS migration_items, sql_schema_migrations")
+        self.directory.cleanup()
+
+    def write(self, name, sql):
+        with open(os.path.join(self.directory.name, name), "w", encoding="utf-8") as migration_file:
+            migration_file.write(sql)
+
+    def runner(self):
+        return MigrationRunner(directory=self.directory.name)
+
+    def test_migrate_is_idempotent(self):
+        applied = self.runner().migrate()
+        self.assertEqual([migration.version for migration in applied], ["0001", "0002"])
+        self.assertEqual(self.runner().migrate(), [])
+        self.assertEqual([record["state"] for record in self.runner().status()], ["applied", "applied"])
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'migration_items' ORDER BY 1")
+            indexes = [row[0] for row in cursor.fetchall()]
+        self.assertEqual(indexes, ["migration_items_id_idx", "migration_items_name_key"])
+
+    def test_report_shows_serving_index(self):
+        self.runner().migrate()
+        report = {item["index"]: item for item in self.runner().index_report()}
+        self.assertEqual(report["migration_items_name_uniq"]["served_by"], "migration_items_name_key")
+        self.assertEqual(report["migration_items_name_uniq"]["serves"], ["lookup by name"])
+        self.assertEqual(report["migration_items_id_idx"]["served_by"], "migration_items_id_idx")
+
+    def test_changed_migration_is_reported(self):
+        self.runner().migrate()
+        self.write("0001_items.sql", "CREATE TABLE IF NOT EXISTS migration_items (id int);")
+        self.assertEqual(self.runner().status()[0]["state"], "changed")
+
+    def test_comments_are_not_checksummed(self):
+        self.runner().migrate()
+        self.write("0002_items_indexes.sql", (
+            "-- serves: renamed lookup\n"
+            "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS migration_items_name_uniq ON migration_items (name);\n"
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS migration_items_id_idx ON migration_items (id);\n"
+        ))
+        self.assertEqual(self.runner().status()[1]["state"], "applied")
+
+
+class ProgressDedupeMigrationTest(TestCase):
+    """
+    Шаги 0002, удаляющие повторы прогресса и записи на модули перед
+    уникальными индексами.
+    """
+
+    def test_duplicates_are_removed_before_unique_indexes(self):
+        dedupe = [statement.sql for statement in load_migrations()[1].statements if statement.sql.startswith("DELETE")]
+        execute_query("""
+            CREATE TEMP TABLE usertestprogress (
+                id serial PRIMARY KEY, user_id int, test_id int,
+                is_passed boolean DEFAULT false, attempts int DEFAULT 0, correct_answers int DEFAULT 0
+            );
+            CREATE TEMP TABLE courseprogress (id serial PRIMARY KEY, user_id int, completion_percentage float);
+            CREATE TEMP TABLE usersmodules (id serial PRIMARY KEY, user_id int, module_id int);
+            INSERT INTO usertestprogress (user_id, test_id, is_passed, correct_answers) VALUES
+                (1, 1, false, 5), (1, 1, true, 3), (1, 1, NULL, NULL), (1, 2, false, 1), (1, 2, false, 1),
+                (2, 1, false, 0);
+            INSERT INTO courseprogress (user_id, completion_percentage) VALUES (1, 50), (1, 25), (2, 10);
+            INSERT INTO usersmodules (user_id, module_id) VALUES (1, 1), (1, 2), (1, 1), (2, 1), (1, 1);
+        """)
+        for sql in dedupe:
+            execute_query(sql)
+
+        self.assertEqual(
+            execute_query("SELECT id, user_id, test_id FROM usertestprogress ORDER BY id", fetchall=True),
+            [(2, 1, 1), (5, 1, 2), (6, 2, 1)],
+        )
+        self.assertEqual(execute_query("SELECT id FROM courseprogress ORDER BY id", fetchall=True), [(2,), (3,)])
+        execute_query("CREATE UNIQUE INDEX ON usertestprogress (user_id, test_id)")
+        self.assertEqual(execute_query("SELECT id FROM usersmodules ORDER BY id", fetchall=True), [(1,), (2,), (4,)])
+        execute_query("CREATE UNIQUE INDEX ON courseprogress (user_id)")
+        execute_query("CREATE UNIQUE INDEX ON usersmodules (user_id, module_id)")
@@ -0,0 +1,80 @@
+import itertools
+import statistics
+import threading
+import time
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+
+def run_benchmark(func, requests=1000, concurrency=1, warmup=10):
+    """
+    Вызывает func() requests раз в concurrency потоках и возвращает сводку
+    по времени одного вызова (мс) и пропускной способности (вызовов в секунду).
+    """
+    for _ in range(warmup):
+        func()
+
+    durations = []
+    errors = []
+    counter = itertools.count()
+
+    def worker():
+        try:
+            while next(counter) < requests:
+                started = time.perf_counter()
+                try:
+                    func()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                durations.append(time.perf_counter() - started)
+        finally:
+            # У каждого потока своё соединение с базой
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = time.perf_counter() - started
+
+    return summarize(durations, total, errors=len(errors), concurrency=concurrency)
+
+
+def summarize(durations, total, errors=0, concurrency=1):
+    if not durations:
+        return {"requests": 0, "errors": errors, "concurrency": concurrency}
+    ordered = sorted(durations)
+
+    def percentile(value):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * value))] * 1000, 3)
+
+    return {
+        "requests": len(durations),
+        "errors": errors,
+        "concurrency": concurrency,
+        "total_s": round(total, 3),
+        "rps": round(len(durations) / total, 1) if total else None,
+        "mean_ms": round(statistics.fmean(durations) * 1000, 3),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def count_queries(func, using="default"):
+    """
+    Сколько SQL-запросов выполняет один вызов func().
+    """
+    with CaptureQueriesContext(connections[using]) as queries:
+        func()
+    return len(queries)
+
+
+def format_summary(title, summary):
+    fields = ", ".join(f"{key}={value}" for key, value in summary.items())
+    return f"{title}: {fields}"
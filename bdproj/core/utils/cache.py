@@ -0,0 +1,515 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from core.utils.result_cache import MISS
+
+
+def shared_cache():
+    """
+    Общий для всех процессов кэш (CACHES[SHARED_CACHE_ALIAS]): redis,
+    memcached или файловый кэш на общем диске.
+    """
+    return caches[getattr(settings, "SHARED_CACHE_ALIAS", "default")]
+
+
+# Бэкенды, у которых add() и incr() атомарны: redis и memcached — между
+# процессами, locmem — между потоками своего процесса. У файлового кэша
+# это чтение и запись без блокировки
+_ATOMIC_BACKENDS = ("RedisCache", "PyMemcacheCache", "PyLibMCCache", "LocMemCache")
+
+
+def atomic_cache(cache=None):
+    """
+    Можно ли строить на общем кэше блокировки (add) и счётчики (incr).
+    """
+    cache = shared_cache() if cache is None else cache
+    return type(cache).__name__ in _ATOMIC_BACKENDS
+
+
+def hashed_key(value):
+    """
+    Ключ общего кэша для произвольной строки (например, токена): сам токен
+    не хранится в кэше, а длина ключа не зависит от входа.
+    """
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+class LocalCache:
+    """
+    LRU-кэш в памяти процесса с ограниченным сроком жизни записей.
+    """
+
+    def __init__(self, max_entries=10000, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return MISS
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else min(self.ttl, ttl))
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class InvalidationBus:
+    """
+    Сбросы локальных кэшей между процессами.
+
+    Каждая тема — ключ общего кэша с меткой последнего изменения.
+    publish() записывает новую метку, poll() не чаще раза в poll_interval
+    секунд читает метки всех подписанных тем одним get_many и вызывает
+    обработчики тем, метка которых изменилась. Метка — случайная строка,
+    а не счётчик, поэтому одновременные публикации не теряются и на
+    файловом кэше без атомарного incr.
+
+    Удаление отдельных ключей темы (publish_keys) — журнал событий:
+    номер события берётся атомарным incr, событие хранится event_ttl
+    секунд, и poll() передаёт подписчикам (subscribe_keys) только
+    удалённые ключи. Если события потеряны (вытеснены, пропущено больше
+    max_events), подписчик получает None и сбрасывает всё. Без атомарного
+    incr (файловый кэш) publish_keys сбрасывает тему целиком.
+
+    Данные, сброшенные в другом процессе, остаются в локальном кэше
+    не дольше poll_interval секунд (0 — проверка в каждом запросе).
+    """
+
+    KEY = "invalidate:{}"
+    SEQUENCE_KEY = "invalidate:{}:seq"
+    EVENT_KEY = "invalidate:{}:{}"
+
+    def __init__(self, poll_interval=1.0, max_events=100, event_ttl=600):
+        self.poll_interval = poll_interval
+        self.max_events = max_events
+        self.event_ttl = event_ttl
+        self._handlers = {}
+        self._key_handlers = {}
+        self._seen = {}
+        self._seen_events = {}
+        self._polled_at = None
+        self._lock = threading.Lock()
+        self.published = 0
+        self.received = 0
+
+    def subscribe(self, topic, handler):
+        with self._lock:
+            self._handlers.setdefault(topic, []).append(handler)
+
+    def subscribe_keys(self, topic, handler):
+        """
+        handler(keys) — ключи темы, удалённые в других процессах, или None,
+        если события потеряны и сбросить нужно всё.
+        """
+        with self._lock:
+            self._key_handlers.setdefault(topic, []).append(handler)
+
+    def publish_keys(self, topic, keys):
+        cache = shared_cache()
+        if not atomic_cache(cache):
+            self.publish(topic)
+            return
+        sequence_key = self.SEQUENCE_KEY.format(topic)
+        cache.add(sequence_key, 0, timeout=None)
+        try:
+            sequence = cache.incr(sequence_key)
+        except ValueError:
+            # Счётчик вытеснен между add и incr
+            self.publish(topic)
+            return
+        cache.set(self.EVENT_KEY.format(topic, sequence), tuple(keys), timeout=self.event_ttl)
+        with self._lock:
+            self.published += 1
+
+    def publish(self, *topics):
+        stamps = {topic: uuid.uuid4().hex for topic in topics}
+        shared_cache().set_many({self.KEY.format(topic): stamp for topic, stamp in stamps.items()}, timeout=None)
+        with self._lock:
+            # Свои сбросы уже выполнены в этом процессе
+            self._seen.update(stamps)
+            self.published += len(stamps)
+
+    def poll(self, force=False):
+        """
+        Вызывает обработчики тем, изменённых в других процессах.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not self._handlers and not self._key_handlers:
+                return
+            if not force and self._polled_at is not None and now - self._polled_at < self.poll_interval:
+                return
+            self._polled_at = now
+            topics = list(self._handlers)
+            key_topics = list(self._key_handlers)
+
+        stamps = shared_cache().get_many(
+            [self.KEY.format(topic) for topic in topics] + [self.SEQUENCE_KEY.format(topic) for topic in key_topics]
+        )
+        changed = []
+        changed_keys = []
+        with self._lock:
+            for topic in topics:
+                stamp = stamps.get(self.KEY.format(topic))
+                if stamp != self._seen.get(topic):
+                    self._seen[topic] = stamp
+                    changed.append(topic)
+            for topic in key_topics:
+                sequence = stamps.get(self.SEQUENCE_KEY.format(topic), 0)
+                seen = self._seen_events.get(topic)
+                if sequence != seen:
+                    self._seen_events[topic] = sequence
+                    changed_keys.append((topic, seen, sequence))
+            self.received += len(changed) + len(changed_keys)
+            handlers = [(topic, list(self._handlers[topic])) for topic in changed]
+            key_handlers = [
+                (topic, seen, sequence, list(self._key_handlers[topic])) for topic, seen, sequence in changed_keys
+            ]
+
+        for topic, topic_handlers in handlers:
+            for handler in topic_handlers:
+                handler(topic)
+        for topic, seen, sequence, topic_handlers in key_handlers:
+            keys = self._deleted_keys(topic, seen, sequence)
+            for handler in topic_handlers:
+                handler(keys)
+
+    def _deleted_keys(self, topic, seen, sequence):
+        """
+        Ключи, удалённые событиями seen+1..sequence, или None, если часть
+        событий недоступна или процесс ещё не знает, с какого события читать.
+        """
+        if seen is None or not seen < sequence <= seen + self.max_events:
+            return None
+        numbers = range(seen + 1, sequence + 1)
+        events = shared_cache().get_many([self.EVENT_KEY.format(topic, number) for number in numbers])
+        if len(events) != len(numbers):
+            return None
+        return frozenset(key for keys in events.values() for key in keys)
+
+    def stamps(self, *topics):
+        """
+        Последние известные процессу метки тем (обновляются в poll()):
+        меняются при каждой публикации, подходят как версии для ETag.
+        """
+        with self._lock:
+            return tuple(self._seen.get(topic) for topic in topics)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "topics": len(self._handlers),
+                "key_topics": len(self._key_handlers),
+                "poll_interval": self.poll_interval,
+                "published": self.published,
+                "received": self.received,
+            }
+
+
+invalidation_bus = InvalidationBus(
+    poll_interval=getattr(settings, "CACHE_INVALIDATION_POLL_INTERVAL", 1.0),
+)
+
+
+class VersionStamps:
+    """
+    Версии объектов (например, прогресса пользователя) в общем кэше:
+    случайная метка на ключ, одинаковая во всех процессах; bump()
+    заменяет её новой. Если метку вытеснили из кэша, заводится новая —
+    версия меняется, но старая не возвращается.
+    """
+
+    def __init__(self, namespace, timeout=30 * 24 * 3600):
+        self.namespace = namespace
+        self.timeout = timeout
+
+    def get(self, key):
+        return self.get_many(key)[0]
+
+    def get_many(self, *keys):
+        """
+        Версии нескольких ключей одним запросом к общему кэшу.
+        """
+        cache = shared_cache()
+        cache_keys = [f"{self.namespace}:{key}" for key in keys]
+        stamps = cache.get_many(cache_keys)
+        for cache_key in cache_keys:
+            if stamps.get(cache_key) is None:
+                cache.add(cache_key, uuid.uuid4().hex[:12], timeout=self.timeout)
+                stamps[cache_key] = cache.get(cache_key)
+        return tuple(stamps[cache_key] for cache_key in cache_keys)
+
+    def bump(self, key):
+        shared_cache().set(f"{self.namespace}:{key}", uuid.uuid4().hex[:12], timeout=self.timeout)
+
+
+class SharedNamespace:
+    """
+    Группа ключей общего кэша с общим поколением.
+
+    Ключ общего кэша имеет вид "<namespace>:<поколение>:<key>"; clear()
+    заводит новое поколение, и все старые записи разом становятся
+    невидимыми (и со временем вытесняются самим кэшем). Поколение читается
+    из общего кэша один раз и перечитывается после сообщения о сбросе
+    в invalidation_bus; обработчики on_invalidate очищают локальные
+    кэши процесса. Об удалении отдельных ключей (delete) другие процессы
+    узнают по ключам: обработчики on_delete(keys) удаляют только их.
+    """
+
+    def __init__(self, namespace, bus=None):
+        self.namespace = namespace
+        self.bus = invalidation_bus if bus is None else bus
+        self._generation = None
+        self._handlers = []
+        self._delete_handlers = []
+        self.bus.subscribe(namespace, self._invalidated)
+        self.bus.subscribe_keys(namespace, self._deleted)
+
+    def on_invalidate(self, handler):
+        self._handlers.append(handler)
+
+    def on_delete(self, handler):
+        """
+        handler(keys) — ключи, удалённые в другом процессе. Без таких
+        обработчиков удаление сбрасывает локальные кэши целиком.
+        """
+        self._delete_handlers.append(handler)
+
+    def key(self, key, generation=None):
+        return f"{self.namespace}:{generation or self.generation()}:{key}"
+
+    def generation(self):
+        generation = self._generation
+        if generation is None:
+            cache = shared_cache()
+            generation_key = f"{self.namespace}:generation"
+            cache.add(generation_key, uuid.uuid4().hex[:8], timeout=None)
+            generation = self._generation = cache.get(generation_key)
+        return generation
+
+    def get(self, key, default=MISS):
+        return shared_cache().get(self.key(key), default)
+
+    def set(self, key, value, timeout, generation=None):
+        """
+        generation — записать в заданное поколение (например, в то, из
+        которого читались данные), а не в текущее.
+        """
+        shared_cache().set(self.key(key, generation), value, timeout=timeout)
+
+    def add(self, key, value, timeout):
+        """
+        Записывает значение, только если ключа ещё нет; True — записано.
+        """
+        return shared_cache().add(self.key(key), value, timeout=timeout)
+
+    def delete(self, *keys, publish=True):
+        """
+        Удаляет ключи и (publish) сообщает другим процессам, какие ключи
+        сброшены.
+        """
+        shared_cache().delete_many([self.key(key) for key in keys])
+        if publish:
+            self.bus.publish_keys(self.namespace, keys)
+
+    def clear(self):
+        """
+        Новое поколение: все записи пространства имён сброшены во всех процессах.
+        """
+        generation = uuid.uuid4().hex[:8]
+        shared_cache().set(f"{self.namespace}:generation", generation, timeout=None)
+        self._generation = generation
+        self.bus.publish(self.namespace)
+
+    def _invalidated(self, topic):
+        self._generation = None
+        for handler in self._handlers:
+            handler()
+
+    def _deleted(self, keys):
+        if keys is None or not self._delete_handlers:
+            self._invalidated(self.namespace)
+            return
+        for handler in self._delete_handlers:
+            handler(keys)
+
+
+class TieredCache:
+    """
+    Двухуровневый кэш: память процесса перед общим кэшем.
+
+    Чтение сначала смотрит локальный LRU, затем общий кэш (и кладёт
+    найденное в локальный), запись идёт в оба уровня. delete() и clear()
+    сбрасывают оба уровня в этом процессе, а остальные процессы при
+    следующем invalidation_bus.poll() удаляют из локального уровня те же
+    ключи (после clear() — всё).
+    """
+
+    def __init__(self, namespace, timeout=300, local_ttl=30, max_local_entries=10000, bus=None, build_wait=5.0):
+        self.timeout = timeout
+        self.build_wait = build_wait
+        self.local = LocalCache(max_entries=max_local_entries, ttl=local_ttl)
+        self.shared = SharedNamespace(namespace, bus=bus)
+        self.shared.on_invalidate(self.local.clear)
+        self.shared.on_delete(lambda keys: self.local.delete(*keys))
+        self._lock = threading.Lock()
+        self._key_locks = [threading.Lock() for _ in range(64)]
+        self.shared_hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.coalesced = 0
+
+    @property
+    def namespace(self):
+        return self.shared.namespace
+
+    def get(self, key):
+        """
+        Значение или MISS.
+        """
+        value = self.local.get(key)
+        if value is not MISS:
+            return value
+        value = self.shared.get(key)
+        with self._lock:
+            if value is MISS:
+                self.misses += 1
+            else:
+                self.shared_hits += 1
+        if value is not MISS:
+            self.local.set(key, value)
+        return value
+
+    def get_or_set(self, key, compute, timeout=None):
+        value = self.get(key)
+        if value is MISS:
+            value = compute()
+            self.set(key, value, timeout)
+        return value
+
+    def get_or_build(self, key, build, timeout=None):
+        """
+        Как get_or_set, но одновременные промахи по одному ключу
+        схлопываются: в процессе значение строит один поток, а между
+        процессами — тот, кто первым взял блокировку в общем кэше;
+        остальные ждут его результата до build_wait секунд (потом строят
+        сами). Блокировка между процессами нужна атомарная (redis,
+        memcached): на файловом кэше add() не атомарен, и сборки
+        схлопываются только внутри процесса. Значение, построенное
+        до clear(), в новое поколение не попадает.
+        """
+        value = self.get(key)
+        if value is not MISS:
+            return value
+
+        with self._key_locks[hash(key) % len(self._key_locks)]:
+            value = self.local.get(key)
+            if value is MISS:
+                value = self.shared.get(key)
+            if value is not MISS:
+                # Построено другим потоком или процессом, пока ждали
+                self._built_elsewhere(key, value)
+                return value
+
+            lock_key = f"{key}:building"
+            locked = False
+            if atomic_cache():
+                locked = self.shared.add(lock_key, 1, timeout=self.build_wait)
+                if not locked:
+                    value = self._wait_shared(key)
+                    if value is not MISS:
+                        return value
+            try:
+                generation = self.shared.generation()
+                value = build()
+                timeout = self.timeout if timeout is None else timeout
+                self.shared.set(key, value, timeout, generation=generation)
+                if self.shared.generation() == generation:
+                    self.local.set(key, value, ttl=timeout)
+                with self._lock:
+                    self.builds += 1
+            finally:
+                if locked:
+                    self.shared.delete(lock_key, publish=False)
+            return value
+
+    def _wait_shared(self, key):
+        deadline = time.monotonic() + self.build_wait
+        while time.monotonic() < deadline:
+            time.sleep(0.01)
+            value = self.shared.get(key)
+            if value is not MISS:
+                self._built_elsewhere(key, value)
+                return value
+        return MISS
+
+    def _built_elsewhere(self, key, value):
+        self.local.set(key, value)
+        with self._lock:
+            self.coalesced += 1
+
+    def set(self, key, value, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        self.shared.set(key, value, timeout)
+        self.local.set(key, value, ttl=timeout)
+
+    def delete(self, *keys):
+        self.local.delete(*keys)
+        self.shared.delete(*keys)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def stats(self):
+        local = self.local.stats()
+        with self._lock:
+            return {
+                "namespace": self.namespace,
+                "local_size": local["size"],
+                "local_hits": local["hits"],
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "builds": self.builds,
+                "coalesced": self.coalesced,
+            }
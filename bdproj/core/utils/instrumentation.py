@@ -0,0 +1,51 @@
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+
+class QueryCollector:
+    """
+    Счётчик SQL-запросов: количество обращений к базе, суммарное время и
+    число повторов каждого текста запроса.
+
+    Подключается к соединениям Django через execute_wrapper, поэтому видит
+    все запросы — и через core.utils.query, и через connection.cursor().
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+            self.statements[sql] += 1
+
+    def repeated(self, threshold):
+        """
+        Запросы, выполненные не меньше threshold раз: признак N+1.
+        """
+        return [
+            (sql, count)
+            for sql, count in self.statements.most_common()
+            if count >= threshold
+        ]
+
+
+@contextmanager
+def collect_queries(collector=None):
+    """
+    Подключает QueryCollector ко всем соединениям текущего потока.
+    """
+    collector = collector or QueryCollector()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(collector))
+        yield collector
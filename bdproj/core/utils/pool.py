@@ -0,0 +1,367 @@
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+from django.db import connections
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """Не удалось получить соединение из пула за отведённое время."""
+
+
+class PoolClosed(psycopg2.OperationalError):
+    """Пул уже закрыт."""
+
+
+class PooledConnection(extensions.connection):
+    """
+    Соединение psycopg2, которое знает свой пул и время создания.
+    """
+    _pool = None
+    created_at = 0.0
+
+
+class ConnectionPool:
+    """
+    Пул постоянных соединений с PostgreSQL.
+
+    Держит от min_size до max_size соединений. Перед выдачей соединение,
+    простаивавшее дольше check_interval, проверяется запросом SELECT 1.
+    Соединения старше max_lifetime закрываются при возврате, а лишние
+    соединения, простаивающие дольше max_idle, закрывает фоновый поток.
+    """
+
+    def __init__(
+        self,
+        connect,
+        configure=None,
+        name="default",
+        min_size=1,
+        max_size=10,
+        timeout=30.0,
+        max_lifetime=3600.0,
+        max_idle=600.0,
+        check=True,
+        check_interval=30.0,
+        reap_interval=60.0,
+    ):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Pool size must satisfy 0 <= min_size <= max_size, max_size >= 1.")
+
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check = check
+        self.check_interval = check_interval
+        self.reap_interval = reap_interval
+
+        self._connect = connect
+        self._configure = configure
+        self._cond = threading.Condition()
+        # Простаивающие соединения: (соединение, время возврата в пул).
+        # Выдаём с конца (LIFO), чтобы «остывали» и закрывались старые.
+        self._idle = deque()
+        self._size = 0
+        self._waiting = 0
+        self._opened = False
+        self._closed = False
+        self._stop_reaper = threading.Event()
+
+        self._stats = {
+            "connections_opened": 0,
+            "connections_closed": 0,
+            "connections_failed": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_ms": 0.0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "expired": 0,
+            "reaped": 0,
+            "rollbacks_on_return": 0,
+            "peak_in_use": 0,
+        }
+
+    def open(self):
+        """
+        Открывает пул: создаёт min_size соединений и запускает фоновую очистку.
+        Повторные вызовы ничего не делают.
+        """
+        if self._opened:
+            return
+
+        with self._cond:
+            if self._opened:
+                return
+            if self._closed:
+                raise PoolClosed(f"Connection pool '{self.name}' is closed.")
+            self._opened = True
+            missing = max(self.min_size - self._size, 0)
+            self._size += missing
+
+        for _ in range(missing):
+            try:
+                conn = self._new_connection()
+            except Exception:
+                self._release_slot()
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+        if self.reap_interval:
+            reaper = threading.Thread(
+                target=self._reaper_loop,
+                name=f"pool-reaper-{self.name}",
+                daemon=True,
+            )
+            reaper.start()
+
+    def getconn(self):
+        """
+        Выдаёт исправное соединение из пула, при необходимости открывая новое
+        или ожидая освобождения не дольше timeout секунд.
+        """
+        self.open()
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            conn, returned_at = self._checkout(deadline)
+
+            if conn is None:
+                try:
+                    conn = self._new_connection()
+                except Exception:
+                    self._release_slot()
+                    raise
+            elif not self._is_healthy(conn, returned_at):
+                self._discard(conn)
+                continue
+
+            with self._cond:
+                self._stats["checkouts"] += 1
+                in_use = self._size - len(self._idle)
+                if in_use > self._stats["peak_in_use"]:
+                    self._stats["peak_in_use"] = in_use
+            return conn
+
+    def putconn(self, conn):
+        """
+        Возвращает соединение в пул. Незавершённая транзакция откатывается,
+        сломанные и устаревшие соединения закрываются.
+        """
+        if getattr(conn, "_pool", None) is not self:
+            conn.close()
+            return
+
+        discard = bool(conn.closed) or self._is_expired(conn)
+
+        if not discard:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+                else:
+                    with self._cond:
+                        self._stats["rollbacks_on_return"] += 1
+
+        if discard:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            if self._closed:
+                closing = True
+            else:
+                closing = False
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+        if closing:
+            self._discard(conn)
+
+    def reap(self):
+        """
+        Закрывает простаивающие соединения: устаревшие по max_lifetime —
+        всегда, простаивающие дольше max_idle — пока в пуле больше min_size.
+        """
+        now = time.monotonic()
+        to_close = []
+
+        with self._cond:
+            kept = deque()
+            while self._idle:
+                conn, returned_at = self._idle.popleft()
+                if self._is_expired(conn, now):
+                    self._stats["expired"] += 1
+                    to_close.append(conn)
+                elif (
+                    self.max_idle
+                    and now - returned_at > self.max_idle
+                    and self._size - len(to_close) > self.min_size
+                ):
+                    self._stats["reaped"] += 1
+                    to_close.append(conn)
+                else:
+                    kept.append((conn, returned_at))
+            self._idle = kept
+
+        for conn in to_close:
+            self._discard(conn)
+
+        return len(to_close)
+
+    def close(self):
+        """
+        Закрывает пул и все простаивающие соединения. Выданные соединения
+        будут закрыты при возврате.
+        """
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        self._stop_reaper.set()
+
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self):
+        """
+        Возвращает текущую статистику пула для подбора его размеров.
+        """
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                "name": self.name,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": idle,
+                "in_use": self._size - idle,
+                "requests_waiting": self._waiting,
+                **self._stats,
+                "wait_time_ms": round(self._stats["wait_time_ms"], 3),
+            }
+
+    def _checkout(self, deadline):
+        """
+        Берёт простаивающее соединение или резервирует слот под новое
+        (тогда возвращает None вместо соединения).
+        """
+        with self._cond:
+            started = None
+            while True:
+                if self._closed:
+                    raise PoolClosed(f"Connection pool '{self.name}' is closed.")
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn, returned_at = None, None
+                    break
+
+                now = time.monotonic()
+                if started is None:
+                    started = now
+                    self._stats["waits"] += 1
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    self._stats["wait_time_ms"] += (now - started) * 1000
+                    raise PoolTimeout(
+                        f"Couldn't get a connection from pool '{self.name}' "
+                        f"after {self.timeout} seconds."
+                    )
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            if started is not None:
+                self._stats["wait_time_ms"] += (time.monotonic() - started) * 1000
+        return conn, returned_at
+
+    def _new_connection(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._stats["connections_failed"] += 1
+            raise
+
+        conn._pool = self
+        conn.created_at = time.monotonic()
+        # Настраиваем соединение в autocommit; Django сам выставит нужный режим.
+        conn.autocommit = True
+        if self._configure is not None:
+            self._configure(conn)
+        with self._cond:
+            self._stats["connections_opened"] += 1
+        return conn
+
+    def _is_expired(self, conn, now=None):
+        if not self.max_lifetime:
+            return False
+        now = time.monotonic() if now is None else now
+        return now - conn.created_at > self.max_lifetime
+
+    def _is_healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if self._is_expired(conn):
+            with self._cond:
+                self._stats["expired"] += 1
+            return False
+        if not self.check or time.monotonic() - returned_at < self.check_interval:
+            return True
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        except psycopg2.Error:
+            with self._cond:
+                self._stats["health_check_failures"] += 1
+            return False
+        return True
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._stats["connections_closed"] += 1
+        self._release_slot()
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _reaper_loop(self):
+        while not self._stop_reaper.wait(self.reap_interval):
+            self.reap()
+
+
+def pool_stats():
+    """
+    Статистика пулов всех баз данных, для которых включён пул.
+    """
+    stats = {}
+    for alias in connections:
+        pool = getattr(connections[alias], "pool", None)
+        if pool is not None:
+            stats[alias] = pool.stats()
+    return stats
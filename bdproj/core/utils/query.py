@@ -0,0 +1,362 @@
+import logging
+import re
+import time
+import weakref
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from psycopg2.extras import execute_batch
+from psycopg2.extras import execute_values as _execute_values
+
+from core.utils import routing
+from core.utils.cache import invalidation_bus
+from core.utils.result_cache import MISS, cache_key, cacheable_tables, result_cache, written_tables
+
+
+logger = logging.getLogger("core.sql")
+
+_statements = {}
+# Имена подготовленных на сервере запросов для каждого физического соединения
+_prepared = weakref.WeakKeyDictionary()
+_query_hooks = []
+_write_listeners = []
+
+_READ_ONLY_RE = re.compile(r"\s*(SELECT|WITH|VALUES|TABLE)\b", re.IGNORECASE)
+_WRITE_RE = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b|\bFOR\s+(UPDATE|SHARE)\b", re.IGNORECASE)
+
+
+class Statement:
+    """
+    Именованный SQL-запрос, который выполняется как серверный prepared
+    statement: PREPARE делается один раз на соединение, дальше запрос
+    выполняется через EXECUTE без повторного разбора и планирования.
+
+    Запрос записывается как обычно, с параметрами %s.
+    """
+
+    def __init__(self, name, sql):
+        if not re.fullmatch(r"[a-z_][a-z0-9_]*", name):
+            raise ValueError(f"Invalid statement name: {name!r}")
+
+        registered = _statements.get(name)
+        if registered is not None and registered.sql != sql:
+            raise ValueError(f"Statement {name!r} is already registered with another query.")
+
+        self.name = name
+        self.sql = sql
+
+        parts = sql.strip().rstrip(";").split("%s")
+        positional = parts[0]
+        for index, part in enumerate(parts[1:], start=1):
+            positional += f"${index}{part}"
+        self.param_count = len(parts) - 1
+        self.prepare_sql = f"PREPARE {name} AS {positional.replace('%%', '%')}"
+        if self.param_count:
+            placeholders = ", ".join(["%s"] * self.param_count)
+            self.execute_sql = f"EXECUTE {name} ({placeholders})"
+        else:
+            self.execute_sql = f"EXECUTE {name}"
+
+        _statements.setdefault(name, self)
+
+    def __repr__(self):
+        return f"<Statement {self.name}>"
+
+
+def add_query_hook(hook):
+    """
+    Регистрирует функцию, которая вызывается после каждого запроса слоя:
+    hook(sql=..., params=..., duration=..., using=..., name=...), где
+    duration — время выполнения в секундах, name — имя Statement или None.
+    """
+    if hook not in _query_hooks:
+        _query_hooks.append(hook)
+
+
+def remove_query_hook(hook):
+    if hook in _query_hooks:
+        _query_hooks.remove(hook)
+
+
+def add_write_listener(listener):
+    """
+    Регистрирует функцию listener(table), которая вызывается после
+    фиксации записи в справочную таблицу (RESULT_CACHE_TABLES): в этом
+    процессе сразу, в остальных — при следующем invalidation_bus.poll().
+    Так производные кэши (например, пул вопросов) сбрасываются вместе
+    с кэшем результатов.
+    """
+    if listener not in _write_listeners:
+        _write_listeners.append(listener)
+
+
+def remove_write_listener(listener):
+    if listener in _write_listeners:
+        _write_listeners.remove(listener)
+
+
+def _notify_write(table):
+    for listener in list(_write_listeners):
+        listener(table)
+
+
+def _notify(sql, params, started, using, name=None):
+    if not _query_hooks:
+        return
+    duration = time.perf_counter() - started
+    for hook in list(_query_hooks):
+        hook(sql=sql, params=params, duration=duration, using=using, name=name)
+
+
+def is_read_only(query):
+    """
+    Запрос только читает данные (SELECT без FOR UPDATE и без
+    модифицирующих CTE), его можно выполнять на реплике.
+    """
+    sql = query.sql if isinstance(query, Statement) else query
+    return bool(_READ_ONLY_RE.match(sql)) and not _WRITE_RE.search(sql)
+
+
+def get_statement(name):
+    return _statements.get(name)
+
+
+def _route(query, using):
+    if using is not None:
+        return using
+    return routing.read_alias() if is_read_only(query) else DEFAULT_DB_ALIAS
+
+
+def _after_write(query, using):
+    """
+    Вызывается после выполнения пишущего запроса.
+    """
+    sql = query.sql if isinstance(query, Statement) else query
+
+    # Последующие чтения пользователя идут с основной базы
+    user_id = routing.current_user()
+    if user_id is not None:
+        routing.stick_to_primary(user_id)
+
+    # Сбрасываем кэш результатов по изменённым таблицам (вместе с каскадами
+    # внешних ключей) сразу и ещё раз после фиксации транзакции, чтобы
+    # параллельный запрос не успел закэшировать данные, прочитанные до коммита
+    tables = written_tables(sql)
+    if tables:
+        result_cache.invalidate(*tables)
+        transaction.on_commit(lambda: _tables_written(tables), using=using)
+
+
+def _tables_written(tables):
+    for table in sorted(tables):
+        _table_written(table)
+
+
+def _table_written(table):
+    result_cache.invalidate(table)
+    # Остальные процессы сбрасывают свои кэши при следующем poll()
+    if table in getattr(settings, "RESULT_CACHE_TABLES", ()):
+        _notify_write(table)
+        invalidation_bus.publish(f"table:{table}")
+
+
+def _table_invalidated(topic):
+    table = topic.partition(":")[2]
+    result_cache.invalidate(table)
+    _notify_write(table)
+
+
+for _table in getattr(settings, "RESULT_CACHE_TABLES", ()):
+    invalidation_bus.subscribe(f"table:{_table}", _table_invalidated)
+
+
+def _use_prepared():
+    return getattr(settings, "SQL_PREPARED_STATEMENTS", True)
+
+
+def _execute(cursor, query, params, using):
+    started = time.perf_counter()
+
+    if isinstance(query, Statement):
+        if _use_prepared():
+            raw_connection = connections[using].connection
+            prepared = _prepared.setdefault(raw_connection, set())
+            if query.name not in prepared:
+                cursor.execute(query.prepare_sql)
+                prepared.add(query.name)
+            cursor.execute(query.execute_sql, params or None)
+        else:
+            cursor.execute(query.sql, params or [])
+        _notify(query.sql, params, started, using, query.name)
+    else:
+        cursor.execute(query, params or [])
+        _notify(query, params, started, using)
+
+
+def execute_query(query, params=None, fetchone=False, fetchall=False, mapper=None, using=None):
+    """
+    Выполняет SQL-запрос (строку или Statement).
+
+    :param fetchone: Вернуть первую строку результата.
+    :param fetchall: Вернуть все строки результата.
+    :param mapper: Mapper или Group (core.utils.rows) для преобразования
+                   строк в словари; без него возвращаются кортежи.
+    :param using: Алиас базы; по умолчанию читающие запросы идут на реплику
+                  (core.utils.routing), остальные — на основную базу.
+
+    Чтения только из справочных таблиц (RESULT_CACHE_TABLES) без явного
+    using кэшируются в core.utils.result_cache до записи в эти таблицы.
+    """
+    read_only = is_read_only(query)
+    cacheable = (
+        read_only
+        and (fetchone or fetchall)
+        and using is None
+        and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+    )
+    key = tables = None
+    if cacheable:
+        sql = query.sql if isinstance(query, Statement) else query
+        tables = cacheable_tables(sql)
+        key = cache_key(sql, params, fetchone) if tables else None
+        if key is not None:
+            cached = result_cache.get(key)
+            if cached is not MISS:
+                return _map(mapper, fetchone, *cached)
+
+    using = _route(query, using)
+    started = time.monotonic()
+    try:
+        description, result = _fetch(query, params, fetchone, fetchall, using)
+    except OperationalError as e:
+        if using == DEFAULT_DB_ALIAS:
+            raise
+        # Реплика недоступна — читаем с основной базы
+        logger.warning("Replica %r is unavailable, reading from primary: %s", using, e)
+        using = DEFAULT_DB_ALIAS
+        description, result = _fetch(query, params, fetchone, fetchall, using)
+
+    if not read_only:
+        _after_write(query, using)
+    elif key is not None:
+        # Не кэшируем результат, если во время чтения в таблицы писали;
+        # для реплики учитываем ещё и её возможное отставание
+        since = started
+        if using != DEFAULT_DB_ALIAS:
+            since -= getattr(settings, "REPLICA_STICKY_SECONDS", 5)
+        if not result_cache.written_after(tables, since):
+            result_cache.set(key, (description, result), tables)
+
+    return _map(mapper, fetchone, description, result)
+
+
+def execute_json(query, params=None, using=None):
+    """
+    Выполняет запрос, который сам строит JSON-документ в Postgres
+    (json_build_object/json_agg, приведённые к text), и возвращает документ
+    байтами без разбора и повторной сериализации в Python; None — если
+    запрос ничего не вернул. Кэширование и маршрутизация — как
+    в execute_query.
+    """
+    row = execute_query(query, params, fetchone=True, using=using)
+    if row is None or row[0] is None:
+        return None
+    return row[0].encode("utf-8")
+
+
+def _fetch(query, params, fetchone, fetchall, using):
+    with connections[using].cursor() as cursor:
+        _execute(cursor, query, params, using)
+        if fetchone:
+            return cursor.description, cursor.fetchone()
+        if fetchall:
+            return cursor.description, cursor.fetchall()
+        return None, None
+
+
+def _map(mapper, fetchone, description, result):
+    if mapper is None or result is None:
+        return result
+    if fetchone:
+        return mapper.map_one(description, result)
+    return mapper.map_all(description, result)
+
+
+def stream_query(query, params=None, batch_size=None, mapper=None, using=None):
+    """
+    Генератор строк результата SELECT через именованный (серверный) курсор.
+
+    Строки забираются с сервера пачками по batch_size (FETCH FORWARD), так что
+    в памяти процесса одновременно находится не больше одной пачки. Курсор
+    живёт внутри транзакции, которая закрывается вместе с генератором.
+    С mapper (core.utils.rows.Mapper) строки отдаются словарями.
+    """
+    batch_size = batch_size or getattr(settings, "SQL_STREAM_BATCH_SIZE", 2000)
+    using = _route(query, using)
+    # Серверный курсор объявляется через DECLARE, EXECUTE в нём недоступен
+    name = query.name if isinstance(query, Statement) else None
+    sql = query.sql if isinstance(query, Statement) else query
+
+    with transaction.atomic(using=using, savepoint=False):
+        with connections[using].chunked_cursor() as cursor:
+            started = time.perf_counter()
+            cursor.execute(sql, params or [])
+            rows = cursor.fetchmany(batch_size)
+            _notify(sql, params, started, using, name)
+            map_row = mapper.bind(cursor.description) if mapper is not None else None
+            while rows:
+                if map_row is None:
+                    yield from rows
+                else:
+                    yield from map(map_row, rows)
+                rows = cursor.fetchmany(batch_size)
+
+
+def _page_size(page_size):
+    return page_size or getattr(settings, "SQL_BATCH_PAGE_SIZE", 1000)
+
+
+def execute_many(query, data, page_size=None, using=DEFAULT_DB_ALIAS):
+    """
+    Выполняет запрос для каждого набора параметров из data.
+
+    Наборы отправляются пачками по page_size в одном обращении к базе
+    (psycopg2 execute_batch) в одной транзакции; если транзакция уже
+    открыта вызывающим кодом, запросы выполняются в ней без точки сохранения.
+    """
+    if not data:
+        return
+
+    started = time.perf_counter()
+    with transaction.atomic(using=using, savepoint=False):
+        with connections[using].cursor() as cursor:
+            execute_batch(cursor, query, data, page_size=_page_size(page_size))
+        _after_write(query, using)
+    _notify(query, None, started, using)
+
+
+def execute_values(query, data, template=None, page_size=None, fetch=False, using=DEFAULT_DB_ALIAS):
+    """
+    Многострочная вставка: запрос вида "INSERT ... VALUES %s [RETURNING ...]".
+
+    Строки из data подставляются вместо %s по page_size строк на запрос,
+    всё выполняется в одной транзакции (как в execute_many). При fetch=True
+    возвращает строки RETURNING в порядке строк data.
+    """
+    if not data:
+        return [] if fetch else None
+
+    started = time.perf_counter()
+    with transaction.atomic(using=using, savepoint=False):
+        with connections[using].cursor() as cursor:
+            rows = _execute_values(
+                cursor,
+                query,
+                data,
+                template=template,
+                page_size=_page_size(page_size),
+                fetch=fetch,
+            )
+        _after_write(query, using)
+    _notify(query, None, started, using)
+    return rows
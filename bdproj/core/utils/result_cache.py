@@ -0,0 +1,210 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+_TABLE_RE = re.compile(r"\b(?:FROM|JOIN)\s+", re.IGNORECASE)
+# Отношение списка FROM с необязательным псевдонимом и запятой после него
+_RELATION_RE = re.compile(
+    r"([A-Za-z_][A-Za-z0-9_]*)(?:\s+(?:AS\s+)?[A-Za-z_][A-Za-z0-9_]*)?\s*(,)?\s*", re.IGNORECASE
+)
+_WRITE_TABLE_RE = re.compile(
+    r"^\s*(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM|TRUNCATE(?:\s+TABLE)?)\s+([A-Za-z_][A-Za-z0-9_]*)",
+    re.IGNORECASE,
+)
+_DELETE_RE = re.compile(r"^\s*(?:DELETE|TRUNCATE)\b", re.IGNORECASE)
+
+# Результат таких запросов меняется от вызова к вызову
+_VOLATILE_RE = re.compile(r"\b(?:random|now|clock_timestamp|statement_timestamp|timeofday)\s*\(", re.IGNORECASE)
+
+MISS = object()
+
+
+def read_tables(sql):
+    """
+    Таблицы, из которых читает запрос (FROM, в том числе через запятую, и JOIN).
+    """
+    tables = set()
+    for match in _TABLE_RE.finditer(sql):
+        position = match.end()
+        while True:
+            relation = _RELATION_RE.match(sql, position)
+            if relation is None:
+                break
+            tables.add(relation.group(1).lower())
+            if relation.group(2) is None:
+                break
+            position = relation.end()
+    return tables
+
+
+def written_table(sql):
+    match = _WRITE_TABLE_RE.match(sql)
+    return match.group(1).lower() if match else None
+
+
+def written_tables(sql):
+    """
+    Таблицы, которые меняет пишущий запрос: изменяемая таблица, а для
+    DELETE и TRUNCATE — и таблицы, которые меняются каскадом внешних
+    ключей (RESULT_CACHE_CASCADES).
+    """
+    table = written_table(sql)
+    if table is None:
+        return frozenset()
+    if not _DELETE_RE.match(sql):
+        return frozenset({table})
+    return cascade_closure(table)
+
+
+def cascade_closure(table, cascades=None):
+    """
+    Таблица и все таблицы, которые меняет удаление из неё. ON DELETE
+    CASCADE распространяется дальше, SET NULL — только обновляет строки
+    ссылающейся таблицы.
+    """
+    if cascades is None:
+        cascades = getattr(settings, "RESULT_CACHE_CASCADES", {})
+    tables = {table}
+    pending = [table]
+    expanded = set()
+    while pending:
+        parent = pending.pop()
+        if parent in expanded:
+            continue
+        expanded.add(parent)
+        for child, action in cascades.get(parent, {}).items():
+            tables.add(child)
+            if action == "CASCADE":
+                pending.append(child)
+    return frozenset(tables)
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+class ResultCache:
+    """
+    LRU-кэш результатов запросов, помеченных таблицами, из которых они читают.
+
+    Запись в таблицу удаляет все записи кэша с её тегом. Кэшируются только
+    сырые строки (кортежи), поэтому вызывающий код не может испортить
+    закэшированный результат, изменив полученные словари.
+    """
+
+    def __init__(self, max_entries=1000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._written_at = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return MISS
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, tables):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value, tables)
+            for table in tables:
+                self._tags.setdefault(table, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tables):
+        with self._lock:
+            now = time.monotonic()
+            for table in tables:
+                self._written_at[table] = now
+                for key in self._tags.pop(table, ()):
+                    if key in self._entries:
+                        self._remove(key)
+                        self.invalidations += 1
+
+    def written_after(self, tables, since):
+        """
+        Была ли запись в одну из таблиц после момента since (time.monotonic()).
+        """
+        return any(self._written_at.get(table, float("-inf")) >= since for table in tables)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._written_at.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key):
+        _, _, tables = self._entries.pop(key)
+        for table in tables:
+            keys = self._tags.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[table]
+
+
+result_cache = ResultCache(
+    max_entries=getattr(settings, "RESULT_CACHE_MAX_ENTRIES", 1000),
+    ttl=getattr(settings, "RESULT_CACHE_TTL", 300),
+)
+
+
+def cacheable_tables(sql):
+    """
+    Теги для кэширования запроса или None, если запрос читает хотя бы одну
+    таблицу не из справочника RESULT_CACHE_TABLES или вызывает изменчивые
+    функции (random(), now()).
+    """
+    if not getattr(settings, "RESULT_CACHE_ENABLED", True) or _VOLATILE_RE.search(sql):
+        return None
+    tables = read_tables(sql)
+    catalog = getattr(settings, "RESULT_CACHE_TABLES", ())
+    if not tables or not tables.issubset(catalog):
+        return None
+    return frozenset(tables)
+
+
+def cache_key(sql, params, fetchone):
+    try:
+        key = (sql, _freeze(params or ()), fetchone)
+        hash(key)
+    except TypeError:
+        return None
+    return key
@@ -0,0 +1,68 @@
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# (user_id, читать ли с основной базы) для текущего HTTP-запроса
+_current = ContextVar("replica_routing", default=None)
+
+_STICKY_KEY = "replica_sticky:{}"
+
+
+def replica_alias():
+    """
+    Алиас реплики из настроек или None, если реплика не настроена.
+    """
+    alias = getattr(settings, "SQL_REPLICA_ALIAS", "replica")
+    return alias if alias in settings.DATABASES else None
+
+
+def read_alias():
+    """
+    База для читающего запроса.
+
+    Чтение идёт с реплики, кроме случаев, когда пользователь недавно писал
+    (окно REPLICA_STICKY_SECONDS, чтобы он сразу видел свои изменения) или
+    на основной базе открыта транзакция.
+    """
+    replica = replica_alias()
+    if replica is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return DEFAULT_DB_ALIAS
+
+    current = _current.get()
+    if current is not None and current[1]:
+        return DEFAULT_DB_ALIAS
+    return replica
+
+
+def set_current_user(user_id):
+    """
+    Запоминает пользователя текущего запроса; проверка окна после записи
+    выполняется один раз на запрос.
+    """
+    sticky = replica_alias() is not None and cache.get(_STICKY_KEY.format(user_id)) is not None
+    _current.set((user_id, sticky))
+
+
+def current_user():
+    current = _current.get()
+    return current[0] if current is not None else None
+
+
+def reset_current_user():
+    _current.set(None)
+
+
+def stick_to_primary(user_id):
+    """
+    Открывает окно, в течение которого чтения пользователя идут с основной базы.
+    """
+    if replica_alias() is None:
+        return
+    timeout = getattr(settings, "REPLICA_STICKY_SECONDS", 5)
+    cache.set(_STICKY_KEY.format(user_id), True, timeout=timeout)
+    current = _current.get()
+    if current is not None and current[0] == user_id:
+        _current.set((user_id, True))
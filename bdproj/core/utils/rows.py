@@ -0,0 +1,136 @@
+import json
+
+
+def json_or_none(value):
+    """
+    Разбирает JSON-строку из базы данных, пустое значение оставляет None.
+    """
+    return json.loads(value) if value else None
+
+
+def _columns(description):
+    return tuple(column[0] for column in description)
+
+
+def _compile_row_function(columns, fields, converters):
+    """
+    Генерирует функцию row -> dict с заранее вычисленными индексами колонок.
+    """
+    if fields is None:
+        if len(set(columns)) != len(columns):
+            raise ValueError(f"Duplicate column names in result: {columns}")
+        fields = {column: column for column in columns}
+
+    namespace = {}
+    items = []
+    for key, column in fields.items():
+        try:
+            index = columns.index(column)
+        except ValueError:
+            raise ValueError(f"Column {column!r} is missing from result: {columns}") from None
+
+        converter = converters.get(key)
+        if converter is None:
+            items.append(f"{key!r}: row[{index}]")
+        else:
+            name = f"_convert_{len(namespace)}"
+            namespace[name] = converter
+            items.append(f"{key!r}: {name}(row[{index}])")
+
+    source = "def map_row(row):\n    return {" + ", ".join(items) + "}\n"
+    exec(source, namespace)
+    return namespace["map_row"]
+
+
+class Mapper:
+    """
+    Преобразует строки результата (кортежи) в словари.
+
+    Функция преобразования строится один раз для каждого набора колонок из
+    cursor.description и дальше применяется к строкам без поиска по именам.
+
+    :param fields: Соответствие "ключ словаря -> имя колонки" или список
+                   колонок, которые берутся под своими именами; по умолчанию
+                   все колонки результата.
+    :param converters: Функции преобразования значений по ключу словаря.
+    """
+
+    def __init__(self, fields=None, converters=None):
+        if fields is not None and not isinstance(fields, dict):
+            fields = {column: column for column in fields}
+        self.fields = fields
+        self.converters = dict(converters or {})
+        self._compiled = {}
+
+    def bind(self, description):
+        columns = _columns(description)
+        map_row = self._compiled.get(columns)
+        if map_row is None:
+            map_row = _compile_row_function(columns, self.fields, self.converters)
+            self._compiled[columns] = map_row
+        return map_row
+
+    def map_one(self, description, row):
+        return self.bind(description)(row)
+
+    def map_all(self, description, rows):
+        return list(map(self.bind(description), rows))
+
+
+# Все колонки результата под своими именами (алиасы задаются в SELECT)
+ROW_DICT = Mapper()
+
+
+class Group:
+    """
+    Собирает плоский результат JOIN во вложенную структуру.
+
+    Строки с одинаковым значением колонки key образуют одну запись с полями
+    fields; children — вложенные группы, каждая попадает в запись списком под
+    своим именем. Строки, где key равен NULL (пустая сторона LEFT JOIN),
+    не создают записей. Порядок записей совпадает с порядком строк.
+    """
+
+    def __init__(self, key, fields, children=None, converters=None):
+        self.key = key
+        self.mapper = Mapper(fields, converters)
+        self.children = dict(children or {})
+        self._compiled = {}
+
+    def _compile(self, description, columns):
+        key_index = columns.index(self.key)
+        make_record = self.mapper.bind(description)
+        children = [(name, child.bind(description)) for name, child in self.children.items()]
+
+        def add(row, records, index):
+            key = row[key_index]
+            if key is None:
+                return
+            child_states = index.get(key)
+            if child_states is None:
+                record = make_record(row)
+                child_states = []
+                for name, child_add in children:
+                    child_records = record[name] = []
+                    child_states.append((child_add, child_records, {}))
+                index[key] = child_states
+                records.append(record)
+            for child_add, child_records, child_index in child_states:
+                child_add(row, child_records, child_index)
+
+        return add
+
+    def bind(self, description):
+        columns = _columns(description)
+        add = self._compiled.get(columns)
+        if add is None:
+            add = self._compiled[columns] = self._compile(description, columns)
+        return add
+
+    def map_all(self, description, rows):
+        add = self.bind(description)
+        records = []
+        index = {}
+        for row in rows:
+            add(row, records, index)
+        return records
@@ -0,0 +1,104 @@
+import random
+
+
+_rng = random.Random()
+
+
+def draw(population, count, rng, skip=None, key=None):
+    """
+    До count случайных элементов последовательности population без повторов.
+
+    Частичная перетасовка Фишера — Йетса: перестановки хранятся в словаре,
+    поэтому сама последовательность не копируется и не меняется, а время и
+    память — O(count + число пропущенных). Элементы, ключ которых (key(item)
+    или сам элемент) есть в skip, пропускаются.
+    """
+    size = len(population)
+    swaps = {}
+    picked = []
+    position = 0
+    while len(picked) < count and position < size:
+        other = rng.randrange(position, size)
+        index = swaps.get(other, other)
+        swaps[other] = swaps.get(position, position)
+        position += 1
+
+        item = population[index]
+        if skip and (key(item) if key else item) in skip:
+            continue
+        picked.append(item)
+    return picked
+
+
+class SamplingPool:
+    """
+    Неизменяемый пул элементов для случайных выборок с квотами.
+
+    Элементы хранятся кортежем, для каждой группировки (groups: имя ->
+    функция элемента, например "level" -> уровень вопроса) заранее
+    строятся кортежи индексов по значениям. Выборка стоит O(k) от числа
+    выбранных элементов, а не от размера пула.
+    """
+
+    def __init__(self, items, key, groups=None):
+        self.items = tuple(items)
+        self.key = key
+        self.groups = {}
+        for name, group_of in (groups or {}).items():
+            buckets = {}
+            for index, item in enumerate(self.items):
+                buckets.setdefault(group_of(item), []).append(index)
+            self.groups[name] = (group_of, {value: tuple(indices) for value, indices in buckets.items()})
+
+    def __len__(self):
+        return len(self.items)
+
+    def buckets(self, group):
+        """
+        {значение: (элемент, ...)} для группировки group.
+        """
+        _, buckets = self.groups[group]
+        return {value: tuple(self.items[index] for index in indices) for value, indices in buckets.items()}
+
+    def sample(self, size=None, quotas=None, exclude=(), seed=None):
+        """
+        Случайная выборка.
+
+        :param quotas: {группировка: n} — не меньше n элементов каждого
+                       значения группировки (если их хватает), или
+                       {группировка: {значение: n}} для отдельных значений.
+                       Квоты выполняются по порядку, уже выбранные элементы
+                       засчитываются в следующие квоты.
+        :param size: Добрать случайными элементами до size; без size
+                     выборка состоит только из квот.
+        :param exclude: Ключи элементов, которые выбирать нельзя (например,
+                        недавно показанные вопросы).
+        :param seed: Одинаковый seed на одном и том же пуле даёт одну и ту
+                     же выборку.
+        """
+        rng = random.Random(seed) if seed is not None else _rng
+        skip = set(exclude)
+        picked = []
+
+        def take(population, count):
+            items = draw(population, count, rng, skip, self._key_at)
+            skip.update(self._key_at(index) for index in items)
+            picked.extend(self.items[index] for index in items)
+
+        for group, quota in (quotas or {}).items():
+            group_of, buckets = self.groups[group]
+            counts = {}
+            for item in picked:
+                value = group_of(item)
+                counts[value] = counts.get(value, 0) + 1
+            for value, indices in buckets.items():
+                wanted = quota.get(value, 0) if isinstance(quota, dict) else quota
+                if wanted > counts.get(value, 0):
+                    take(indices, wanted - counts.get(value, 0))
+
+        if size is not None and len(picked) < size:
+            take(range(len(self.items)), size - len(picked))
+        return picked
+
+    def _key_at(self, index):
+        return self.key(self.items[index])
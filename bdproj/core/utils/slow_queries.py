@@ -0,0 +1,216 @@
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from core.utils.query import get_statement, is_read_only
+
+
+logger = logging.getLogger("core.slow_queries")
+
+# Представление, которое сейчас обрабатывает запрос (ставит core.middleware)
+current_view = ContextVar("current_view", default=None)
+
+_EXECUTE_RE = re.compile(r"\s*EXECUTE\s+([a-z_][a-z0-9_]*)", re.IGNORECASE)
+
+# Служебные команды (транзакции, точки сохранения, параметры сеанса) не
+# записываются: их длительность — ожидание блокировок или сети, а не план
+_SERVICE_RE = re.compile(
+    r"\s*(SAVEPOINT|RELEASE|ROLLBACK|BEGIN|START|COMMIT|END|SET|RESET|SHOW|DEALLOCATE|DISCARD)\b",
+    re.IGNORECASE,
+)
+
+
+def normalize_sql(sql):
+    return " ".join(sql.split())
+
+
+def _explain_target(sql):
+    """
+    Запрос, который можно безопасно выполнить под EXPLAIN ANALYZE
+    (только чтение), или None.
+    """
+    match = _EXECUTE_RE.match(sql)
+    if match:
+        statement = get_statement(match.group(1).lower())
+        return sql if statement is not None and is_read_only(statement) else None
+    return sql if is_read_only(sql) else None
+
+
+class SlowQueryRecorder:
+    """
+    Обёртка выполнения запросов (execute_wrapper), которая записывает
+    запросы дольше SLOW_QUERY_THRESHOLD_MS в журнал "core.slow_queries".
+
+    Для читающих запросов к записи прикладывается план EXPLAIN (ANALYZE,
+    BUFFERS) — не чаще раза в SLOW_QUERY_EXPLAIN_INTERVAL секунд на текст
+    запроса и с вероятностью SLOW_QUERY_EXPLAIN_SAMPLE_RATE. Время
+    последнего плана хранится для max_explained последних текстов запросов.
+    Служебные команды (SAVEPOINT, SET и т. п.) не записываются.
+    """
+
+    def __init__(self, max_explained=1000):
+        self.max_explained = max_explained
+        self._explained = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def threshold(self):
+        return getattr(settings, "SLOW_QUERY_THRESHOLD_MS", 200) / 1000
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = time.perf_counter() - started
+        if duration >= self.threshold and not _SERVICE_RE.match(sql):
+            try:
+                self.record(sql, params, many, duration, context)
+            except Exception:
+                logger.exception("Unable to record slow query")
+        return result
+
+    def record(self, sql, params, many, duration, context):
+        entry = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "sql": normalize_sql(sql),
+            "params": None if many else _jsonable(params),
+            "duration_ms": round(duration * 1000, 2),
+            "view": current_view.get(),
+            "using": context["connection"].alias,
+            "plan": None,
+        }
+        if not many and self._should_explain(entry["sql"]):
+            entry["plan"] = self.explain(context["connection"], sql, params)
+        logger.warning(json.dumps(entry, ensure_ascii=False, default=str))
+
+    def _should_explain(self, sql):
+        if _explain_target(sql) is None:
+            return False
+        if random.random() >= getattr(settings, "SLOW_QUERY_EXPLAIN_SAMPLE_RATE", 1.0):
+            return False
+        interval = getattr(settings, "SLOW_QUERY_EXPLAIN_INTERVAL", 60)
+        now = time.monotonic()
+        with self._lock:
+            last = self._explained.get(sql)
+            if last is not None and now - last < interval:
+                return False
+            self._explained[sql] = now
+            self._explained.move_to_end(sql)
+            while len(self._explained) > self.max_explained:
+                self._explained.popitem(last=False)
+        return True
+
+    def explain(self, connection, sql, params):
+        """
+        Выполняет EXPLAIN (ANALYZE, BUFFERS) напрямую через psycopg2, мимо
+        обёрток Django. Внутри транзакции план снимается в точке сохранения,
+        чтобы ошибка EXPLAIN не прервала транзакцию вызывающего кода.
+        """
+        raw = connection.connection
+        in_transaction = not raw.autocommit
+        with raw.cursor() as cursor:
+            if in_transaction:
+                cursor.execute("SAVEPOINT slow_query_explain")
+            try:
+                cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", params)
+                plan = cursor.fetchone()[0]
+            except Exception as e:
+                plan = {"error": str(e)}
+                if in_transaction:
+                    cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            if in_transaction:
+                cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        return plan
+
+
+recorder = SlowQueryRecorder()
+
+
+def install(connection, **kwargs):
+    """
+    Обработчик connection_created: подключает recorder к соединению.
+    """
+    if not getattr(settings, "SLOW_QUERY_LOG", True):
+        return
+    if recorder not in connection.execute_wrappers:
+        connection.execute_wrappers.append(recorder)
+
+
+def _jsonable(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: _jsonable_value(value) for key, value in params.items()}
+    return [_jsonable_value(value) for value in params]
+
+
+def _jsonable_value(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_jsonable_value(item) for item in value]
+    return str(value)
+
+
+def read_entries(path=None):
+    """
+    Читает записи журнала медленных запросов вместе с ротированными файлами.
+    """
+    path = path or settings.SLOW_QUERY_LOG_FILE
+    backups = getattr(settings, "SLOW_QUERY_LOG_BACKUP_COUNT", 3)
+    files = [f"{path}.{index}" for index in range(backups, 0, -1)] + [str(path)]
+
+    for file_path in files:
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path, encoding="utf-8") as log_file:
+            for line in log_file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def top_offenders(limit=20, path=None):
+    """
+    Группирует записи журнала по тексту запроса и сортирует по суммарному
+    времени: число срабатываний, суммарное/среднее/максимальное время,
+    представления, последние параметры и последний снятый план.
+    """
+    offenders = {}
+    for entry in read_entries(path):
+        item = offenders.get(entry["sql"])
+        if item is None:
+            item = offenders[entry["sql"]] = {
+                "sql": entry["sql"],
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "views": [],
+                "last_seen": None,
+                "last_params": None,
+                "plan": None,
+            }
+        item["count"] += 1
+        item["total_ms"] += entry["duration_ms"]
+        item["max_ms"] = max(item["max_ms"], entry["duration_ms"])
+        item["last_seen"] = entry["time"]
+        item["last_params"] = entry["params"]
+        if entry["view"] and entry["view"] not in item["views"]:
+            item["views"].append(entry["view"])
+        if entry["plan"] is not None:
+            item["plan"] = entry["plan"]
+
+    result = sorted(offenders.values(), key=lambda item: item["total_ms"], reverse=True)[:limit]
+    for item in result:
+        item["total_ms"] = round(item["total_ms"], 2)
+        item["avg_ms"] = round(item["total_ms"] / item["count"], 2)
+    return result
@@ -0,0 +1,411 @@
+import hashlib
+import re
+from collections import namedtuple
+from pathlib import Path
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "sql_migrations"
+
+MIGRATIONS_TABLE = "sql_schema_migrations"
+
+# Ключ pg_advisory_lock: два процесса деплоя не применяют миграции одновременно
+_LOCK_KEY = 0x5D1A7E
+
+_FILE_RE = re.compile(r"^(\d+)_(\w+)\.sql$")
+_SERVES_RE = re.compile(r"^--\s*serves:\s*(.+?)\s*$", re.IGNORECASE)
+_CONCURRENTLY_RE = re.compile(r"\bCONCURRENTLY\b", re.IGNORECASE)
+_INDEX_RE = re.compile(
+    r"^CREATE\s+(UNIQUE\s+)?INDEX\s+(CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?"
+    r"([A-Za-z_][A-Za-z0-9_]*)\s+ON\s+(?:ONLY\s+)?([A-Za-z_][A-Za-z0-9_]*)\s*"
+    r"(?:USING\s+\w+\s*)?\(([^()]*)\)\s*(WHERE\b.*)?$",
+    re.IGNORECASE | re.DOTALL,
+)
+_COLUMN_RE = re.compile(r'^"?([A-Za-z_][A-Za-z0-9_]*)"?(?:\s+(?:ASC|DESC))?$', re.IGNORECASE)
+_DOLLAR_RE = re.compile(r"\$(?:[A-Za-z_][A-Za-z0-9_]*)?\$")
+
+TABLE_INDEXES_QUERY = """
+    SELECT
+        ic.relname,
+        i.indisunique,
+        i.indisvalid,
+        i.indpred IS NOT NULL OR i.indexprs IS NOT NULL,
+        ARRAY(
+            SELECT a.attname::text
+            FROM unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+            WHERE k.ord <= i.indnkeyatts
+            ORDER BY k.ord
+        )
+    FROM pg_index i
+    JOIN pg_class ic ON ic.oid = i.indexrelid
+    WHERE i.indrelid = to_regclass(%s)
+    ORDER BY ic.relname;
+"""
+
+INDEX_USAGE_QUERY = """
+    SELECT indexrelname, idx_scan, pg_size_pretty(pg_relation_size(indexrelid))
+    FROM pg_stat_user_indexes
+    WHERE relid = to_regclass(%s);
+"""
+
+
+class MigrationError(Exception):
+    pass
+
+
+# Оператор файла миграции и комментарии "--", стоящие перед ним
+SQLStatement = namedtuple("SQLStatement", "sql comments")
+
+# Индекс, объявленный в миграции; columns — None для индексов по выражениям
+IndexSpec = namedtuple("IndexSpec", "name table columns unique partial concurrently serves sql")
+
+# Индекс, который уже есть в базе
+ExistingIndex = namedtuple("ExistingIndex", "name unique valid special columns")
+
+
+def split_statements(sql):
+    """
+    Делит текст миграции на операторы по ";" вне строк, идентификаторов
+    в кавычках, $$-блоков и комментариев.
+    """
+    statements = []
+    comments = []
+    buffer = []
+    i = 0
+    length = len(sql)
+
+    def flush():
+        text = "".join(buffer).strip()
+        if text:
+            statements.append(SQLStatement(text, tuple(comments)))
+            comments.clear()
+        buffer.clear()
+
+    while i < length:
+        char = sql[i]
+        if char == "-" and sql.startswith("--", i):
+            end = sql.find("\n", i)
+            end = length if end == -1 else end
+            if "".join(buffer).strip():
+                buffer.append(" ")
+            else:
+                comments.append(sql[i:end].strip())
+            i = end
+        elif char == "/" and sql.startswith("/*", i):
+            end = sql.find("*/", i + 2)
+            end = length if end == -1 else end + 2
+            buffer.append(sql[i:end])
+            i = end
+        elif char in ("'", '"'):
+            end = i + 1
+            while end < length:
+                if sql[end] == char:
+                    if sql.startswith(char * 2, end):
+                        end += 2
+                        continue
+                    break
+                end += 1
+            buffer.append(sql[i:end + 1])
+            i = end + 1
+        elif char == "$" and _DOLLAR_RE.match(sql, i):
+            tag = _DOLLAR_RE.match(sql, i).group(0)
+            end = sql.find(tag, i + len(tag))
+            end = length if end == -1 else end + len(tag)
+            buffer.append(sql[i:end])
+            i = end
+        elif char == ";":
+            flush()
+            i += 1
+        elif char == "\n" and not "".join(buffer).strip():
+            # Пустая строка отделяет комментарии, не относящиеся к оператору
+            if not sql[sql.rfind("\n", 0, i) + 1:i].strip():
+                comments.clear()
+            buffer.append(char)
+            i += 1
+        else:
+            buffer.append(char)
+            i += 1
+    flush()
+    return statements
+
+
+def parse_index(statement):
+    """
+    IndexSpec для оператора CREATE INDEX или None для остальных операторов.
+    """
+    match = _INDEX_RE.match(statement.sql)
+    if match is None:
+        return None
+    unique, concurrently, name, table, columns, where = match.groups()
+
+    parsed = []
+    for column in columns.split(","):
+        column_match = _COLUMN_RE.match(column.strip())
+        if column_match is None:
+            parsed = None
+            break
+        parsed.append(column_match.group(1).lower())
+
+    serves = []
+    for comment in statement.comments:
+        serves_match = _SERVES_RE.match(comment)
+        if serves_match:
+            serves.append(serves_match.group(1))
+
+    return IndexSpec(
+        name=name.lower(),
+        table=table.lower(),
+        columns=tuple(parsed) if parsed else None,
+        unique=bool(unique),
+        partial=bool(where),
+        concurrently=bool(concurrently),
+        serves=tuple(serves),
+        sql=statement.sql,
+    )
+
+
+def covering_index(spec, existing):
+    """
+    Существующий индекс, который обслуживает те же запросы, что и spec.
+
+    Уникальный индекс заменяется только уникальным индексом по тому же
+    набору колонок (он же годится как цель ON CONFLICT), обычный — любым
+    индексом, у которого колонки spec идут первыми.
+    """
+    if spec.columns is None or spec.partial:
+        return None
+    for index in existing:
+        if not index.valid or index.special:
+            continue
+        if spec.unique:
+            if index.unique and set(index.columns) == set(spec.columns):
+                return index
+        elif tuple(index.columns[:len(spec.columns)]) == spec.columns:
+            return index
+    return None
+
+
+class Migration:
+    """
+    Файл NNNN_name.sql из каталога миграций.
+
+    Файл без CREATE INDEX CONCURRENTLY применяется в одной транзакции,
+    файл с ним — по одному оператору в режиме autocommit (CONCURRENTLY
+    нельзя выполнять внутри транзакции).
+    """
+
+    def __init__(self, path):
+        match = _FILE_RE.match(path.name)
+        if match is None:
+            raise MigrationError(f"Invalid migration file name: {path.name}")
+        self.version = match.group(1)
+        self.name = match.group(2)
+        self.path = path
+        self.sql = path.read_text(encoding="utf-8")
+        self.statements = split_statements(self.sql)
+        # Сумма считается только по операторам: комментарии (в том числе
+        # "-- serves:") можно править после применения миграции
+        self.checksum = hashlib.sha256(
+            ";\n".join(statement.sql for statement in self.statements).encode("utf-8")
+        ).hexdigest()
+        self.atomic = not any(_CONCURRENTLY_RE.search(statement.sql) for statement in self.statements)
+
+    def __repr__(self):
+        return f"<Migration {self.version}_{self.name}>"
+
+    def indexes(self):
+        return [spec for spec in map(parse_index, self.statements) if spec is not None]
+
+
+def load_migrations(directory=None):
+    directory = Path(directory or MIGRATIONS_DIR)
+    migrations = [Migration(path) for path in sorted(directory.glob("*.sql"))]
+    versions = [migration.version for migration in migrations]
+    duplicates = {version for version in versions if versions.count(version) > 1}
+    if duplicates:
+        raise MigrationError(f"Duplicate migration versions: {', '.join(sorted(duplicates))}")
+    return sorted(migrations, key=lambda migration: int(migration.version))
+
+
+class MigrationRunner:
+    """
+    Применяет SQL-миграции из core/sql_migrations и ведёт их учёт
+    в таблице sql_schema_migrations.
+
+    Каждая миграция применяется один раз. Индексы создаются идемпотентно:
+    валидный индекс с тем же именем или равноценный индекс под другим
+    именем пропускаются, а невалидный индекс (оставшийся после прерванного
+    CREATE INDEX CONCURRENTLY) удаляется и строится заново.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, directory=None, log=None):
+        self.using = using
+        self.connection = connections[using]
+        self.migrations = load_migrations(directory)
+        self.log = log or (lambda message: None)
+
+    def ensure_table(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+                    version varchar(32) PRIMARY KEY,
+                    name varchar(255) NOT NULL,
+                    checksum char(64) NOT NULL,
+                    applied_at timestamptz NOT NULL DEFAULT now()
+                );
+            """)
+
+    def applied(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"SELECT to_regclass('{MIGRATIONS_TABLE}') IS NOT NULL;")
+            if not cursor.fetchone()[0]:
+                return {}
+            cursor.execute(f"SELECT version, checksum, applied_at FROM {MIGRATIONS_TABLE};")
+            return {version: (checksum, applied_at) for version, checksum, applied_at in cursor.fetchall()}
+
+    def status(self):
+        applied = self.applied()
+        result = []
+        for migration in self.migrations:
+            record = applied.get(migration.version)
+            if record is None:
+                state = "pending"
+            elif record[0] != migration.checksum:
+                state = "changed"
+            else:
+                state = "applied"
+            result.append({
+                "version": migration.version,
+                "name": migration.name,
+                "state": state,
+                "applied_at": record[1] if record else None,
+            })
+        return result
+
+    def pending(self):
+        applied = self.applied()
+        return [migration for migration in self.migrations if migration.version not in applied]
+
+    def migrate(self, dry_run=False):
+        """
+        Применяет непримененные миграции по порядку и возвращает их список.
+        """
+        if self.connection.in_atomic_block:
+            raise MigrationError("SQL migrations cannot run inside a transaction.")
+
+        if dry_run:
+            pending = self.pending()
+            for migration in pending:
+                self.log(f"Would apply {migration.version}_{migration.name}")
+                with self.connection.cursor() as cursor:
+                    for spec in migration.indexes():
+                        self.log(f"  {spec.name}: {self.plan_index(cursor, spec)}")
+            return pending
+
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s);", [_LOCK_KEY])
+        try:
+            self.ensure_table()
+            for record in self.status():
+                if record["state"] == "changed":
+                    self.log(f"Warning: applied migration {record['version']}_{record['name']} has been modified")
+            pending = self.pending()
+            for migration in pending:
+                self.apply(migration)
+            return pending
+        finally:
+            with self.connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s);", [_LOCK_KEY])
+
+    def apply(self, migration):
+        self.log(f"Applying {migration.version}_{migration.name}...")
+        if migration.atomic:
+            with transaction.atomic(using=self.using):
+                self._apply_statements(migration)
+                self._record(migration)
+        else:
+            self._apply_statements(migration)
+            self._record(migration)
+
+    def _apply_statements(self, migration):
+        with self.connection.cursor() as cursor:
+            for statement in migration.statements:
+                spec = parse_index(statement)
+                if spec is None:
+                    cursor.execute(statement.sql)
+                else:
+                    self.log(f"  {spec.name}: {self.ensure_index(cursor, spec)}")
+
+    def _record(self, migration):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {MIGRATIONS_TABLE} (version, name, checksum)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (version) DO NOTHING;
+                """,
+                [migration.version, migration.name, migration.checksum],
+            )
+
+    def table_indexes(self, cursor, table):
+        cursor.execute(TABLE_INDEXES_QUERY, [table])
+        return [
+            ExistingIndex(name, unique, valid, special, tuple(columns))
+            for name, unique, valid, special, columns in cursor.fetchall()
+        ]
+
+    def plan_index(self, cursor, spec):
+        """
+        Что нужно сделать с индексом: "exists", "covered by <имя>",
+        "rebuild invalid" или "create".
+        """
+        existing = self.table_indexes(cursor, spec.table)
+        own = next((index for index in existing if index.name == spec.name), None)
+        if own is not None:
+            return "exists" if own.valid else "rebuild invalid"
+        covering = covering_index(spec, existing)
+        if covering is not None:
+            return f"covered by {covering.name}"
+        return "create"
+
+    def ensure_index(self, cursor, spec):
+        action = self.plan_index(cursor, spec)
+        if action == "rebuild invalid":
+            concurrently = "CONCURRENTLY " if spec.concurrently else ""
+            cursor.execute(f'DROP INDEX {concurrently}IF EXISTS "{spec.name}";')
+        if action in ("create", "rebuild invalid"):
+            cursor.execute(spec.sql)
+        return action
+
+    def index_report(self):
+        """
+        Для каждого индекса из миграций: какие запросы он обслуживает,
+        какой индекс базы их на самом деле обслуживает и сколько раз
+        он использовался (pg_stat_user_indexes).
+        """
+        report = []
+        with self.connection.cursor() as cursor:
+            for migration in self.migrations:
+                for spec in migration.indexes():
+                    existing = self.table_indexes(cursor, spec.table)
+                    own = next((index for index in existing if index.name == spec.name and index.valid), None)
+                    served_by = own or covering_index(spec, existing)
+
+                    cursor.execute(INDEX_USAGE_QUERY, [spec.table])
+                    usage = {name: (scans, size) for name, scans, size in cursor.fetchall()}
+                    scans, size = usage.get(served_by.name, (None, None)) if served_by else (None, None)
+
+                    report.append({
+                        "migration": migration.version,
+                        "index": spec.name,
+                        "table": spec.table,
+                        "columns": list(spec.columns or ()),
+                        "unique": spec.unique,
+                        "serves": list(spec.serves),
+                        "served_by": served_by.name if served_by else None,
+                        "scans": scans,
+                        "size": size,
+                    })
+        return report
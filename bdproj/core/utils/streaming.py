@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, StreamingHttpResponse
+
+
+def iter_json_array(items, encoder=DjangoJSONEncoder, chunk_size=None):
+    """
+    Кодирует итерируемый объект в JSON-массив по частям.
+
+    Элементы сериализуются по одному и склеиваются в куски примерно по
+    chunk_size байт, так что весь массив никогда не собирается в памяти.
+    """
+    chunk_size = chunk_size or getattr(settings, "JSON_STREAM_CHUNK_SIZE", 64 * 1024)
+    encode = encoder().encode
+
+    buffer = ["["]
+    buffered = 1
+    separator = ""
+    for item in items:
+        part = separator + encode(item)
+        separator = ","
+        buffer.append(part)
+        buffered += len(part)
+        if buffered >= chunk_size:
+            yield "".join(buffer)
+            buffer = []
+            buffered = 0
+    buffer.append("]")
+    yield "".join(buffer)
+
+
+def accepts_encoding(request, coding):
+    """
+    Принимает ли клиент ответ в кодировке coding (например, "gzip").
+
+    Заголовок Accept-Encoding разбирается с учётом q-значений: "gzip;q=0"
+    означает отказ от gzip, явно названная кодировка важнее "*".
+    """
+    coding = coding.lower()
+    weights = {}
+    for part in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = float(value.strip())
+                except ValueError:
+                    weight = 0.0
+        weights[name] = weight
+    weight = weights.get(coding, weights.get("*", 0.0))
+    return weight > 0
+
+
+class StreamingJsonResponse(StreamingHttpResponse):
+    """
+    Потоковый ответ со списком объектов в формате JSON.
+
+    Аналог JsonResponse(data, safe=False) для длинных списков: items может
+    быть генератором, строки результата отдаются клиенту по мере чтения.
+    """
+
+    def __init__(self, items, encoder=DjangoJSONEncoder, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(iter_json_array(items, encoder), **kwargs)
+
+
+class RawJsonResponse(HttpResponse):
+    """
+    Ответ с уже готовым JSON-документом (байты или строка), например
+    собранным в Postgres (core.utils.query.execute_json): в отличие от
+    JsonResponse данные не сериализуются повторно.
+    """
+
+    def __init__(self, content, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(content, **kwargs)
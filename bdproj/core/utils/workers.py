@@ -0,0 +1,109 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+
+class PoolBusy(Exception):
+    """Очередь пула заполнена или задача не дождалась исполнителя."""
+
+
+class WorkerPool:
+    """
+    Ограниченный пул потоков для CPU-ёмкой работы (например, хэширования
+    паролей).
+
+    Одновременно выполняется не больше max_workers задач, ещё max_queue
+    ждут в очереди; остальные сразу получают PoolBusy. Так всплеск входов
+    в начале экзамена не занимает все процессорное время, а лишние запросы
+    быстро получают отказ вместо долгого ожидания.
+
+    Потоков достаточно для функций, отпускающих GIL (hashlib.pbkdf2_hmac,
+    hashlib.scrypt).
+    """
+
+    def __init__(self, name, max_workers=4, max_queue=32, timeout=10):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.max_pending = 0
+        self._wait_time = 0.0
+        self._run_time = 0.0
+
+    def run(self, func, *args):
+        """
+        Выполняет func(*args) в пуле и возвращает результат.
+        """
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise PoolBusy(f"Worker pool '{self.name}' queue is full.")
+            self._pending += 1
+            self.submitted += 1
+            self.max_pending = max(self.max_pending, self._pending)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix=f"{self.name}-worker"
+                )
+
+        future = self._executor.submit(self._call, time.perf_counter(), func, args)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._lock:
+                self.timeouts += 1
+                if future.cancel():
+                    # Задача так и не началась: _call не уменьшит счётчик
+                    self._pending -= 1
+            raise PoolBusy(f"Worker pool '{self.name}' timed out.")
+
+    def _call(self, queued_at, func, args):
+        started = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        else:
+            with self._lock:
+                self.completed += 1
+            return result
+        finally:
+            finished = time.perf_counter()
+            with self._lock:
+                self._pending -= 1
+                self._wait_time += started - queued_at
+                self._run_time += finished - started
+
+    def stats(self):
+        with self._lock:
+            done = self.completed + self.failed
+            return {
+                "name": self.name,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._pending,
+                "max_in_flight": self.max_pending,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self._wait_time / done * 1000, 3) if done else None,
+                "avg_run_ms": round(self._run_time / done * 1000, 3) if done else None,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
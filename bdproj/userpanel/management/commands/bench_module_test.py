@@ -0,0 +1,94 @@
+from django.core.management.base import BaseCommand
+from django.http import JsonResponse
+
+from core.utils.bench import format_summary, run_benchmark
+from core.utils.query import execute_json, execute_query, execute_values
+from core.utils.streaming import RawJsonResponse
+from userpanel.views import MODULE_TEST_GROUP, MODULE_TEST_JSON_QUERY, MODULE_TEST_QUERY
+
+
+OPTIONS_PER_QUESTION = 4
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает сборку теста модуля (GET /api/users/moduletest/<id>/): "
+        "группировка строк JOIN в Python против JSON, собранного в Postgres. "
+        "Для каждого размера создаётся временный модуль с тестом."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--questions", type=int, nargs="+", default=[50, 100, 500])
+        parser.add_argument("--requests", type=int, default=200)
+
+    def handle(self, *args, **options):
+        for size in options["questions"]:
+            module_id, option_ids = create_module_test(size)
+            try:
+                self.compare(module_id, size, options["requests"])
+            finally:
+                execute_query("DELETE FROM modules WHERE id = %s", [module_id])
+                execute_query("DELETE FROM optionss WHERE id = ANY(%s)", [option_ids])
+
+    def compare(self, module_id, size, requests):
+        # using="default": мимо кэша результатов, каждый вызов идёт в базу
+        def python_grouping():
+            tests = execute_query(
+                MODULE_TEST_QUERY, [module_id], fetchall=True, mapper=MODULE_TEST_GROUP, using="default"
+            )
+            return JsonResponse(tests[0]).content
+
+        def postgres_json():
+            return RawJsonResponse(execute_json(MODULE_TEST_JSON_QUERY, [module_id], using="default")).content
+
+        rows = len(execute_query(MODULE_TEST_QUERY, [module_id], fetchall=True, using="default"))
+        self.stdout.write(
+            f"{size} questions: {rows} JOIN rows, "
+            f"payload {len(python_grouping())} bytes (python) / {len(postgres_json())} bytes (json)"
+        )
+        for title, func in (("python grouping", python_grouping), ("postgres json", postgres_json)):
+            summary = run_benchmark(func, requests=requests)
+            self.stdout.write(format_summary(f"  {title}", summary))
+
+
+def create_module_test(size):
+    """
+    Временный модуль с одной темой и тестом из size вопросов по
+    OPTIONS_PER_QUESTION вариантов. Возвращает (id модуля, id вариантов).
+    """
+    module_id = execute_query(
+        "INSERT INTO modules (name, description) VALUES ('Benchmark', '') RETURNING id", fetchone=True
+    )[0]
+    topic_id = execute_query(
+        "INSERT INTO topics (name, description, module_id) VALUES ('Benchmark', '', %s) RETURNING id",
+        [module_id],
+        fetchone=True,
+    )[0]
+    test_id = execute_query(
+        "INSERT INTO tests (name, module_id) VALUES ('Benchmark', %s) RETURNING id", [module_id], fetchone=True
+    )[0]
+    question_ids = [row[0] for row in execute_values(
+        "INSERT INTO questions (name, topic_id) VALUES %s RETURNING id",
+        [(f"Benchmark question {number}", topic_id) for number in range(size)],
+        fetch=True,
+    )]
+    option_ids = [row[0] for row in execute_values(
+        "INSERT INTO optionss (value) VALUES %s RETURNING id",
+        [(f"Benchmark option {number}",) for number in range(size * OPTIONS_PER_QUESTION)],
+        fetch=True,
+    )]
+
+    links = []
+    for position, question_id in enumerate(question_ids):
+        for option_id in option_ids[position * OPTIONS_PER_QUESTION:(position + 1) * OPTIONS_PER_QUESTION]:
+            links.append((question_id, option_id))
+    execute_values("INSERT INTO questionoptions (question_id, option_id) VALUES %s", links)
+    execute_values("INSERT INTO testsquestions (test_id, question_id) VALUES %s", [
+        (test_id, question_id) for question_id in question_ids
+    ])
+    execute_values(
+        "UPDATE questions q SET correct_answer_id = v.option_id FROM (VALUES %s) AS v(question_id, option_id) "
+        "WHERE q.id = v.question_id",
+        links[::OPTIONS_PER_QUESTION],
+    )
+    return module_id, option_ids
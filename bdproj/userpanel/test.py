@@ -1,7 +1,25 @@
-from django.test import TestCase, Client
+import gzip
+import json
+from unittest import mock
+
+from django.db import connection
+from django.http import JsonResponse
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 
+from auth_users.utils.required import remember_token
+from auth_users.utils.token_cache import token_cache
+from core.utils.cache import shared_cache
+from core.utils.query import execute_query
+from core.utils.sql_migrations import load_migrations
+from .utils import curriculum as curriculum_module
+from .utils.curriculum import curriculum
+from .utils.entrance_pool import entrance_pool, entrance_test, recent_questions, remember_questions
+from .utils.etags import progress_versions
+from .utils.module_tests import bumps_module_tests, module_tests
+
 class UserPanelAPITest(TestCase):
     def setUp(self):
         self.client = Client()
@@ -57,3 +75,484 @@ class UserPanelAPITest(TestCase):
         response = self.client.delete(self.user_detail_url(user_id))
         self.assertTrue(response.status_code in [status.HTTP_404_NOT_FOUND, status.HTTP_401_UNAUTHORIZED])
 
+
+MODULE_SOURCE = ("module", 37)
+
+
+def create_schema():
+    """
+    Схема базы из миграций core/sql_migrations — та же, что на сервере.
+    Тест идёт в транзакции, поэтому индексы строятся без CONCURRENTLY.
+    """
+    with connection.cursor() as cursor:
+        for migration in load_migrations():
+            for statement in migration.statements:
+                cursor.execute(statement.sql.replace("CONCURRENTLY ", ""))
+
+
+class SchemaTestCase(TestCase):
+    """
+    Схема из миграций создаётся один раз на класс и откатывается после него.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        create_schema()
+
+
+class StudentTestCase(SchemaTestCase):
+    """
+    Запросы от имени ученика 5 с токеном "student".
+    """
+
+    def setUp(self):
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        remember_token("student", 5, 2)
+
+
+def create_users(*users):
+    """
+    users — пары (id, level_id).
+    """
+    with connection.cursor() as cursor:
+        for user_id, level_id in users:
+            cursor.execute(
+                "INSERT INTO users (id, email, password, level_id) VALUES (%s, %s, 'x', %s)",
+                [user_id, f"user{user_id}@example.com", level_id],
+            )
+
+
+def create_entrance_questions():
+    """
+    Вступительный тест (модуль 37): вопросы 1-3 уровня 1, 4-6 уровня 2,
+    у каждого варианты 1 (правильный) и 2.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO levels (id, name) VALUES (1, 'A1'), (2, 'A2')")
+        cursor.execute(
+            "INSERT INTO modules (id, name, description, level_id) "
+            "VALUES (37, 'Entrance', '', NULL), (1, 'A1', '', 1), (2, 'A2', '', 2)"
+        )
+        cursor.execute("INSERT INTO topics (id, name, module_id) VALUES (1, 'A1 topic', 1), (2, 'A2 topic', 2)")
+        cursor.execute("INSERT INTO tests (id, module_id) VALUES (1, 37)")
+        cursor.execute("INSERT INTO optionss (id, value) VALUES (1, 'yes'), (2, 'no')")
+        for question_id in range(1, 7):
+            topic_id = 1 if question_id <= 3 else 2
+            cursor.execute(
+                "INSERT INTO questions (id, name, topic_id, correct_answer_id) VALUES (%s, %s, %s, 1)",
+                [question_id, f"Q{question_id}", topic_id],
+            )
+            cursor.execute(
+                "INSERT INTO questionoptions (question_id, option_id) VALUES (%s, 1), (%s, 2)",
+                [question_id, question_id],
+            )
+            cursor.execute("INSERT INTO testsquestions (test_id, question_id) VALUES (1, %s)", [question_id])
+
+
+class EntrancePoolTest(SchemaTestCase):
+    def setUp(self):
+        entrance_pool.invalidate()
+        self.addCleanup(entrance_pool.invalidate)
+        create_entrance_questions()
+
+    def test_pool_is_built_once(self):
+        pool = entrance_pool.pool(MODULE_SOURCE)
+        self.assertEqual({level: len(items) for level, items in pool.buckets("level").items()}, {1: 3, 2: 3})
+        self.assertEqual([option["is_correct"] for option in pool.items[0]["options"]], [True, False])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIs(entrance_pool.pool(MODULE_SOURCE), pool)
+        self.assertEqual(len(queries), 0)
+
+    def test_admin_write_rebuilds_pool(self):
+        entrance_pool.pool(MODULE_SOURCE)
+        with self.captureOnCommitCallbacks(execute=True):
+            execute_query("UPDATE questions SET name = 'Changed' WHERE id = 1")
+        self.assertFalse(entrance_pool.stats()["built"])
+        questions = entrance_pool.pool(MODULE_SOURCE).items
+        self.assertEqual(questions[0]["question_name"], "Changed")
+
+        # Запись в справочник, не входящий в пул, пул не сбрасывает
+        with self.captureOnCommitCallbacks(execute=True):
+            execute_query("INSERT INTO levels (id, name) VALUES (3, 'B1')")
+        self.assertTrue(entrance_pool.stats()["built"])
+
+    def test_sample(self):
+        self.assert_entrance_test(entrance_test(per_level=1, size=4))
+        self.assertEqual(len(entrance_test(size=10)), 6)
+
+    def assert_entrance_test(self, questions, size=4):
+        self.assertEqual(len(questions), size)
+        self.assertEqual(len({question["question_id"] for question in questions}), size)
+        self.assertEqual({question["level_id"] for question in questions}, {1, 2})
+        self.assertTrue(all(len(question["options"]) == 2 for question in questions))
+
+    @override_settings(ENTRANCE_TEST_SAMPLING="sql")
+    def test_sql_sampling_reads_only_selected_questions(self):
+        with CaptureQueriesContext(connection) as queries:
+            questions = entrance_test(per_level=1, size=4)
+        self.assert_entrance_test(questions)
+        self.assertEqual(len(queries), 1)
+        self.assertFalse(entrance_pool.stats()["built"])
+
+    @override_settings(ENTRANCE_POOL_MAX_QUESTIONS=5)
+    def test_large_bank_is_sampled_in_database(self):
+        self.assert_entrance_test(entrance_test(per_level=1, size=4))
+        self.assertEqual(entrance_pool.stats()["questions"], 6)
+        with CaptureQueriesContext(connection) as queries:
+            self.assert_entrance_test(entrance_test(per_level=1, size=4))
+        self.assertEqual(len(queries), 1)
+
+    def test_test_and_tag_sources(self):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO tests (id, module_id) VALUES (2, 1)")
+            cursor.execute("INSERT INTO testsquestions (test_id, question_id) VALUES (2, 1), (2, 4)")
+            cursor.execute("INSERT INTO questiontags VALUES ('placement', 2), ('placement', 5)")
+        for source, expected in (("test:2", {1, 4}), ("tag:placement", {2, 5})):
+            for sampling in ("memory", "sql"):
+                with override_settings(ENTRANCE_TEST_SOURCE=source, ENTRANCE_TEST_SAMPLING=sampling):
+                    questions = entrance_test(per_level=1, size=10)
+                self.assertEqual({question["question_id"] for question in questions}, expected)
+
+    def test_exclude_and_seed(self):
+        for sampling in ("memory", "sql"):
+            with override_settings(ENTRANCE_TEST_SAMPLING=sampling):
+                questions = entrance_test(per_level=1, size=2, exclude=[1, 2, 4, 5])
+                self.assertEqual({question["question_id"] for question in questions}, {3, 6})
+                # Без исключённых вопросов теста не набрать — они возвращаются
+                self.assertEqual(len(entrance_test(per_level=1, size=4, exclude=[1, 2, 4, 5])), 4)
+
+                first = entrance_test(per_level=1, size=4, seed="abc")
+                self.assert_entrance_test(first)
+                self.assertEqual(entrance_test(per_level=1, size=4, seed="abc"), first)
+
+    def test_repeated_request_shows_other_questions(self):
+        shared_cache().delete("entrance_seen:7")
+        self.addCleanup(shared_cache().delete, "entrance_seen:7")
+        first = entrance_test(per_level=1, size=3)
+        remember_questions(7, first)
+        self.assertEqual(recent_questions(7), tuple(question["question_id"] for question in first))
+        second = entrance_test(per_level=1, size=3, exclude=recent_questions(7))
+        self.assertFalse({q["question_id"] for q in first} & {q["question_id"] for q in second})
+
+
+class EntranceGradingTest(StudentTestCase):
+    def setUp(self):
+        super().setUp()
+        create_entrance_questions()
+        curriculum.enrolled.clear()
+        create_users((5, None))
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO modules (id, name, description, level_id) VALUES (3, 'A1 extra', '', 1)")
+
+    def submit(self, answers):
+        return self.client.post(
+            reverse('test'), {"answers": answers}, content_type='application/json', HTTP_AUTHORIZATION="Token student"
+        )
+
+    def test_grading_and_assignment(self):
+        # Уровень 1: 3 из 3, уровень 2: 1 из 3
+        answers = [{"question_id": question_id, "selected_option_id": 1} for question_id in (1, 2, 3, 4)]
+        answers += [{"question_id": question_id, "selected_option_id": 2} for question_id in (5, 6)]
+        answers.append({"question_id": "bad", "selected_option_id": 1})
+        self.assertEqual(curriculum.module_ids(5), ())
+        response = self.submit(answers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["level"], 1)
+        self.assertEqual(response.json()["modules_assigned"], [1, 3])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT entrance_test, level_id FROM users WHERE id = 5")
+            self.assertEqual(cursor.fetchone(), (True, 1))
+            cursor.execute("SELECT module_id FROM usersmodules WHERE user_id = 5 ORDER BY module_id")
+            self.assertEqual(cursor.fetchall(), [(1,), (3,)])
+        self.assertEqual(curriculum.module_ids(5), (1, 3))
+
+    def test_query_count_does_not_grow_with_answers(self):
+        # Первый запрос подготавливает запросы на соединении
+        self.submit([{"question_id": 1, "selected_option_id": 1}])
+        counts = []
+        for question_ids in ((1,), (1, 2, 3, 4, 5, 6)):
+            with CaptureQueriesContext(connection) as queries:
+                self.submit([{"question_id": question_id, "selected_option_id": 1} for question_id in question_ids])
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class CurriculumCacheTest(StudentTestCase):
+    def setUp(self):
+        super().setUp()
+        curriculum.invalidate()
+        curriculum.enrolled.clear()
+        self.addCleanup(curriculum.invalidate)
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO levels (id, name) VALUES (1, 'A1'), (2, 'A2'), (3, 'B1')")
+            cursor.execute(
+                "INSERT INTO modules (id, name, description, level_id) "
+                "VALUES (1, 'A1', 'a', 1), (2, 'A2', 'b', 2), (3, 'B1', 'c', 3)"
+            )
+            cursor.execute(
+                "INSERT INTO topics (id, name, description, module_id) "
+                "VALUES (10, 'Verbs', '', 1), (11, 'Nouns', '', 1), (20, 'Tenses', '', 2)"
+            )
+        create_users((5, 1), (6, 3))
+        execute_query("INSERT INTO usersmodules (user_id, module_id) VALUES (5, 2), (5, 1), (6, 3)")
+
+    def get(self, name):
+        return self.client.get(reverse(name), HTTP_AUTHORIZATION="Token student")
+
+    def test_modules_are_assembled_from_cache(self):
+        expected = [
+            {"id": 1, "name": "A1", "description": "a", "topics": [
+                {"id": 10, "name": "Verbs", "description": ""},
+                {"id": 11, "name": "Nouns", "description": ""},
+            ]},
+            {"id": 2, "name": "A2", "description": "b", "topics": [{"id": 20, "name": "Tenses", "description": ""}]},
+        ]
+        builds = curriculum.stats()["builds"]
+        self.assertEqual(self.get('usermodules').json()["modules"], expected)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get('usermodules').json()["modules"], expected)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(curriculum.modules(6)[0]["id"], 3)
+        self.assertEqual(curriculum.stats()["builds"], builds + 1)
+
+    def test_topic_write_and_enrollment_refresh_layers(self):
+        curriculum.modules(5)
+        with self.captureOnCommitCallbacks(execute=True):
+            execute_query("UPDATE topics SET name = 'Changed' WHERE id = 20")
+        self.assertEqual(curriculum.modules(5)[1]["topics"][0]["name"], "Changed")
+
+        execute_query("INSERT INTO usersmodules (user_id, module_id) VALUES (5, 3)")
+        self.assertEqual([module["id"] for module in curriculum.modules(5)], [1, 2])
+        curriculum.invalidate_user(5)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual([module["id"] for module in curriculum.modules(5)], [1, 2, 3])
+        self.assertEqual(len(queries), 1)
+
+    def test_enrollment_during_build_is_not_cached_stale(self):
+        query = curriculum_module.execute_query
+
+        def enroll_while_reading(*args, **kwargs):
+            rows = query(*args, **kwargs)
+            execute_query("INSERT INTO usersmodules (user_id, module_id) VALUES (5, 3)")
+            curriculum.invalidate_user(5)
+            return rows
+
+        with mock.patch.object(curriculum_module, "execute_query", enroll_while_reading):
+            self.assertEqual(curriculum.module_ids(5), (1, 2))
+        self.assertEqual(curriculum.module_ids(5), (1, 2, 3))
+
+    def test_etag(self):
+        response = self.get('usermodules')
+        etag = response["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('usermodules'), HTTP_AUTHORIZATION="Token student", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(queries), 0)
+
+        execute_query("INSERT INTO usersmodules (user_id, module_id) VALUES (5, 3)")
+        curriculum.invalidate_user(5)
+        enrolled_etag = self.get('usermodules')["ETag"]
+        self.assertNotEqual(enrolled_etag, etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            execute_query("UPDATE modules SET name = 'Changed' WHERE id = 3")
+        self.assertNotEqual(self.get('usermodules')["ETag"], enrolled_etag)
+
+
+class ModuleTestPayloadTest(StudentTestCase):
+    def setUp(self):
+        super().setUp()
+        create_entrance_questions()
+        module_tests.bump()
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE tests SET name = 'Entrance'")
+            # Тест без вопросов и повторная связь теста с вопросом
+            cursor.execute("INSERT INTO tests (id, module_id, name) VALUES (0, 37, 'Empty')")
+            cursor.execute("INSERT INTO testsquestions (test_id, question_id) VALUES (1, 2)")
+
+    def get(self, module_id, **params):
+        return self.client.get(f"/api/users/moduletest/{module_id}/", params, HTTP_AUTHORIZATION="Token student")
+
+    def test_json_payload_matches_python_grouping(self):
+        response = self.get(37)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/json")
+        module_tests.bump()
+        with override_settings(MODULE_TEST_SQL_JSON=False):
+            expected = self.get(37).json()
+        self.assertEqual(json.loads(response.content), expected)
+        self.assertEqual(expected["name"], "Entrance")
+        self.assertEqual([question["id"] for question in expected["questions"]], [1, 2, 3, 4, 5, 6])
+        self.assertEqual(expected["questions"][0]["options"], [{"id": 1, "text": "yes"}, {"id": 2, "text": "no"}])
+
+        self.assertEqual(self.get(99).json(), {"id": None, "name": None, "questions": []})
+
+    def test_payload_is_cached_until_content_changes(self):
+        first = self.get(37)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get(37).content, first.content)
+        self.assertEqual(len(queries), 0)
+
+        response = self.client.get("/api/users/moduletest/37/", HTTP_AUTHORIZATION="Token student", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), first.content)
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertIn("Accept-Encoding", first["Vary"])
+
+        response = self.client.get("/api/users/moduletest/37/", HTTP_AUTHORIZATION="Token student", HTTP_ACCEPT_ENCODING="gzip;q=0, br")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.content, first.content)
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+        # Запись админки поднимает версию содержимого
+        @bumps_module_tests
+        def rename_question(view, request):
+            execute_query("UPDATE questions SET name = 'Changed' WHERE id = 1")
+            return JsonResponse({}, status=200)
+
+        version = module_tests.version()
+        rename_question(None, None)
+        self.assertNotEqual(module_tests.version(), version)
+        self.assertEqual(self.get(37).json()["questions"][0]["name"], "Changed")
+
+    def test_sampled_test_uses_python_path(self):
+        response = self.get(37, size=2, per_topic=1, seed="s")
+        self.assertEqual({question["topic_id"] for question in response.json()["questions"]}, {1, 2})
+        self.assertFalse(response.has_header("ETag"))
+
+    def test_etag_follows_content_version(self):
+        etag = self.get(37)["ETag"]
+        response = self.client.get("/api/users/moduletest/37/", HTTP_AUTHORIZATION="Token student", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        module_tests.bump()
+        response = self.client.get("/api/users/moduletest/37/", HTTP_AUTHORIZATION="Token student", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class ProgressETagTest(StudentTestCase):
+    def setUp(self):
+        super().setUp()
+        create_users((5, None))
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO modules (id, name) VALUES (1, 'A1')")
+            cursor.execute("INSERT INTO tests (id, name, module_id) VALUES (1, 'T', 1)")
+            cursor.execute("INSERT INTO usertestprogress (user_id, test_id, is_passed, attempts, correct_answers) VALUES (5, 1, TRUE, 1, 3)")
+
+    def get(self, etag=None):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        return self.client.get(reverse('user-progress'), HTTP_AUTHORIZATION="Token student", **headers)
+
+    def test_not_modified_until_progress_changes(self):
+        response = self.get()
+        self.assertEqual(response.json()["tests_progress"][0]["correct_answers"], 3)
+        etag = response["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get(etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(queries), 0)
+
+        execute_query("UPDATE usertestprogress SET correct_answers = 4")
+        progress_versions.bump(5)
+        response = self.get(etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["tests_progress"][0]["correct_answers"], 4)
+
+    def test_cascading_test_delete_changes_etag(self):
+        etag = self.get()["ETag"]
+        remember_token("admin", 6, 1)
+        response = self.client.delete(
+            reverse('admin_test_detail', args=[1]), HTTP_AUTHORIZATION="Token admin"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.get(etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["tests_progress"], [])
+
+
+class SubmitModuleTestTest(StudentTestCase):
+    def setUp(self):
+        super().setUp()
+        create_entrance_questions()
+        create_users((5, 1))
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO tests (id, module_id) VALUES (2, 2)")
+
+    def submit(self, answers, module_id=37):
+        return self.client.post(
+            f"/api/users/submittestmodule/{module_id}", {"answers": answers},
+            content_type='application/json', HTTP_AUTHORIZATION="Token student",
+        )
+
+    def answers(self, correct, wrong=()):
+        return (
+            [{"question_id": question_id, "selected_option_id": 1} for question_id in correct]
+            + [{"question_id": question_id, "selected_option_id": 2} for question_id in wrong]
+        )
+
+    def test_grading_and_progress_upserts(self):
+        response = self.submit(self.answers([1, 2, 3, 4, 99], wrong=[5]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {
+            "score_percent": 4 / 6 * 100,
+            "correct_count": 4,
+            "total_questions": 6,
+            "is_passed": False,
+            "completion_percentage": 0.0,
+            "is_complite_course": False,
+        })
+
+        response = self.submit(self.answers([1, 2, 3, 4, 5]))
+        self.assertTrue(response.json()["is_passed"])
+        # Пройден 1 тест из 2
+        self.assertEqual(response.json()["completion_percentage"], 50.0)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT attempts, correct_answers, is_passed FROM usertestprogress WHERE user_id = 5")
+            self.assertEqual(cursor.fetchall(), [(2, 5, True)])
+            cursor.execute("SELECT is_complite_course, completion_percentage, modules_complite FROM courseprogress")
+            self.assertEqual(cursor.fetchall(), [(False, 50.0, 1)])
+            # На уровне 1 тестов нет — уровень повышен; тест уровня 2 не пройден
+            cursor.execute("SELECT level_id FROM users WHERE id = 5")
+            self.assertEqual(cursor.fetchone(), (2,))
+
+            # Тестов уровня 2 нет, но уровня 3 тоже нет — уровень не меняется
+            cursor.execute("DELETE FROM tests WHERE id = 2")
+        self.submit(self.answers([1]))
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT level_id FROM users WHERE id = 5")
+            self.assertEqual(cursor.fetchone(), (2,))
+
+        self.assertEqual(self.submit(self.answers([1]), module_id=99).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_answers_go_to_the_served_test(self):
+        with connection.cursor() as cursor:
+            # Тест без вопросов с меньшим id: GET его не отдаёт
+            cursor.execute("INSERT INTO tests (id, module_id) VALUES (0, 37)")
+        module_tests.bump()
+        served = self.client.get("/api/users/moduletest/37/", HTTP_AUTHORIZATION="Token student").json()
+        self.assertEqual(served["id"], 1)
+
+        response = self.client.post(
+            "/api/users/submittestmodule/37", {"test_id": served["id"], "answers": self.answers([1])},
+            content_type='application/json', HTTP_AUTHORIZATION="Token student",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT test_id FROM usertestprogress WHERE user_id = 5")
+            self.assertEqual(cursor.fetchall(), [(1,)])
+
+        response = self.client.post(
+            "/api/users/submittestmodule/37", {"test_id": 0, "answers": self.answers([1])},
+            content_type='application/json', HTTP_AUTHORIZATION="Token student",
+        )
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_query_count_does_not_grow_with_answers(self):
+        # Первый запрос подготавливает запросы на соединении
+        self.submit(self.answers([1]))
+        counts = []
+        for question_ids in ((1,), (1, 2, 3, 4, 5, 6)):
+            with CaptureQueriesContext(connection) as queries:
+                self.submit(self.answers(question_ids))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
@@ -1,43 +1,48 @@
-from django.db import connection
-import psycopg2
-from psycopg2.extras import execute_batch
+from core.utils import query as sql_query
+
 
 class BaseSQLHandler:
     @staticmethod
-    def execute_query(query, params=None, fetchone=False, fetchall=False):
+    def execute_query(query, params=None, fetchone=False, fetchall=False, mapper=None):
         """
-        Выполняет SQL-запрос с обработкой исключений.
+        Выполняет SQL-запрос (строку или Statement) с обработкой исключений.
         """
-        with connection.cursor() as cursor:
-            try:
-                cursor.execute(query, params or [])
-                if fetchone:
-                    return cursor.fetchone()
-                if fetchall:
-                    return cursor.fetchall()
-            except Exception as e:
-                raise Exception(f"Database error: {e}")
-            
+        try:
+            return sql_query.execute_query(
+                query, params, fetchone=fetchone, fetchall=fetchall, mapper=mapper
+            )
+        except Exception as e:
+            raise Exception(f"Database error: {e}")
+
 
     @staticmethod
-    def execute_many(query, data):
+    def execute_many(query, data, page_size=None):
         """
         Выполняет SQL-запрос с множеством параметров.
-        
+
         :param query: SQL-запрос, который нужно выполнить.
         :param data: Список параметров для выполнения запроса.
+        :param page_size: Количество наборов параметров в одном обращении к базе.
+        """
+        try:
+            sql_query.execute_many(query, data, page_size=page_size)
+        except Exception as e:
+            raise Exception(f"Database error: {e}")
+
+    @staticmethod
+    def execute_values(query, data, template=None, page_size=None, fetch=False):
+        """
+        Многострочная вставка одним запросом на пачку строк.
+
+        :param query: SQL-запрос вида "INSERT ... VALUES %s [RETURNING ...]".
+        :param data: Список строк для вставки.
+        :param template: Шаблон одной строки, например "(%s, %s, NULL)".
+        :param page_size: Количество строк в одном запросе.
+        :param fetch: Вернуть строки RETURNING (в порядке строк data).
         """
         try:
-            with psycopg2.connect(
-                dbname="your_database_name",
-                user="your_user",
-                password="your_password",
-                host="your_host",
-                port="your_port"
-            ) as conn:
-                with conn.cursor() as cursor:
-                    execute_batch(cursor, query, data)
-                conn.commit()
+            return sql_query.execute_values(
+                query, data, template=template, page_size=page_size, fetch=fetch
+            )
         except Exception as e:
-            print(f"Error executing batch query: {e}")
-            raise
\ No newline at end of file
+            raise Exception(f"Database error: {e}")
@@ -1,13 +1,4 @@
-from django.db import connection
-
-def execute_query(query, params=None, fetchone=False, fetchall=False):
-    # Пример реализации функции выполнения запроса
-    with connection.cursor() as cursor:
-        cursor.execute(query, params or [])
-        if fetchone:
-            return cursor.fetchone()
-        if fetchall:
-            return cursor.fetchall()
+from core.utils.query import execute_query
 
 
 def validate_unique_field(table, field, value, exclude_id=None):
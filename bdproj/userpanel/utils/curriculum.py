@@ -0,0 +1,144 @@
+import threading
+
+from django.conf import settings
+
+from core.utils.cache import TieredCache, VersionStamps
+from core.utils.query import Statement, add_write_listener, execute_query
+from core.utils.result_cache import MISS
+from core.utils.rows import Group
+
+
+# Запись в любую из этих таблиц пересобирает дерево модулей
+CURRICULUM_TABLES = frozenset({"modules", "topics"})
+
+MODULE_TREE_QUERY = Statement("module_tree", """
+    SELECT
+        m.id AS module_id,
+        m.name AS module_name,
+        m.description AS module_description,
+        t.id AS topic_id,
+        t.name AS topic_name,
+        t.description AS topic_description
+    FROM Modules m
+    LEFT JOIN Topics t ON t.module_id = m.id
+    ORDER BY m.id, t.id;
+""")
+
+USER_MODULE_IDS_QUERY = Statement("user_module_ids", """
+    SELECT DISTINCT module_id FROM UsersModules WHERE user_id = %s ORDER BY module_id;
+""")
+
+CURRICULUM_GROUP = Group(
+    "module_id",
+    {"id": "module_id", "name": "module_name", "description": "module_description"},
+    children={
+        "topics": Group(
+            "topic_id",
+            {"id": "topic_id", "name": "topic_name", "description": "topic_description"},
+        ),
+    },
+)
+
+
+class CurriculumCache:
+    """
+    Модули пользователя с их темами в два уровня.
+
+    Общий уровень — дерево "модуль -> темы" всех модулей: строится одним
+    запросом и хранится в памяти процесса, пока администратор не изменит
+    модули или темы (core.utils.query.add_write_listener; в других
+    процессах — через invalidation_bus). Сборка, начатая до такой записи,
+    в кэш не попадает.
+
+    Пользовательский уровень — только список id модулей, на которые
+    записан пользователь (TieredCache: память процесса и общий кэш).
+    Ключ списка включает версию пользователя (VersionStamps); после
+    записи на модули или снятия с них вызывается invalidate_user, который
+    заводит новую версию. Список, прочитанный из базы до этого, остаётся
+    под старым ключом и больше не читается.
+
+    Ответ собирается из двух уровней без запросов к базе. Модули дерева
+    общие для всех запросов, изменять их нельзя.
+    """
+
+    def __init__(self, tables=CURRICULUM_TABLES, namespace="curriculum_users", timeout=3600, bus=None):
+        self.tables = tables
+        self.enrolled = TieredCache(namespace, timeout=timeout, bus=bus)
+        self.versions = VersionStamps(f"{namespace}_version")
+        self._tree = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self._building = threading.Lock()
+        self.builds = 0
+        self.invalidations = 0
+
+    def modules(self, user_id):
+        """
+        Модули пользователя (по возрастанию id) с их темами.
+        """
+        module_ids = self.module_ids(user_id)
+        tree = self.tree()
+        return [tree[module_id] for module_id in module_ids if module_id in tree]
+
+    def module_ids(self, user_id):
+        # Версия читается до запроса к базе: если пользователя перезапишут
+        # во время сборки, результат уйдёт под уже устаревший ключ
+        key = f"{user_id}:{self.versions.get(user_id)}"
+        return self.enrolled.get_or_build(key, lambda: tuple(
+            row[0] for row in execute_query(USER_MODULE_IDS_QUERY, [user_id], fetchall=True)
+        ))
+
+    def tree(self):
+        """
+        {module_id: модуль с темами} для всех модулей.
+        """
+        tree = self._tree
+        if tree is not None:
+            return tree
+
+        # Дерево собирает один поток, остальные ждут его результата
+        with self._building:
+            with self._lock:
+                if self._tree is not None:
+                    return self._tree
+                version = self._version
+
+            modules = execute_query(MODULE_TREE_QUERY, fetchall=True, mapper=CURRICULUM_GROUP)
+            tree = {module["id"]: module for module in modules}
+
+            with self._lock:
+                self.builds += 1
+                if version == self._version:
+                    self._tree = tree
+            return tree
+
+    def invalidate(self, table=None):
+        if table is not None and table not in self.tables:
+            return
+        with self._lock:
+            self._version += 1
+            self._tree = None
+            self.invalidations += 1
+
+    def invalidate_user(self, user_id):
+        """
+        Сбрасывает список модулей пользователя во всех процессах.
+        """
+        version = self.versions.get(user_id)
+        self.versions.bump(user_id)
+        self.enrolled.delete(f"{user_id}:{version}")
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "built": self._tree is not None,
+                "modules": len(self._tree) if self._tree is not None else 0,
+                "builds": self.builds,
+                "invalidations": self.invalidations,
+            }
+        stats["enrolled"] = self.enrolled.stats()
+        return stats
+
+
+curriculum = CurriculumCache(timeout=getattr(settings, "CURRICULUM_CACHE_TTL", 3600))
+add_write_listener(curriculum.invalidate)
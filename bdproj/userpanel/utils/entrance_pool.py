@@ -0,0 +1,306 @@
+import threading
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from core.utils.cache import shared_cache
+from core.utils.query import Statement, add_write_listener, execute_query
+from core.utils.rows import Group
+from core.utils.sampling import SamplingPool
+
+
+_RECENT_KEY = "entrance_seen:{}"
+
+
+# Запись в любую из этих таблиц пересобирает пул
+ENTRANCE_POOL_TABLES = frozenset({
+    "testsquestions",
+    "questions",
+    "topics",
+    "tests",
+    "modules",
+    "questionoptions",
+    "optionss",
+    "questiontags",
+})
+
+# Источники вопросов (ENTRANCE_TEST_SOURCE = "<вид>:<значение>"): запрос
+# возвращает question_id без повторов
+ENTRANCE_SOURCES = {
+    # Все тесты модуля
+    "module": """
+        SELECT DISTINCT tq.question_id
+        FROM TestsQuestions tq
+        JOIN Tests ts ON tq.test_id = ts.id
+        WHERE ts.module_id = %s
+    """,
+    # Один тест
+    "test": "SELECT DISTINCT question_id FROM TestsQuestions WHERE test_id = %s",
+    # Вопросы с меткой (таблица questiontags)
+    "tag": "SELECT question_id FROM QuestionTags WHERE tag = %s",
+}
+
+_QUESTION_COLUMNS = """
+        q.id AS question_id,
+        q.name AS question_name,
+        t.id AS topic_id,
+        t.name AS topic_name,
+        mods.level_id AS level_id,
+        o.id AS option_id,
+        o.value AS option_text,
+        CASE WHEN q.correct_answer_id = o.id THEN TRUE ELSE FALSE END AS is_correct
+"""
+
+# Весь пул источника: вопросы с вариантами ответов
+ENTRANCE_POOL_QUERIES = {
+    kind: Statement(f"entrance_pool_{kind}", f"""
+        SELECT {_QUESTION_COLUMNS}
+        FROM ({source}) src
+        JOIN Questions q ON q.id = src.question_id
+        JOIN Topics t ON q.topic_id = t.id
+        JOIN Modules mods ON t.module_id = mods.id
+        JOIN QuestionOptions qo ON q.id = qo.question_id
+        JOIN Optionss o ON qo.option_id = o.id
+        ORDER BY q.id, o.id
+    """)
+    for kind, source in ENTRANCE_SOURCES.items()
+}
+
+ENTRANCE_COUNT_QUERIES = {
+    kind: Statement(f"entrance_pool_size_{kind}", f"SELECT count(*) FROM ({source}) src")
+    for kind, source in ENTRANCE_SOURCES.items()
+}
+
+# Выборка на стороне базы: по квоте случайных вопросов с каждого уровня
+# (ROW_NUMBER по уровню в случайном порядке), затем добор случайными до
+# размера теста. По всему банку идут только id вопросов; варианты ответов
+# читаются по индексам только для выбранных вопросов. С seed случайный
+# порядок заменяется хэшем от seed и id вопроса — выборка повторяема.
+# Параметры — sample_params()
+ENTRANCE_SAMPLE_QUERIES = {
+    kind: Statement(f"entrance_sample_{kind}", f"""
+        WITH ranked AS MATERIALIZED (
+            SELECT id, r, row_number() OVER (PARTITION BY level_id ORDER BY r, id) <= %s AS quota
+            FROM (
+                SELECT
+                    q.id,
+                    mods.level_id,
+                    CASE WHEN %s::text IS NULL THEN random()
+                         ELSE hashtext(%s::text || ':' || q.id)::float8 END AS r
+                FROM ({source}) src
+                JOIN Questions q ON q.id = src.question_id
+                JOIN Topics t ON q.topic_id = t.id
+                JOIN Modules mods ON t.module_id = mods.id
+                WHERE q.id <> ALL(%s::int[])
+            ) keyed
+        ),
+        picked AS (
+            SELECT (quota.ids || rest.ids)[1:GREATEST(%s, cardinality(quota.ids))] AS ids
+            FROM
+                (SELECT coalesce(array_agg(id ORDER BY r, id), '{{}}') AS ids FROM ranked WHERE quota) quota,
+                (SELECT coalesce(array_agg(id ORDER BY r, id), '{{}}') AS ids
+                 FROM (SELECT id, r FROM ranked WHERE NOT quota ORDER BY r, id LIMIT %s) extra) rest
+        )
+        SELECT {_QUESTION_COLUMNS}
+        FROM picked p
+        CROSS JOIN unnest(p.ids) WITH ORDINALITY AS s(id, position)
+        JOIN Questions q ON q.id = s.id
+        JOIN Topics t ON q.topic_id = t.id
+        JOIN Modules mods ON t.module_id = mods.id
+        JOIN QuestionOptions qo ON q.id = qo.question_id
+        JOIN Optionss o ON qo.option_id = o.id
+        ORDER BY s.position, o.id
+    """)
+    for kind, source in ENTRANCE_SOURCES.items()
+}
+
+
+def sample_params(value, per_level, size, exclude=(), seed=None):
+    seed = None if seed is None else str(seed)
+    return [per_level, seed, seed, value, list(exclude), size, size]
+
+
+ENTRANCE_QUESTIONS_GROUP = Group(
+    "question_id",
+    ["question_id", "question_name", "topic_id", "topic_name", "level_id"],
+    children={
+        "options": Group("option_id", ["option_id", "option_text", "is_correct"]),
+    },
+)
+
+
+def entrance_source():
+    """
+    (вид, значение) источника вопросов из ENTRANCE_TEST_SOURCE:
+    "module:<id>", "test:<id>" или "tag:<метка>".
+    """
+    source = getattr(settings, "ENTRANCE_TEST_SOURCE", "module:37")
+    kind, _, value = source.partition(":")
+    if kind not in ENTRANCE_SOURCES or not value:
+        raise ImproperlyConfigured(f"Invalid ENTRANCE_TEST_SOURCE: {source!r}.")
+    if kind != "tag":
+        try:
+            value = int(value)
+        except ValueError:
+            raise ImproperlyConfigured(f"Invalid ENTRANCE_TEST_SOURCE: {source!r}.")
+    return kind, value
+
+
+class EntrancePool:
+    """
+    Вопросы вступительного теста с вариантами ответов, разложенные по уровням.
+
+    Пул строится одним запросом при первом обращении и хранится в памяти
+    процесса, пока администратор не изменит вопросы, варианты, темы, модули,
+    метки или связи тестов с вопросами (core.utils.query.add_write_listener;
+    в других процессах — через invalidation_bus). Сборка, начатая до такой
+    записи, в кэш не попадает.
+
+    Если в источнике больше max_questions вопросов, пул не строится
+    (запоминается только его размер), и тест выбирается запросом к базе.
+
+    Вопросы пула общие для всех запросов, изменять их нельзя.
+    """
+
+    def __init__(self, tables=ENTRANCE_POOL_TABLES):
+        self.tables = tables
+        self._source = None
+        self._size = None
+        self._pool = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self._building = threading.Lock()
+        self.builds = 0
+        self.invalidations = 0
+
+    def pool(self, source, max_questions=None):
+        """
+        SamplingPool вопросов источника (с группировками "level" и "topic")
+        или None, если вопросов больше max_questions.
+        """
+        with self._lock:
+            if self._source == source and self._size is not None:
+                return self._fitting(max_questions)
+
+        # Пул собирает один поток, остальные ждут его результата
+        with self._building:
+            with self._lock:
+                if self._source == source and self._size is not None:
+                    return self._fitting(max_questions)
+                version = self._version
+
+            kind, value = source
+            size = execute_query(ENTRANCE_COUNT_QUERIES[kind], [value], fetchone=True)[0]
+            pool = None
+            if max_questions is None or size <= max_questions:
+                pool = question_pool(execute_query(
+                    ENTRANCE_POOL_QUERIES[kind], [value], fetchall=True, mapper=ENTRANCE_QUESTIONS_GROUP
+                ))
+                size = len(pool)
+
+            with self._lock:
+                self.builds += 1
+                if version == self._version:
+                    self._source, self._size, self._pool = source, size, pool
+            return pool
+
+    def _fitting(self, max_questions):
+        if max_questions is not None and self._size > max_questions:
+            return None
+        return self._pool
+
+    def invalidate(self, table=None):
+        if table is not None and table not in self.tables:
+            return
+        with self._lock:
+            self._version += 1
+            self._source = self._size = self._pool = None
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "built": self._pool is not None,
+                "source": ":".join(map(str, self._source)) if self._source else None,
+                "questions": self._size or 0,
+                "levels": len(self._pool.groups["level"][1]) if self._pool is not None else 0,
+                "builds": self.builds,
+                "invalidations": self.invalidations,
+            }
+
+
+entrance_pool = EntrancePool()
+add_write_listener(entrance_pool.invalidate)
+
+
+def question_pool(questions, key="question_id", level="level_id", topic="topic_id"):
+    """
+    SamplingPool вопросов с группировками "level" и "topic".
+    """
+    return SamplingPool(
+        questions,
+        key=itemgetter(key),
+        groups={"level": itemgetter(level), "topic": itemgetter(topic)},
+    )
+
+
+def entrance_test(per_level=2, size=10, exclude=(), seed=None):
+    """
+    Вопросы вступительного теста: per_level случайных вопросов с каждого
+    уровня и добор до size. Вопросы из exclude (например, недавно
+    показанные) не выбираются, пока без них хватает вопросов на тест;
+    одинаковый seed даёт одинаковый тест.
+
+    ENTRANCE_TEST_SAMPLING: "memory" — выборка из пула в памяти, "sql" —
+    выборка в Postgres (по сети передаются только выбранные вопросы),
+    "auto" — пул в памяти, пока в источнике не больше
+    ENTRANCE_POOL_MAX_QUESTIONS вопросов, иначе выборка в Postgres.
+    """
+    source = entrance_source()
+    mode = getattr(settings, "ENTRANCE_TEST_SAMPLING", "auto")
+    pool = None
+    if mode != "sql":
+        max_questions = None if mode == "memory" else getattr(settings, "ENTRANCE_POOL_MAX_QUESTIONS", 2000)
+        pool = entrance_pool.pool(source, max_questions)
+
+    def sample(exclude):
+        if pool is not None:
+            return pool.sample(size, quotas={"level": per_level}, exclude=exclude, seed=seed)
+        kind, value = source
+        return execute_query(
+            ENTRANCE_SAMPLE_QUERIES[kind],
+            sample_params(value, per_level, size, exclude, seed),
+            fetchall=True,
+            mapper=ENTRANCE_QUESTIONS_GROUP,
+        )
+
+    questions = sample(exclude)
+    if exclude and len(questions) < size:
+        # Без исключённых вопросов на тест не хватает
+        questions = sample(())
+    return questions
+
+
+def recent_questions(user_id):
+    """
+    Вопросы вступительного теста, недавно показанные пользователю.
+    """
+    return shared_cache().get(_RECENT_KEY.format(user_id), ())
+
+
+def remember_questions(user_id, questions):
+    """
+    Запоминает показанные вопросы (последние ENTRANCE_RECENT_QUESTIONS
+    на ENTRANCE_RECENT_TTL секунд) в общем кэше, чтобы повторный запрос
+    теста в любом процессе выдал другие вопросы.
+    """
+    limit = getattr(settings, "ENTRANCE_RECENT_QUESTIONS", 50)
+    if limit <= 0:
+        return
+    seen = [*recent_questions(user_id), *(question["question_id"] for question in questions)]
+    shared_cache().set(
+        _RECENT_KEY.format(user_id),
+        tuple(seen[-limit:]),
+        timeout=getattr(settings, "ENTRANCE_RECENT_TTL", 24 * 3600),
+    )
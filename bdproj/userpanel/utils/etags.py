@@ -0,0 +1,42 @@
+from core.utils.cache import VersionStamps, hashed_key, invalidation_bus
+
+from .curriculum import curriculum
+from .module_tests import module_tests
+
+
+# Версия прогресса пользователя: поднимается при каждой записи
+# в UserTestProgress/CourseProgress (сдача теста, правка в админке)
+progress_versions = VersionStamps("progress_version")
+
+# Версия прогресса всех пользователей: поднимается, когда прогресс
+# удаляется каскадом (удаление теста или модуля в админке)
+ALL_PROGRESS = "all"
+
+
+def _weak_etag(*parts):
+    # Слабый ETag: ответ может отдаваться и сжатым, и несжатым
+    return f'W/"{hashed_key(repr(parts))[:20]}"'
+
+
+def curriculum_etag(request, *args, **kwargs):
+    """
+    Модули пользователя (из кэша) и версии справочников модулей и тем.
+    """
+    return _weak_etag(
+        "curriculum",
+        curriculum.module_ids(request.user_id),
+        invalidation_bus.stamps("table:modules", "table:topics"),
+    )
+
+
+def module_test_etag(request, module_id):
+    """
+    Версия содержимого тестов; у случайной выборки (size, per_topic) ETag нет.
+    """
+    if request.GET.get("size") or request.GET.get("per_topic"):
+        return None
+    return _weak_etag("module_test", module_id, module_tests.version())
+
+
+def progress_etag(request, *args, **kwargs):
+    return _weak_etag("progress", request.user_id, progress_versions.get_many(request.user_id, ALL_PROGRESS))
@@ -1,9 +1,2 @@
-import hashlib
-
-def hash_password(password):
-    """Хэширует пароль."""
-    return hashlib.sha256(password.encode('utf-8')).hexdigest()
-
-def verify_password(password, hashed_password):
-    """Проверяет, совпадает ли пароль с хэшем."""
-    return hash_password(password) == hashed_password
\ No newline at end of file
+# Хэширование паролей общее для всех приложений (auth_users.utils.hash_password)
+from auth_users.utils.hash_password import hash_password, verify_password
@@ -0,0 +1,70 @@
+import gzip
+from functools import wraps
+
+from django.conf import settings
+
+from core.utils.cache import TieredCache
+
+
+class ModuleTestCache:
+    """
+    Готовые ответы теста модуля: закодированный JSON (и, если задан
+    gzip_level, заранее сжатый gzip) по ключу (module_id, версия
+    содержимого).
+
+    Тест одинаков для всех учащихся, поэтому ответ строится один раз на
+    версию и дальше отдаётся без запросов и повторного кодирования.
+    Версия — поколение общего кэша (core.utils.cache.SharedNamespace):
+    bump() после изменения тестов, вопросов, вариантов или их связей
+    делает все сохранённые ответы невидимыми во всех процессах.
+    Одновременные промахи (холодный кэш в начале экзамена) схлопываются
+    в одну сборку (TieredCache.get_or_build).
+    """
+
+    def __init__(self, namespace="module_tests", timeout=3600, gzip_level=None, bus=None):
+        self.gzip_level = gzip_level
+        self.cache = TieredCache(namespace, timeout=timeout, local_ttl=timeout, bus=bus)
+
+    def payload(self, module_id, build):
+        """
+        (JSON-байты, gzip-байты или None); build() возвращает JSON-байты
+        и вызывается только при промахе.
+        """
+        return self.cache.get_or_build(str(module_id), lambda: self._encode(build()))
+
+    def _encode(self, content):
+        if not self.gzip_level:
+            return content, None
+        return content, gzip.compress(content, compresslevel=self.gzip_level)
+
+    def version(self):
+        return self.cache.shared.generation()
+
+    def bump(self):
+        """
+        Новая версия содержимого: сбрасывает ответы всех модулей.
+        """
+        self.cache.clear()
+
+    def stats(self):
+        return {"version": self.version(), **self.cache.stats()}
+
+
+module_tests = ModuleTestCache(
+    timeout=getattr(settings, "MODULE_TEST_CACHE_TTL", 3600),
+    gzip_level=getattr(settings, "MODULE_TEST_GZIP_LEVEL", 6),
+)
+
+
+def bumps_module_tests(view_func):
+    """
+    Декоратор записывающих методов админки: после успешного ответа
+    поднимает версию содержимого тестов модулей.
+    """
+    @wraps(view_func)
+    def wrapper(self, request, *args, **kwargs):
+        response = view_func(self, request, *args, **kwargs)
+        if response.status_code < 400:
+            module_tests.bump()
+        return response
+    return wrapper
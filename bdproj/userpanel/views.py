@@ -1,34 +1,235 @@
-from django.db.models import Q
+import logging
+from operator import itemgetter
+
+from django.conf import settings
 from .utils.required import isAuthorized
-from .utils.base_sql_handler import BaseSQLHandler
 from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework.views import APIView
-import random
-from django.db import connection
-from collections import defaultdict
-import psycopg2
-from psycopg2.extras import execute_batch
-from django.http import JsonResponse
-from django.db import connection
-
-def execute_query(query, params=None, fetchall=False, fetchone=False):
+from django.db import transaction
+from core.utils.query import Statement, execute_json, execute_query
+from core.utils.rows import ROW_DICT, Group
+from core.utils.sampling import SamplingPool
+from core.utils.streaming import RawJsonResponse, accepts_encoding
+from .utils.curriculum import curriculum
+from .utils.entrance_pool import entrance_test, recent_questions, remember_questions
+from .utils.etags import curriculum_etag, module_test_etag, progress_etag, progress_versions
+from .utils.module_tests import module_tests
+
+
+logger = logging.getLogger(__name__)
+
+# Часто выполняемые запросы: на сервере они подготавливаются
+# один раз на соединение и дальше выполняются без разбора и планирования
+CORRECT_ANSWERS_QUERY = Statement("question_correct_answers", """
+    SELECT id, correct_answer_id FROM questions WHERE id = ANY(%s);
+""")
+
+# Уровни и правильные ответы только присланных вопросов
+ANSWER_KEY_QUERY = Statement("answer_key", """
+    SELECT q.id, m.level_id, q.correct_answer_id
+    FROM questions q
+    JOIN topics t ON q.topic_id = t.id
+    JOIN modules m ON t.module_id = m.id
+    WHERE q.id = ANY(%s);
+""")
+
+# Уровни, по которым есть вопросы (справочник, берётся из кэша результатов)
+QUESTION_LEVELS_QUERY = Statement("question_levels", """
+    SELECT DISTINCT m.level_id
+    FROM modules m
+    WHERE m.level_id IS NOT NULL
+      AND EXISTS (
+          SELECT 1 FROM topics t JOIN questions q ON q.topic_id = t.id WHERE t.module_id = m.id
+      );
+""")
+
+ASSIGN_LEVEL_QUERY = Statement("assign_level", """
+    UPDATE users SET entrance_test = TRUE, level_id = %s WHERE id = %s;
+""")
+
+ASSIGN_LEVEL_MODULES_QUERY = Statement("assign_level_modules", """
+    INSERT INTO UsersModules (user_id, module_id)
+    SELECT %s, id FROM modules WHERE level_id = %s
+    ON CONFLICT DO NOTHING;
+""")
+
+LEVEL_MODULES_QUERY = Statement("level_modules", """
+    SELECT id FROM modules WHERE level_id = %s ORDER BY id;
+""")
+
+# Тест, который отдаёт GET moduletest/<id>/ (MODULE_TEST_JSON_QUERY,
+# MODULE_TEST_QUERY): первый по id тест модуля, у которого есть вопросы
+# с вариантами ответов. Ответы засчитываются именно ему
+MODULE_SERVED_TEST_QUERY = Statement("module_served_test", """
+    SELECT ts.id, ts.name
+    FROM tests ts
+    WHERE ts.module_id = %s
+      AND EXISTS (
+          SELECT 1
+          FROM testsquestions tq
+          JOIN questions q ON q.id = tq.question_id
+          JOIN topics t ON q.topic_id = t.id
+          JOIN modules mods ON t.module_id = mods.id
+          JOIN questionoptions qo ON qo.question_id = q.id
+          JOIN optionss o ON o.id = qo.option_id
+          WHERE tq.test_id = ts.id
+      )
+    ORDER BY ts.id
+    LIMIT 1;
+""")
+
+UPSERT_TEST_PROGRESS_QUERY = Statement("upsert_test_progress", """
+    INSERT INTO usertestprogress (user_id, test_id, attempts, correct_answers, is_passed)
+    VALUES (%s, %s, 1, %s, %s)
+    ON CONFLICT (user_id, test_id) DO UPDATE SET
+        attempts = usertestprogress.attempts + 1,
+        correct_answers = EXCLUDED.correct_answers,
+        is_passed = EXCLUDED.is_passed;
+""")
+
+# Прогресс по курсу: курс — все тесты всех модулей
+UPSERT_COURSE_PROGRESS_QUERY = Statement("upsert_course_progress", """
+    INSERT INTO courseprogress (user_id, is_complite_course, completion_percentage, modules_complite)
+    SELECT %s, p.percentage >= 100, p.percentage, p.passed
+    FROM (
+        SELECT
+            c.passed,
+            CASE WHEN c.total > 0 THEN (c.passed::float8 / c.total) * 100 ELSE 0.0 END AS percentage
+        FROM (
+            SELECT
+                (SELECT count(*) FROM tests WHERE module_id IN (SELECT id FROM modules)) AS total,
+                (SELECT count(*) FROM usertestprogress
+                 WHERE user_id = %s AND is_passed = true
+                   AND test_id IN (SELECT id FROM tests WHERE module_id IN (SELECT id FROM modules))) AS passed
+        ) c
+    ) p
+    ON CONFLICT (user_id) DO UPDATE SET
+        is_complite_course = EXCLUDED.is_complite_course,
+        completion_percentage = EXCLUDED.completion_percentage,
+        modules_complite = EXCLUDED.modules_complite
+    RETURNING completion_percentage, is_complite_course;
+""")
+
+# Следующий уровень, если пройдены все тесты модулей текущего уровня
+# и такой уровень есть
+PROMOTE_LEVEL_QUERY = Statement("promote_level", """
+    UPDATE users u
+    SET level_id = u.level_id + 1
+    WHERE u.id = %s
+      AND u.level_id IS NOT NULL
+      AND EXISTS (SELECT 1 FROM levels l WHERE l.id = u.level_id + 1)
+      AND NOT EXISTS (
+          SELECT 1
+          FROM tests t
+          JOIN modules m ON t.module_id = m.id
+          WHERE m.level_id = u.level_id
+            AND t.id NOT IN (
+                SELECT test_id FROM usertestprogress WHERE user_id = %s AND is_passed = true
+            )
+      );
+""")
+
+MODULE_TEST_QUERY = Statement("module_test_questions", """
+    SELECT 
+        ts.id AS test_id,
+        ts.name AS test_name,
+        q.id AS question_id,
+        q.name AS question_name,
+        t.id AS topic_id,
+        t.name AS topic_name,
+        mods.level_id AS level_id,
+        o.id AS option_id,
+        o.value AS option_text,
+        q.correct_answer_id AS correct_answer_id
+    FROM TestsQuestions tq
+    JOIN Questions q ON tq.question_id = q.id
+    JOIN Topics t ON q.topic_id = t.id
+    JOIN Tests ts ON tq.test_id = ts.id
+    JOIN Modules mods ON t.module_id = mods.id
+    JOIN QuestionOptions qo ON q.id = qo.question_id
+    JOIN Optionss o ON qo.option_id = o.id
+    WHERE ts.module_id = %s
+    ORDER BY ts.id, q.id, o.id;
+""")
+
+# Тот же тест модуля, собранный в JSON на стороне Postgres: одна строка
+# с готовым документом вместо строки на каждую пару (вопрос, вариант).
+# Как и при группировке MODULE_TEST_QUERY, повторные связи схлопываются,
+# а тесты без вопросов с вариантами пропускаются
+MODULE_TEST_JSON_QUERY = Statement("module_test_json", """
+    SELECT json_build_object('id', ts.id, 'name', ts.name, 'questions', qs.questions)::text
+    FROM Tests ts
+    CROSS JOIN LATERAL (
+        SELECT json_agg(json_build_object(
+            'id', q.id,
+            'name', q.name,
+            'topic_id', t.id,
+            'topic_name', t.name,
+            'correct_answer_id', q.correct_answer_id,
+            'options', opts.options
+        ) ORDER BY q.id) AS questions
+        FROM (SELECT DISTINCT question_id FROM TestsQuestions WHERE test_id = ts.id) tq
+        JOIN Questions q ON q.id = tq.question_id
+        JOIN Topics t ON q.topic_id = t.id
+        JOIN Modules mods ON t.module_id = mods.id
+        CROSS JOIN LATERAL (
+            SELECT json_agg(json_build_object('id', o.id, 'text', o.value) ORDER BY o.id) AS options
+            FROM (SELECT DISTINCT option_id FROM QuestionOptions WHERE question_id = q.id) qo
+            JOIN Optionss o ON qo.option_id = o.id
+        ) opts
+        WHERE opts.options IS NOT NULL
+    ) qs
+    WHERE ts.module_id = %s AND qs.questions IS NOT NULL
+    ORDER BY ts.id
+    LIMIT 1;
+""")
+
+EMPTY_MODULE_TEST = {"id": None, "name": None, "questions": []}
+
+
+def module_test(module_id):
     """
-    Выполнение SQL-запроса.
+    Тест модуля (один на модуль) с вопросами и вариантами ответов.
     """
-    with connection.cursor() as cursor:
-        cursor.execute(query, params or [])
-        if fetchall:
-            return cursor.fetchall()
-        if fetchone:
-            return cursor.fetchone()
-        return None
-
-def execute_many(query, data):
+    tests = execute_query(MODULE_TEST_QUERY, [module_id], fetchall=True, mapper=MODULE_TEST_GROUP)
+    return tests[0] if tests else dict(EMPTY_MODULE_TEST)
+
+
+def module_test_content(module_id):
     """
-    Выполняет SQL-запрос с множеством параметров.
+    Тест модуля в виде JSON-байтов: собранный в Postgres
+    (MODULE_TEST_SQL_JSON) или сгруппированный в Python.
     """
-    with connection.cursor() as cursor:
-        execute_batch(cursor, query, data)
+    if getattr(settings, "MODULE_TEST_SQL_JSON", True):
+        content = execute_json(MODULE_TEST_JSON_QUERY, [module_id])
+        if content is not None:
+            return content
+        return JsonResponse(EMPTY_MODULE_TEST).content
+    return JsonResponse(module_test(module_id)).content
+
+# Сборка плоских строк JOIN во вложенные структуры ответов
+MODULE_TEST_GROUP = Group(
+    "test_id",
+    {"id": "test_id", "name": "test_name"},
+    children={
+        "questions": Group(
+            "question_id",
+            {
+                "id": "question_id",
+                "name": "question_name",
+                "topic_id": "topic_id",
+                "topic_name": "topic_name",
+                "correct_answer_id": "correct_answer_id",
+            },
+            children={
+                "options": Group("option_id", {"id": "option_id", "text": "option_text"}),
+            },
+        ),
+    },
+)
 
 
 class EntranceTestAPIView(APIView):
@@ -45,9 +246,7 @@ class EntranceTestAPIView(APIView):
         user_query = """
             SELECT id, entrance_test FROM users WHERE id = %s;
         """
-        with connection.cursor() as cursor:
-            cursor.execute(user_query, [user_id])
-            user = cursor.fetchone()
+        user = execute_query(user_query, [user_id], fetchone=True)
 
         if not user:
             return JsonResponse({"error": "User not found."}, status=404)
@@ -57,84 +256,24 @@ class EntranceTestAPIView(APIView):
             modules_query = """
                 SELECT id, name, description FROM modules;
             """
-            with connection.cursor() as cursor:
-                cursor.execute(modules_query)
-                modules = cursor.fetchall()
-                modules_list = [{"id": m[0], "name": m[1], "description": m[2]} for m in modules]
+            modules_list = execute_query(modules_query, fetchall=True, mapper=ROW_DICT)
             return JsonResponse({"status": "modules", "modules": modules_list}, status=200)
 
         # Генерация теста, если он не пройден
         try:
-            # Запрос для получения вопросов и их вариантов
-            questions_with_options_query = """
-                SELECT 
-                    q.id AS question_id, 
-                    q.name AS question_name, 
-                    t.id AS topic_id, 
-                    t.name AS topic_name, 
-                    mods.level_id AS level_id,
-                    o.id AS option_id,
-                    o.value AS option_text,
-                    CASE WHEN q.correct_answer_id = o.id THEN TRUE ELSE FALSE END AS is_correct
-                FROM 
-                    TestsQuestions tq
-                JOIN 
-                    Questions q ON tq.question_id = q.id
-                JOIN 
-                    Topics t ON q.topic_id = t.id
-                JOIN 
-                    Tests ts ON tq.test_id = ts.id
-                JOIN 
-                    Modules mods ON t.module_id = mods.id
-                JOIN 
-                    QuestionOptions qo ON q.id = qo.question_id
-                JOIN 
-                    Optionss o ON qo.option_id = o.id
-                WHERE 
-                    ts.module_id = 37;
-            """
-
-            with connection.cursor() as cursor:
-                cursor.execute(questions_with_options_query)
-                rows = cursor.fetchall()
-
-            # Группируем вопросы и их варианты ответов
-            questions_map = {}
-            for row in rows:
-                question_id = row[0]
-                if question_id not in questions_map:
-                    questions_map[question_id] = {
-                        "question_id": question_id,
-                        "question_name": row[1],
-                        "topic_id": row[2],
-                        "topic_name": row[3],
-                        "level_id": row[4],
-                        "options": []
-                    }
-                # Добавляем варианты ответов
-                questions_map[question_id]["options"].append({
-                    "option_id": row[5],
-                    "option_text": row[6],
-                    "is_correct": row[7],
-                })
-
-            # Выбираем 10 случайных вопросов из разных уровней и тем
-            questions_by_level = defaultdict(list)
-            for question in questions_map.values():
-                questions_by_level[question["level_id"]].append(question)
-
-            selected_questions = []
-            for level_id, questions in questions_by_level.items():
-                random.shuffle(questions)
-                selected_questions.extend(questions[:2])  # Берём 2 вопроса с каждого уровня
-
-            # Если 10 вопросов ещё нет, добираем случайными
-            all_questions = list(questions_map.values())
-            random.shuffle(all_questions)
-            while len(selected_questions) < 10 and all_questions:
-                question = all_questions.pop(0)
-                if question not in selected_questions:
-                    selected_questions.append(question)
+            # По 2 случайных вопроса с каждого уровня, добор до 10: из пула
+            # в памяти или, для большого банка вопросов, выборкой в Postgres.
+            # Недавно показанные вопросы не повторяются; ?seed= даёт
+            # повторяемый тест
+            seed = request.GET.get("seed") or None
+            selected_questions = entrance_test(
+                per_level=2,
+                size=10,
+                exclude=() if seed is not None else recent_questions(user_id),
+                seed=seed,
+            )
+            if seed is None:
+                remember_questions(user_id, selected_questions)
 
             # Возвращаем результат
             return JsonResponse({"status": "test", "test": selected_questions}, status=200)
@@ -155,21 +294,18 @@ class EntranceTestAPIView(APIView):
         if not answers:
             return JsonResponse({"error": "No answers provided"}, status=400)
 
-        # Получаем все вопросы и уровни
-        questions_query = """
-            SELECT q.id, m.level_id
-            FROM questions q
-            JOIN topics t ON q.topic_id = t.id
-            JOIN modules m ON t.module_id = m.id
-        """
-        questions_data = execute_query(questions_query, fetchall=True)
-
-        # Создаём словарь для сопоставления вопросов и уровней
-        question_levels = {}
-        level_set = set()
-        for q_id, level_id in questions_data:
-            question_levels[q_id] = level_id
-            level_set.add(level_id)
+        # Уровни и правильные ответы присланных вопросов — одним запросом
+        question_ids = list({
+            answer.get("question_id") for answer in answers
+            if type(answer.get("question_id")) is int
+        })
+        answer_key = {
+            q_id: (level_id, correct_answer_id)
+            for q_id, level_id, correct_answer_id in execute_query(ANSWER_KEY_QUERY, [question_ids], fetchall=True)
+            if level_id is not None
+        }
+        level_set = {row[0] for row in execute_query(QUESTION_LEVELS_QUERY, fetchall=True)}
+        level_set.update(level_id for level_id, _ in answer_key.values())
 
         # Инициализируем счётчики правильных ответов и общего количества вопросов по уровням
         correct_counts = {level: 0 for level in level_set}
@@ -180,17 +316,13 @@ class EntranceTestAPIView(APIView):
             question_id = answer.get("question_id")
             selected_option_id = answer.get("selected_option_id")
 
-            if question_id not in question_levels:
+            if question_id not in answer_key:
                 continue  # Пропускаем вопросы без уровня
 
-            level_id = question_levels[question_id]
+            level_id, correct_answer_id = answer_key[question_id]
             total_counts[level_id] += 1  # Увеличиваем общее количество вопросов этого уровня
 
-            query = """
-            SELECT correct_answer_id FROM questions WHERE id = %s;
-            """
-            correct_answer_id = execute_query(query, [question_id], fetchone=True)
-            if correct_answer_id and correct_answer_id[0] == selected_option_id:
+            if correct_answer_id == selected_option_id:
                 correct_counts[level_id] += 1  # Увеличиваем количество правильных ответов уровня
 
         # Вычисляем процент правильных ответов по уровням
@@ -208,27 +340,14 @@ class EntranceTestAPIView(APIView):
             else:
                 break  # Если уровень не достигнут, выходим из цикла
 
-        # Обновляем статус теста и уровень для пользователя
-        update_query = """
-        UPDATE users SET entrance_test = TRUE, level_id = %s WHERE id = %s;
-        """
-        execute_query(update_query, [student_level, user_id])
+        # Статус теста, уровень и модули уровня записываются вместе
+        with transaction.atomic():
+            execute_query(ASSIGN_LEVEL_QUERY, [student_level, user_id])
+            execute_query(ASSIGN_LEVEL_MODULES_QUERY, [user_id, student_level])
+        curriculum.invalidate_user(user_id)
 
-        # Получаем модули, соответствующие уровню студента
-        modules_query = """
-            SELECT id FROM modules WHERE level_id = %s;
-        """
-        modules = execute_query(modules_query, [student_level], fetchall=True)
-
-        # Вставляем данные в таблицу UsersModules
-        if modules:
-            user_modules_data = [(user_id, module[0]) for module in modules]
-            insert_query = """
-                INSERT INTO UsersModules (user_id, module_id)
-                VALUES (%s, %s)
-                ON CONFLICT DO NOTHING;
-            """
-            execute_many(insert_query, user_modules_data)
+        # Модули уровня (справочник, из кэша результатов)
+        modules = execute_query(LEVEL_MODULES_QUERY, [student_level], fetchall=True)
 
         return JsonResponse({
             "status": "completed",
@@ -243,50 +362,14 @@ class EntranceTestAPIView(APIView):
 class UserModulesAPIView(APIView):
 
     @isAuthorized
+    @method_decorator(condition(etag_func=curriculum_etag))
     def get(self, request):
         user_id = request.user_id
 
         try:
-            # SQL-запрос для получения модулей пользователя вместе с их темами
-            query = """
-                SELECT 
-                    m.id AS module_id, 
-                    m.name AS module_name, 
-                    m.description AS module_description,
-                    t.id AS topic_id,
-                    t.name AS topic_name,
-                    t.description AS topic_description
-                FROM UsersModules um
-                JOIN Modules m ON um.module_id = m.id
-                LEFT JOIN Topics t ON t.module_id = m.id
-                WHERE um.user_id = %s
-                ORDER BY m.id, t.id;
-            """
-            with connection.cursor() as cursor:
-                cursor.execute(query, [user_id])
-                data = cursor.fetchall()
-
-            # Формируем список модулей с темами
-            modules_dict = {}
-            for row in data:
-                module_id, module_name, module_description, topic_id, topic_name, topic_description = row
-                
-                if module_id not in modules_dict:
-                    modules_dict[module_id] = {
-                        "id": module_id,
-                        "name": module_name,
-                        "description": module_description,
-                        "topics": []
-                    }
-                
-                if topic_id:  # Если у модуля есть темы
-                    modules_dict[module_id]["topics"].append({
-                        "id": topic_id,
-                        "name": topic_name,
-                        "description": topic_description
-                    })
-
-            modules_list = list(modules_dict.values())
+            # Модули пользователя вместе с их темами: дерево модулей
+            # и список модулей пользователя из кэша
+            modules_list = curriculum.modules(user_id)
 
             return JsonResponse({"modules": modules_list}, status=200)
 
@@ -298,72 +381,13 @@ class UserModulesAPIView(APIView):
 class ModuleTopicsTestsView(APIView):
 
     @isAuthorized
+    @method_decorator(condition(etag_func=curriculum_etag))
     def get(self, request):
         user_id = request.user_id
 
-        # Шаг 1: Выполняем JOIN для получения модулей и их тем,
-        #         только без лишних таблиц, чтобы не создавать дубликаты
-        query = """
-            SELECT 
-                m.id AS module_id,
-                m.name AS module_name,
-                m.description AS module_description,
-                t.id AS topic_id,
-                t.name AS topic_name,
-                t.description AS topic_description
-            FROM UsersModules um
-            JOIN Modules m ON um.module_id = m.id
-            LEFT JOIN Topics t ON t.module_id = m.id
-            WHERE um.user_id = %s
-            ORDER BY m.id, t.id
-        """
+        # Модули пользователя и их темы из кэша (userpanel.utils.curriculum)
+        result = curriculum.modules(user_id)
 
-        with connection.cursor() as cursor:
-            cursor.execute(query, [user_id])
-            rows = cursor.fetchall()
-
-        # rows может выглядеть так:
-        # [
-        #   (module_id, module_name, module_description, topic_id, topic_name, topic_description),
-        #   (module_id, module_name, module_description, topic_id, topic_name, topic_description),
-        #   ...
-        # ]
-
-        # Шаг 2: Собираем данные в структуру { module_id: { ...info..., topics: { topic_id: {...} } } }
-        modules_dict = {}  # словарь по module_id
-
-        for row in rows:
-            module_id, module_name, module_description, topic_id, topic_name, topic_description = row
-
-            # Если этого модуля ещё нет в словаре — создаём
-            if module_id not in modules_dict:
-                modules_dict[module_id] = {
-                    "id": module_id,
-                    "name": module_name,
-                    "description": module_description,
-                    "topics": {}
-                }
-
-            # Если у модуля есть тема
-            if topic_id:
-                # Проверим, нет ли её уже
-                if topic_id not in modules_dict[module_id]["topics"]:
-                    modules_dict[module_id]["topics"][topic_id] = {
-                        "id": topic_id,
-                        "name": topic_name,
-                        "description": topic_description
-                    }
-                # Если вдруг возникнут дубликаты, здесь мы не добавляем повторно
-
-        # Шаг 3: Преобразуем словарь в список (и «topics» также делаем списком)
-        result = []
-        for m_id, m_data in modules_dict.items():
-            module_topics_list = list(m_data["topics"].values())
-            # Заменяем словарь topics на список
-            m_data["topics"] = module_topics_list
-            result.append(m_data)
-
-        # Шаг 4: Возвращаем в JSON
         return JsonResponse({"modules": result}, status=200, safe=False)
     
 
@@ -371,78 +395,44 @@ class ModuleTopicsTestsView(APIView):
 class ModuleTestAPIView(APIView):
     
     @isAuthorized
+    @method_decorator(condition(etag_func=module_test_etag))
     def get(self, request, module_id):
         """
-        Получить тест для конкретного модуля
+        Получить тест для конкретного модуля.
+
+        Необязательные параметры: size — случайные size вопросов вместо всех,
+        per_topic — не меньше per_topic вопросов каждой темы, seed —
+        повторяемая выборка.
         """
         try:
-            query = """
-                SELECT 
-                    ts.id AS test_id,
-                    ts.name AS test_name,
-                    q.id AS question_id,
-                    q.name AS question_name,
-                    t.id AS topic_id,
-                    t.name AS topic_name,
-                    mods.level_id AS level_id,
-                    o.id AS option_id,
-                    o.value AS option_text,
-                    CASE WHEN q.correct_answer_id = o.id THEN TRUE ELSE FALSE END AS is_correct
-                FROM TestsQuestions tq
-                JOIN Questions q ON tq.question_id = q.id
-                JOIN Topics t ON q.topic_id = t.id
-                JOIN Tests ts ON tq.test_id = ts.id
-                JOIN Modules mods ON t.module_id = mods.id
-                JOIN QuestionOptions qo ON q.id = qo.question_id
-                JOIN Optionss o ON qo.option_id = o.id
-                WHERE ts.module_id = %s;
-            """
+            size = request.GET.get("size")
+            per_topic = request.GET.get("per_topic")
+            size = int(size) if size else None
+            per_topic = int(per_topic) if per_topic else None
+            if (size is not None and size < 0) or (per_topic is not None and per_topic < 0):
+                raise ValueError
+        except ValueError:
+            return JsonResponse({"error": "size and per_topic must be non-negative integers."}, status=400)
 
-            with connection.cursor() as cursor:
-                cursor.execute(query, [module_id])
-                data = cursor.fetchall()
-
-            # Формируем структуру теста
-            test = { "id": None, "name": None, "questions": [] }
-            questions_map = {}
-
-            for row in data:
-                (
-                    test_id, test_name,
-                    question_id, question_text,
-                    topic_id, topic_name,
-                    level_id,
-                    option_id, option_text,
-                    is_correct
-                ) = row
-
-                # Инициализируем test (один на модуль)
-                if test["id"] is None:
-                    test["id"] = test_id
-                    test["name"] = test_name
-
-                # Инициализируем вопрос, если его ещё нет
-                if question_id not in questions_map:
-                    questions_map[question_id] = {
-                        "id": question_id,
-                        "name": question_text,
-                        "topic_id": topic_id,
-                        "topic_name": topic_name,
-                        "correct_answer_id": None,
-                        "options": []
-                    }
-                    test["questions"].append(questions_map[question_id])
-
-                # Если вариант — корректный, запомним его id
-                if is_correct:
-                    questions_map[question_id]["correct_answer_id"] = option_id
-
-                # Добавляем вариант ответа (если он не null)
-                if option_id:
-                    questions_map[question_id]["options"].append({
-                        "id": option_id,
-                        "text": option_text
-                    })
+        try:
+            if size is None and per_topic is None:
+                # Тест целиком одинаков для всех: готовые байты из кэша
+                content, gzipped = module_tests.payload(module_id, lambda: module_test_content(module_id))
+                if gzipped is not None and accepts_encoding(request, "gzip"):
+                    response = RawJsonResponse(gzipped, status=200)
+                    response["Content-Encoding"] = "gzip"
+                else:
+                    response = RawJsonResponse(content, status=200)
+                patch_vary_headers(response, ["Accept-Encoding"])
+                return response
+
+            test = module_test(module_id)
+            pool = SamplingPool(test["questions"], key=itemgetter("id"), groups={"topic": itemgetter("topic_id")})
+            test["questions"] = pool.sample(
+                size,
+                quotas={"topic": per_topic} if per_topic else None,
+                seed=request.GET.get("seed") or None,
+            )
 
             return JsonResponse(test, status=200)
 
@@ -455,6 +445,7 @@ class SubmitModuleTestAPIView(APIView):
     POST-запрос для отправки ответов теста модуля.
     Принимает JSON:
     {
+      "test_id": 12,  // необязательно: id полученного теста
       "answers": [
         {"question_id": 101, "selected_option_id": 505},
         ...
@@ -465,222 +456,51 @@ class SubmitModuleTestAPIView(APIView):
     def post(self, request, module_id):
 
         user_id = request.user_id
-        data = request.data
-        print(request.data.get("answers"))
-        answers =  request.data.get("answers", [])
+        answers = request.data.get("answers", [])
 
         if not answers:
             return JsonResponse({"error": "No answers provided"}, status=400)
 
         try:
-            # 1) Находим тест, связанный с этим модулем.
-            #    (Предполагается, что "module_id" -> таблица tests -> {test}, 
-            #     или "tests" может быть несколько. Ниже — упрощённый вариант.)
-            test_query = """
-                SELECT t.id, t.name
-                FROM tests t
-                WHERE t.module_id = %s
-            """
-            with connection.cursor() as cursor:
-                cursor.execute(test_query, [module_id])
-                test_row = cursor.fetchone()
-
+            # 1) Тот же тест, что отдаёт GET moduletest/<id>/ (справочник,
+            #    из кэша результатов)
+            test_row = execute_query(MODULE_SERVED_TEST_QUERY, [module_id], fetchone=True)
             if not test_row:
                 return JsonResponse({"error": "No test found for this module."}, status=404)
 
             test_id, test_name = test_row
-
-            # 2) Подсчитываем, сколько ответов правильных
-            #    Для этого нам нужно для каждого question_id узнать correct_answer_id,
-            #    и сравнить с selected_option_id.
-            correct_count = 0
+            if request.data.get("test_id", test_id) != test_id:
+                return JsonResponse({"error": "The module test has changed, reload it."}, status=409)
+
+            # 2) Правильные ответы всех присланных вопросов — одним запросом;
+            #    неизвестные вопросы засчитываются как неверные
+            question_ids = {answer.get("question_id") for answer in answers}
+            correct_answers = dict(execute_query(
+                CORRECT_ANSWERS_QUERY, [[q_id for q_id in question_ids if type(q_id) is int]], fetchall=True
+            ))
+            correct_count = sum(
+                1 for answer in answers
+                if answer.get("question_id") in correct_answers
+                and correct_answers[answer.get("question_id")] == answer.get("selected_option_id")
+            )
             total_questions = len(answers)
 
-            for ans in answers:
-                q_id = ans.get("question_id")
-                selected_opt = ans.get("selected_option_id")
-
-                # достаём correct_answer_id:
-                correct_query = """
-                    SELECT correct_answer_id
-                    FROM questions
-                    WHERE id = %s
-                """
-                with connection.cursor() as cursor:
-                    cursor.execute(correct_query, [q_id])
-                    row = cursor.fetchone()
-                if not row:
-                    # question не найден — пропускаем или считаем неверным
-                    continue
-
-                correct_answer_id = row[0]
-                if correct_answer_id == selected_opt:
-                    correct_count += 1
-
-            # 3) Вычисляем успешность (например, если верно >= 70%, считаем "пройден")
+            # 3) Пройден, если верно >= 70%
             score_percent = (correct_count / total_questions) * 100 if total_questions > 0 else 0
             is_passed = (score_percent >= 70.0)
 
-            # 4) Обновляем/вставляем запись в UserTestProgress
-            #    Проверяем, есть ли уже запись user_id + test_id
-            check_query = """
-                SELECT id, attempts 
-                FROM usertestprogress
-                WHERE user_id = %s AND test_id = %s
-            """
-            with connection.cursor() as cursor:
-                cursor.execute(check_query, [user_id, test_id])
-                utp_row = cursor.fetchone()
-
-            if utp_row:
-                # уже есть запись — обновим
-                utp_id, old_attempts = utp_row
-                new_attempts = old_attempts + 1
-
-                update_utp_query = """
-                    UPDATE usertestprogress
-                    SET attempts = %s,
-                        correct_answers = %s,
-                        is_passed = %s
-                    WHERE id = %s
-                """
-                with connection.cursor() as cursor:
-                    cursor.execute(update_utp_query, [new_attempts, correct_count, is_passed, utp_id])
-            else:
-                # вставляем новую запись
-                insert_utp_query = """
-                    INSERT INTO usertestprogress (user_id, test_id, attempts, correct_answers, is_passed)
-                    VALUES (%s, %s, 1, %s, %s)
-                """
-                with connection.cursor() as cursor:
-                    cursor.execute(insert_utp_query, [user_id, test_id, correct_count, is_passed])
-
-            # 5) Обновляем CourseProgress (modules_complite, completion_percentage, etc.)
-            #    Логика:  
-            #      - Посчитаем, сколько тестов в курсе всего, 
-            #        или сколько *модулей* (test_id) — "пройдено" is_passed
-            #      - modules_complite = count of usertestprogress.is_passed for user
-            #        (только те tests, которые относятся к курсу, 
-            #         если курс = набор всех modules)
-            #      - completion_percentage = (modules_complite / totalModulesInCourse) * 100
-            #      - is_complite_course = True, если modules_complite == totalModulesInCourse
-
-            #   Ниже — очень упрощённый вариант: считаем, что "course" = все modules. 
-            #   Или у вас 1 курс. 
-            #   (Если курсов несколько, нужна более сложная логика.)
-
-            # 5.1) Узнаём общее количество тестов (или модулей) 
-            #      (в примере предполагаем 4 modules => 4 tests)
-            total_mod_tests_query = """
-                SELECT count(*) 
-                FROM tests
-                WHERE module_id IN (SELECT id FROM modules)
-            """
-            with connection.cursor() as cursor:
-                cursor.execute(total_mod_tests_query)
-                total_tests = cursor.fetchone()[0] or 0
-
-            # 5.2) Узнаём, сколько tests у пользователя is_passed = true
-            passed_tests_query = """
-                SELECT count(*)
-                FROM usertestprogress
-                WHERE user_id = %s AND is_passed = true
-                AND test_id IN (SELECT id FROM tests WHERE module_id IN (SELECT id FROM modules))
-            """
-            with connection.cursor() as cursor:
-                cursor.execute(passed_tests_query, [user_id])
-                passed_count = cursor.fetchone()[0] or 0
-
-            # 5.3) Вычисляем completion_percentage
-            completion_percentage = 0.0
-            if total_tests > 0:
-                completion_percentage = (passed_count / total_tests) * 100
-
-            # 5.4) is_complite_course = completion_percentage >= 100
-            is_complite_course = (completion_percentage >= 100)
-
-            # 5.5) Обновляем/вставляем запись в CourseProgress
-            #     Проверяем, есть ли уже CourseProgress (user_id)
-            cp_query = """
-                SELECT id FROM courseprogress WHERE user_id = %s
-            """
-            with connection.cursor() as cursor:
-                cursor.execute(cp_query, [user_id])
-                cp_row = cursor.fetchone()
-
-            if cp_row:
-                cp_id = cp_row[0]
-                update_cp_query = """
-                    UPDATE courseprogress
-                    SET is_complite_course = %s,
-                        completion_percentage = %s,
-                        modules_complite = %s
-                    WHERE id = %s
-                """
-                with connection.cursor() as cursor:
-                    cursor.execute(update_cp_query, 
-                        [is_complite_course, completion_percentage, passed_count, cp_id])
-            else:
-                insert_cp_query = """
-                    INSERT INTO courseprogress (user_id, is_complite_course, completion_percentage, modules_complite)
-                    VALUES (%s, %s, %s, %s)
-                """
-                with connection.cursor() as cursor:
-                    cursor.execute(insert_cp_query, 
-                        [user_id, is_complite_course, completion_percentage, passed_count])
-
-            # 6) Дополнительно, если «все тесты текущего уровня» пройдены — повышаем уровень
-            #    Можно хранить user.level_id, 
-            #    или user -> Users.level_id. Логика может быть сложнее. 
-            #    Ниже — упрощённый пример: 
-            #      - смотрим, есть ли ещё тесты (modules) c level = user.level_id, 
-            #        все ли они "is_passed"? Если да — user.level_id += 1
-            #    (Подразумевается, что Modules хранит level_id, 
-            #    a Users хранит текущий level_id.)
-            #    Код может выглядеть так:
-
-            #   6.1) Узнаём текущий уровень пользователя
-            user_level_query = """
-                SELECT level_id
-                FROM users
-                WHERE id = %s
-            """
-            with connection.cursor() as cursor:
-                cursor.execute(user_level_query, [user_id])
-                row_ul = cursor.fetchone()
-            if row_ul:
-                current_level_id = row_ul[0]
-                if current_level_id:
-                    # Проверяем, есть ли ещё тесты (modules) с level_id = current_level_id, 
-                    # которые не пройдены.
-                    check_level_query = """
-                        SELECT count(*) 
-                        FROM tests t
-                        JOIN modules m ON t.module_id = m.id
-                        WHERE m.level_id = %s
-                          AND t.id NOT IN (
-                             SELECT test_id 
-                             FROM usertestprogress 
-                             WHERE user_id = %s AND is_passed = true
-                          )
-                    """
-                    with connection.cursor() as cursor:
-                        cursor.execute(check_level_query, [current_level_id, user_id])
-                        not_passed_count = cursor.fetchone()[0] or 0
-
-                    if not_passed_count == 0:
-                        # Все тесты этого уровня пройдены — повысить уровень
-                        # (нужно определить, как вы определяете следующий уровень: level_id + 1?)
-                        # Или искать «следующий» уровень. Упростим: +1
-                        next_level_id = current_level_id + 1
-
-                        update_level_query = """
-                            UPDATE users
-                            SET level_id = %s
-                            WHERE id = %s
-                        """
-                        with connection.cursor() as cursor:
-                            cursor.execute(update_level_query, [next_level_id, user_id])
+            # 4) Прогресс по тесту, прогресс по курсу и повышение уровня
+            #    (все тесты текущего уровня пройдены) — upsert'ами в одной
+            #    транзакции: одновременные отправки не создают дублей
+            with transaction.atomic():
+                execute_query(UPSERT_TEST_PROGRESS_QUERY, [user_id, test_id, correct_count, is_passed])
+                completion_percentage, is_complite_course = execute_query(
+                    UPSERT_COURSE_PROGRESS_QUERY, [user_id, user_id], fetchone=True
+                )
+                execute_query(PROMOTE_LEVEL_QUERY, [user_id, user_id])
+
+            # Прогресс изменился: сбрасываем ETag /progress/
+            progress_versions.bump(user_id)
 
             # Возвращаем результат
             result_data = {
@@ -694,13 +514,14 @@ class SubmitModuleTestAPIView(APIView):
             return JsonResponse(result_data, status=200)
 
         except Exception as e:
-            print("Error in SubmitModuleTest:", e)
+            logger.exception("Unable to submit module %s test", module_id)
             return JsonResponse({"error": str(e)}, status=500)
         
 
 class UserProgressAPIView(APIView):
 
     @isAuthorized
+    @method_decorator(condition(etag_func=progress_etag))
     def get(self, request):
         """
         Возвращает прогресс по курсу и тестам для текущего пользователя.
@@ -729,27 +550,24 @@ class UserProgressAPIView(APIView):
                 WHERE user_id = %s;
             """
 
-            with connection.cursor() as cursor:
-                # Получаем прогресс по курсу
-                cursor.execute(course_progress_query, [user_id])
-                course_progress_data = cursor.fetchone()
-                course_progress = {
-                    "is_complite_course": course_progress_data[0],
-                    "completion_percentage": course_progress_data[1],
-                    "modules_complite": course_progress_data[2],
-                } if course_progress_data else None
-
-                # Получаем прогресс по тестам
-                cursor.execute(tests_progress_query, [user_id])
-                tests_progress = [
-                    {
-                        "test_id": row[0],
-                        "is_passed": bool(row[1]),
-                        "attempts": row[2],
-                        "correct_answers": row[3],
-                    }
-                    for row in cursor.fetchall()
-                ]
+            # Получаем прогресс по курсу
+            course_progress_data = execute_query(course_progress_query, [user_id], fetchone=True)
+            course_progress = {
+                "is_complite_course": course_progress_data[0],
+                "completion_percentage": course_progress_data[1],
+                "modules_complite": course_progress_data[2],
+            } if course_progress_data else None
+
+            # Получаем прогресс по тестам
+            tests_progress = [
+                {
+                    "test_id": row[0],
+                    "is_passed": bool(row[1]),
+                    "attempts": row[2],
+                    "correct_answers": row[3],
+                }
+                for row in execute_query(tests_progress_query, [user_id], fetchall=True)
+            ]
 
             # Возвращаем объединённые данные
             return JsonResponse({